@@ -0,0 +1,104 @@
+from decimal import Decimal
+
+from adapters.jsonrpc import JsonRpcClient, JsonRpcError
+from domain.fees import CONF_TARGET
+from domain.types import BlockHeader, SpeedProfile
+
+SATS_PER_BTC = Decimal(100_000_000)
+RPC_INVALID_ADDRESS_OR_KEY = -5 # gettransaction de txid que a carteira nao tem
+
+
+def btc_amount(sats:int)->str:
+    #bitcoin-core aceita valores como string, o que evita arredondamento de float
+    return str((Decimal(sats) / SATS_PER_BTC).quantize(Decimal("0.00000001")))
+
+
+class BitcoinCoreAdapter:
+    """ChainPort + BtcWalletPort sobre o JSON-RPC do bitcoin-core (com batch)."""
+
+    def __init__(self, rpc:JsonRpcClient)->None:
+        self.rpc = rpc
+
+    async def get_tip_height(self)->int:
+        return await self.rpc.call("getblockcount", retry=True)
+
+    async def get_block_hash(self, height:int)->str:
+        return await self.rpc.call("getblockhash", [height], retry=True)
+
+    async def get_block_header(self, height:int)->BlockHeader:
+        block_hash = await self.get_block_hash(height)
+        header = await self.rpc.call("getblockheader", [block_hash], retry=True)
+        return BlockHeader(height, block_hash, header.get("previousblockhash", ""))
+
+    async def get_tip_header(self)->BlockHeader:
+        block_hash = await self.rpc.call("getbestblockhash", retry=True)
+        header = await self.rpc.call("getblockheader", [block_hash], retry=True)
+        return BlockHeader(header["height"], block_hash, header.get("previousblockhash", ""))
+
+    async def list_incoming(self, min_height:int, max_height:int)->list[dict]:
+        #listsinceblock da carteira watch-only com os descriptors de deposito: so o range pedido
+        since = await self.get_block_hash(min_height - 1) if min_height > 0 else ""
+        result = await self.rpc.call("listsinceblock", [since, 1, True], retry=True)
+        return [
+            {"txid": tx["txid"], "vout": tx["vout"], "address": tx["address"],
+             "amount": int(Decimal(str(tx["amount"])) * SATS_PER_BTC), "height": tx["blockheight"]}
+            for tx in result["transactions"]
+            if tx.get("category") == "receive" and min_height <= tx.get("blockheight", -1) <= max_height
+        ]
+
+    async def list_history(self, min_height:int, max_height:int)->list[dict]:
+        #listsinceblock nao tem limite superior: o range [min, tip] vem inteiro e e cortado aqui
+        since = await self.get_block_hash(min_height - 1) if min_height > 0 else ""
+        result = await self.rpc.call("listsinceblock", [since, 1, True, False], retry=True)
+        return [
+            {"txid": tx["txid"], "vout": tx["vout"], "address": tx.get("address"),
+             "amount": abs(int(Decimal(str(tx["amount"])) * SATS_PER_BTC)), "height": tx["blockheight"],
+             "direction": "in" if tx["category"] == "receive" else "out"}
+            for tx in result["transactions"]
+            if tx.get("category") in ("receive", "send") and min_height <= tx.get("blockheight", -1) <= max_height
+        ]
+
+    async def estimate_feerate(self, profile:SpeedProfile)->float:
+        result = await self.rpc.call("estimatesmartfee", [CONF_TARGET[profile], "CONSERVATIVE"], retry=True)
+        if "feerate" not in result:
+            raise JsonRpcError("estimatesmartfee", -1, "; ".join(result.get("errors", ["sem estimativa"])))
+        return float(Decimal(str(result["feerate"])) * SATS_PER_BTC / 1000) # BTC/kvB -> sat/vB
+
+    async def sign_transaction(self, inputs:list[tuple[str,int]], outputs:dict[str,int])->tuple[str,str]:
+        raw = await self.rpc.call("createrawtransaction", [
+            [{"txid": txid, "vout": vout} for txid, vout in inputs],
+            {address: btc_amount(amount) for address, amount in outputs.items()},
+            0,
+            True, # replaceable (BIP125), permite bump por RBF
+        ], retry=True)
+        signed = await self.rpc.call("signrawtransactionwithwallet", [raw], retry=True)
+        if not signed.get("complete"):
+            raise JsonRpcError("signrawtransactionwithwallet", -1, str(signed.get("errors")))
+        decoded = await self.rpc.call("decoderawtransaction", [signed["hex"]], retry=True)
+        return decoded["txid"], signed["hex"]
+
+    async def broadcast(self, raw_tx:str)->str:
+        return await self.rpc.call("sendrawtransaction", [raw_tx])
+
+    async def get_confirmations(self, txid:str)->int|None:
+        try:
+            return (await self.rpc.call("gettransaction", [txid], retry=True)).get("confirmations", 0)
+        except JsonRpcError as e:
+            if e.code == RPC_INVALID_ADDRESS_OR_KEY:
+                return None
+            raise
+
+    async def wallet_output(self, txid:str, address:str)->tuple[int,int]|None:
+        details = (await self.rpc.call("gettransaction", [txid, True], retry=True))["details"]
+        for d in details:
+            if d.get("category") == "receive" and d.get("address") == address:
+                return d["vout"], int(Decimal(str(d["amount"])) * SATS_PER_BTC)
+        return None
+
+    async def derive_addresses(self, descriptor:str, start:int, count:int)->list[str]:
+        #Uma chamada para o range inteiro (descriptor com checksum)
+        return await self.rpc.call("deriveaddresses", [descriptor, [start, start + count - 1]], retry=True)
+
+    async def descriptor_checksum(self, descriptor:str)->str:
+        info = await self.rpc.call("getdescriptorinfo", [descriptor], retry=True)
+        return f"{descriptor.split('#')[0]}#{info['checksum']}"
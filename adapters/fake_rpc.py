@@ -0,0 +1,85 @@
+import asyncio
+import json
+from typing import Any, Callable
+
+import httpx
+
+Method = Callable[[Any], Any]
+
+
+class FakeRpcServer:
+    """Servidor JSON-RPC em processo (httpx.MockTransport) para testar e medir os adapters
+    sem node. `latency` simula o custo de cada POST; `supports_batch=False` imita o
+    monero-wallet-rpc, que recusa arrays."""
+
+    def __init__(self, methods:dict[str,Method]|None=None, latency:float=0.0, supports_batch:bool=True,
+                 fail_first:int=0)->None:
+        self.methods = dict(methods or {})
+        self.latency = latency
+        self.supports_batch = supports_batch
+        self.fail_first = fail_first # primeiros N POSTs devolvem 503 (testa retry)
+        self.http_requests = 0
+        self.rpc_calls = 0
+
+    def method(self, name:str)->Callable[[Method], Method]:
+        def register(fn:Method)->Method:
+            self.methods[name] = fn
+            return fn
+        return register
+
+    def transport(self)->httpx.MockTransport:
+        return httpx.MockTransport(self._handle)
+
+    def _dispatch(self, request:dict)->dict:
+        self.rpc_calls += 1
+        fn = self.methods.get(request.get("method"))
+        if fn is None:
+            return {"jsonrpc": "2.0", "id": request.get("id"), "result": None,
+                    "error": {"code": -32601, "message": "Method not found"}}
+        try:
+            return {"jsonrpc": "2.0", "id": request.get("id"), "result": fn(request.get("params")), "error": None}
+        except Exception as exc:
+            return {"jsonrpc": "2.0", "id": request.get("id"), "result": None, "error": {"code": -1, "message": str(exc)}}
+
+    async def _handle(self, request:httpx.Request)->httpx.Response:
+        self.http_requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.http_requests <= self.fail_first:
+            return httpx.Response(503, text="indisponivel")
+        body = json.loads(request.content)
+        if isinstance(body, list):
+            if not self.supports_batch:
+                return httpx.Response(200, json={"jsonrpc": "2.0", "id": None,
+                                                  "error": {"code": -32600, "message": "batch nao suportado"}})
+            return httpx.Response(200, json=[self._dispatch(r) for r in body])
+        return httpx.Response(200, json=self._dispatch(body))
+
+
+def fake_bitcoin_core(tip:int=800_000, latency:float=0.0)->FakeRpcServer:
+    server = FakeRpcServer(latency=latency)
+    server.methods.update({
+        "getblockcount": lambda params: tip,
+        "getblockhash": lambda params: f"{params[0]:064x}",
+        "getbestblockhash": lambda params: f"{tip:064x}",
+        "getblockheader": lambda params: {"height": int(params[0], 16), "previousblockhash": f"{int(params[0], 16) - 1:064x}"},
+        "estimatesmartfee": lambda params: {"feerate": 0.0001 * 24 / params[0], "blocks": params[0]},
+        "sendrawtransaction": lambda params: "ff" * 32,
+    })
+    return server
+
+
+def fake_monero_wallet(transfers:list[dict], latency:float=0.0)->FakeRpcServer:
+    """monero-wallet-rpc com `transfers` recebidas; get_transfers imita o filter_by_height
+    real: min_height exclusivo, max_height inclusivo."""
+    server = FakeRpcServer(latency=latency, supports_batch=False)
+
+    @server.method("get_transfers")
+    def get_transfers(params:dict)->dict:
+        found = transfers
+        if params.get("filter_by_height"):
+            low, high = params.get("min_height", 0), params.get("max_height", float("inf"))
+            found = [t for t in transfers if low < t["height"] <= high]
+        return {"in": found} if params.get("in") and found else {}
+
+    return server
@@ -0,0 +1,147 @@
+import asyncio
+import itertools
+import logging
+import random
+from typing import Any
+
+import httpx
+
+from adapters.metrics import REGISTRY, timer
+
+log = logging.getLogger("adapters.jsonrpc")
+
+RPC_SECONDS = REGISTRY.histogram("rpc_call_seconds", "Latencia das chamadas JSON-RPC (inclui espera do batch)", ("method",))
+RPC_ERRORS = REGISTRY.counter("rpc_errors_total", "Chamadas JSON-RPC que falharam", ("method",))
+
+
+class JsonRpcError(Exception):
+    def __init__(self, method:str, code:int, message:str)->None:
+        super().__init__(f"{method}: [{code}] {message}")
+        self.method = method
+        self.code = code
+
+
+class JsonRpcClient:
+    """Cliente JSON-RPC assincrono com pool keep-alive, limite de concorrencia e retry.
+
+    O retry e opt-in por chamada (`retry=True`): so leituras e metodos idempotentes.
+    sendrawtransaction, create_address, transfer... saem uma vez so; se o POST falhar
+    o chamador consulta o node para saber se a chamada pegou.
+
+    Com `batch=True` as chamadas concorrentes que chegam dentro de `batch_window`
+    segundos saem num unico POST (array JSON-RPC), como o bitcoin-core aceita. O
+    monero-wallet-rpc nao aceita batch, entao ali cada chamada e um POST.
+    """
+
+    def __init__(self, url:str, auth:httpx.Auth|tuple[str,str]|None=None, *, batch:bool=False,
+                 max_batch:int=100, batch_window:float=0.002, max_connections:int=8, max_concurrency:int=32,
+                 timeout:float=10.0, retries:int=3, backoff:float=0.2, transport:httpx.AsyncBaseTransport|None=None)->None:
+        self.url = url
+        self.batch = batch
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.retries = retries
+        self.backoff = backoff
+        self._http = httpx.AsyncClient(
+            auth=auth,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            transport=transport,
+        )
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._ids = itertools.count(1)
+        self._pending:list[tuple[dict, asyncio.Future, bool]] = []
+        self._flush:asyncio.TimerHandle|None = None
+        self._inflight:set[asyncio.Task] = set()
+
+    async def aclose(self)->None:
+        await self._http.aclose()
+
+    async def call(self, method:str, params:Any=None, *, retry:bool=False)->Any:
+        with timer(RPC_SECONDS, method):
+            try:
+                return await self._call(method, params, retry)
+            except Exception:
+                RPC_ERRORS.labels(method).inc()
+                raise
+
+    async def _call(self, method:str, params:Any, retry:bool)->Any:
+        request = {"jsonrpc": "2.0", "id": next(self._ids), "method": method, "params": [] if params is None else params}
+        if not self.batch:
+            reply = await self._post(request, retry)
+            return self._result(method, reply)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((request, future, retry))
+        if len(self._pending) >= self.max_batch:
+            self._send_pending()
+        elif self._flush is None:
+            self._flush = asyncio.get_running_loop().call_later(self.batch_window, self._send_pending)
+        return self._result(method, await future)
+
+    def _send_pending(self)->None:
+        if self._flush is not None:
+            self._flush.cancel()
+            self._flush = None
+        pending, self._pending = self._pending, []
+        if pending:
+            task = asyncio.ensure_future(self._send_batch(pending))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _send_batch(self, pending:list[tuple[dict, asyncio.Future, bool]])->None:
+        #um unico metodo nao idempotente no lote ja impede o retry do POST inteiro
+        retry = all(retry for _, _, retry in pending)
+        try:
+            replies = await self._post([request for request, _, _ in pending], retry)
+        except Exception as exc:
+            for _, future, _ in pending:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        if not isinstance(replies, list):
+            #erro do lote inteiro (parse error, auth...): objeto unico em vez de array
+            error = (replies.get("error") if isinstance(replies, dict) else None) or {}
+            for request, future, _ in pending:
+                if not future.done():
+                    future.set_exception(JsonRpcError(request["method"], error.get("code", -32603),
+                                                      error.get("message", "resposta do batch nao e um array")))
+            return
+        by_id = {reply.get("id"): reply for reply in replies if isinstance(reply, dict)}
+        for request, future, _ in pending:
+            if future.done():
+                continue
+            reply = by_id.get(request["id"])
+            if reply is None:
+                future.set_exception(JsonRpcError(request["method"], -32603, "resposta ausente no batch"))
+            else:
+                future.set_result(reply)
+
+    async def _post(self, body:dict|list, retry:bool)->Any:
+        retries = self.retries if retry else 0
+        async with self._slots:
+            for attempt in range(retries + 1):
+                try:
+                    response = await self._http.post(self.url, json=body)
+                    #bitcoin-core responde 500 com corpo JSON-RPC em erros de metodo
+                    if response.status_code >= 500 and not _is_rpc_body(response):
+                        response.raise_for_status()
+                    return response.json()
+                except (httpx.TransportError, httpx.HTTPStatusError) as exc:
+                    if attempt == retries:
+                        raise
+                    #backoff exponencial com jitter total
+                    delay = random.uniform(0, self.backoff * 2 ** attempt)
+                    log.warning("rpc %s falhou (%s), nova tentativa em %.2fs", self.url, exc, delay)
+                    await asyncio.sleep(delay)
+
+    @staticmethod
+    def _result(method:str, reply:dict)->Any:
+        error = reply.get("error")
+        if error:
+            raise JsonRpcError(method, error.get("code", -1), error.get("message", ""))
+        return reply.get("result")
+
+
+def _is_rpc_body(response:httpx.Response)->bool:
+    return response.headers.get("content-type", "").startswith("application/json")
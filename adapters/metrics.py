@@ -0,0 +1,265 @@
+"""Metricas em memoria expostas no formato texto do Prometheus, sem dependencia externa.
+
+Com METRICS_ENABLED=0 `timed` devolve a propria funcao e `timer`/`labels` devolvem
+objetos vazios, entao a instrumentacao nos hot paths fica praticamente de graca.
+"""
+import asyncio
+import functools
+import inspect
+import logging
+import os
+import time
+from bisect import bisect_left
+from typing import Awaitable, Callable
+
+log = logging.getLogger("metrics")
+
+ENABLED = os.getenv("METRICS_ENABLED", "1").lower() not in ("0", "false", "no")
+
+#segundos: chamadas rapidas (RPC, UPDATE) e atrasos de minutos/horas (confirmacao, payout)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LAG_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200, 21600, 86400)
+
+
+class _Noop:
+    #filho/timer usado quando as metricas estao desligadas
+    __slots__ = ()
+
+    def inc(self, amount:float=1)->None: pass
+    def dec(self, amount:float=1)->None: pass
+    def set(self, value:float)->None: pass
+    def observe(self, value:float)->None: pass
+    def __enter__(self): return self
+    def __exit__(self, *exc)->None: pass
+
+
+_NOOP = _Noop()
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self)->None:
+        self.value = 0.0
+
+    def inc(self, amount:float=1)->None:
+        self.value += amount
+
+    def dec(self, amount:float=1)->None:
+        self.value -= amount
+
+    def set(self, value:float)->None:
+        self.value = value
+
+
+class _Buckets:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds:tuple[float, ...])->None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value:float)->None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _escape(value)->str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(names:tuple[str, ...], values:tuple)->str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name:str, help:str, labelnames:tuple[str, ...]=())->None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children:dict[tuple,object] = {}
+
+    def _new(self):
+        return _Value()
+
+    def labels(self, *values):
+        if not ENABLED:
+            return _NOOP
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name}: esperava labels {self.labelnames}")
+            child = self._children[values] = self._new()
+        return child
+
+    def render(self)->list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self._children.items()):
+            lines.append(f"{self.name}{_fmt_labels(self.labelnames, values)} {child.value}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name:str, help:str, labelnames:tuple[str, ...]=(), buckets:tuple[float, ...]=LATENCY_BUCKETS)->None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new(self):
+        return _Buckets(self.buckets)
+
+    def render(self)->list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), child.counts):
+                cumulative += count
+                labels = _fmt_labels((*self.labelnames, "le"), (*values, bound))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labelnames, values)} {child.sum}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labelnames, values)} {child.count}")
+        return lines
+
+
+Collector = Callable[[], Awaitable[None]|None]
+
+
+class Registry:
+    def __init__(self)->None:
+        self._metrics:dict[str,Metric] = {}
+        self._collectors:list[Collector] = []
+
+    def _register(self, metric:Metric)->Metric:
+        #mesmo nome devolve a mesma metrica (modulos importados pela API e pelo worker)
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name:str, help:str, labelnames:tuple[str, ...]=())->Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name:str, help:str, labelnames:tuple[str, ...]=())->Gauge:
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(self, name:str, help:str, labelnames:tuple[str, ...]=(), buckets:tuple[float, ...]=LATENCY_BUCKETS)->Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def collector(self, fn:Collector)->Collector:
+        #roda a cada scrape para atualizar gauges caros (profundidade de fila, pool do banco)
+        self._collectors.append(fn)
+        return fn
+
+    async def render(self)->str:
+        for fn in self._collectors:
+            try:
+                result = fn()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                log.warning("collector %s falhou", getattr(fn, "__name__", fn), exc_info=True)
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Timer:
+    __slots__ = ("child", "t0")
+
+    def __init__(self, child)->None:
+        self.child = child
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc)->None:
+        self.child.observe(time.perf_counter() - self.t0)
+
+
+def timer(histogram:Histogram, *labels):
+    """with timer(RPC_SECONDS, "getblockhash"): ..."""
+    return _Timer(histogram.labels(*labels)) if ENABLED else _NOOP
+
+
+def timed(histogram:Histogram, *labels):
+    """Decorator para funcoes sync ou async; desligado, devolve a funcao sem wrapper."""
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+        child = histogram.labels(*labels)
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                t0 = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    child.observe(time.perf_counter() - t0)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - t0)
+        return wrapper
+    return decorate
+
+
+#Metricas compartilhadas entre API e worker
+TRANSITION_SECONDS = REGISTRY.histogram(
+    "escrow_transition_seconds", "Duracao do statement que muda o estado do escrow", ("transition",))
+TRANSITIONS = REGISTRY.counter("escrow_transitions_total", "Escrows que mudaram de estado", ("transition",))
+DB_POOL = REGISTRY.gauge("db_pool_connections", "Conexoes do pool do SQLAlchemy por estado", ("pool", "state"))
+
+
+def track_pool(engine, name:str)->None:
+    #aceita Engine ou AsyncEngine; QueuePool expoe size/checkedout/overflow
+    pool = getattr(engine, "sync_engine", engine).pool
+
+    @REGISTRY.collector
+    def collect_pool()->None:
+        if not hasattr(pool, "checkedout"):
+            return
+        DB_POOL.labels(name, "size").set(pool.size())
+        DB_POOL.labels(name, "checked_out").set(pool.checkedout())
+        DB_POOL.labels(name, "idle").set(pool.checkedin())
+        DB_POOL.labels(name, "overflow").set(max(pool.overflow(), 0))
+
+
+async def serve(registry:Registry, host:str, port:int)->asyncio.AbstractServer:
+    """HTTP minimo (GET /metrics) para processos sem framework web, como o worker."""
+    async def handle(reader:asyncio.StreamReader, writer:asyncio.StreamWriter)->None:
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            if request_line.split(b" ")[1:2] == [b"/metrics"]:
+                body, status = (await registry.render()).encode(), b"200 OK"
+            else:
+                body, status = b"not found\n", b"404 Not Found"
+            writer.write(b"HTTP/1.1 " + status + b"\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                         + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        finally:
+            writer.close()
+    return await asyncio.start_server(handle, host, port)
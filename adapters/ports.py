@@ -0,0 +1,56 @@
+from typing import Protocol
+
+from domain.types import BlockHeader, SpeedProfile
+
+
+class ChainPort(Protocol):
+    #Altura do bloco mais recente visto pelo node (tip)
+    async def get_tip_height(self)->int: ...
+
+    async def get_block_hash(self, height:int)->str: ...
+
+    async def get_block_header(self, height:int)->BlockHeader: ...
+
+    async def get_tip_header(self)->BlockHeader: ...
+
+    #Saidas recebidas nos destinos vigiados entre as alturas (inclusive), no formato do
+    #payload DEPOSIT dos webhooks: {txid, vout, address, amount, height}
+    async def list_incoming(self, min_height:int, max_height:int)->list[dict]: ...
+
+
+class WalletHistoryPort(Protocol):
+    #Historico confirmado da carteira entre as alturas (inclusive), entradas e saidas, para a
+    #conciliacao: {txid, vout, address, amount (>0), height, direction: "in" | "out"}
+    async def list_history(self, min_height:int, max_height:int)->list[dict]: ...
+
+
+class BtcWalletPort(Protocol):
+    async def estimate_feerate(self, profile:SpeedProfile)->float: ... # sat/vB
+
+    #Monta e assina a tx com a carteira do worker; devolve (txid, hex assinado)
+    async def sign_transaction(self, inputs:list[tuple[str,int]], outputs:dict[str,int])->tuple[str,str]: ...
+
+    async def broadcast(self, raw_tx:str)->str: ...
+
+    #Confirmacoes de uma tx da carteira (0 = mempool, negativo = conflitada/substituida,
+    #None = a carteira nao conhece: assinada e nunca aceita pelo node)
+    async def get_confirmations(self, txid:str)->int|None: ...
+
+    #(vout, valor) da saida de `txid` para `address` se a carteira controla o endereco (para CPFP)
+    async def wallet_output(self, txid:str, address:str)->tuple[int,int]|None: ...
+
+
+class XmrWalletPort(Protocol):
+    async def estimate_fee(self, profile:SpeedProfile|None=None)->float: ... # atomic/byte
+
+    #Cria `count` subaddresses numa chamada; devolve [(address, subaddr_index)]
+    async def create_subaddresses(self, account_index:int, count:int)->list[tuple[str,int]]: ...
+
+    async def get_incoming_transfers(self, min_height:int, max_height:int|None=None)->list[dict]: ...
+
+
+class AddressSource(Protocol):
+    #chave do meta que guarda o indice (para retomar a partir do maior ja gerado)
+    meta_key:str
+
+    async def generate(self, start:int, count:int)->list[tuple[str,dict]]: ...
@@ -1,8 +1,67 @@
-import os
+import asyncio, os, sys
+from contextlib import asynccontextmanager, suppress
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+
+from adapters.metrics import REGISTRY, track_pool
+from api.escrows import router as escrows_router
+from api.webhooks import router as webhooks_router
+from api.idempotency import IdempotencyStore
+from db.escrow_view import EscrowViewCache
+from db.session import make_async_engine, make_async_sessionmaker
+from domain.fees import FeeOracle, redis_estimator
+from domain.types import Asset
+from worker.runtime import redis_from_env
+from worker.scheduler import DeadlineScheduler, dispute_scheduler
+
+
+@asynccontextmanager
+async def lifespan(app:FastAPI):
+    engine = make_async_engine()
+    track_pool(engine, "api")
+    redis = redis_from_env()
+    app.state.Session = make_async_sessionmaker(engine)
+    app.state.idempotency = IdempotencyStore(redis)
+    app.state.scheduler = DeadlineScheduler(redis)
+    app.state.dispute_windows = dispute_scheduler(redis)
+    app.state.views = EscrowViewCache(redis)
+    app.state.views.install(asyncio.get_running_loop())
+    #taxas publicadas pelo worker no Redis; cotar um escrow nunca chama o node
+    app.state.fees = FeeOracle({a: redis_estimator(redis, a) for a in Asset}, ttl=float(os.getenv("FEE_REFRESH_SECONDS", "30")))
+    stopping = asyncio.Event()
 
-app = FastAPI()
+    async def sleep(seconds:float)->None:
+        #acorda no shutdown em vez de esperar o ttl inteiro
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(stopping.wait(), timeout=seconds)
+
+    await app.state.fees.refresh()
+    fees_task = asyncio.create_task(app.state.fees.run(stopping.is_set, sleep))
+    try:
+        yield
+    finally:
+        stopping.set()
+        #refresh em andamento termina; preso alem disso e cancelado
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(fees_task, timeout=5)
+        await redis.aclose()
+        await engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
+app.include_router(escrows_router)
+app.include_router(webhooks_router)
 
 @app.get("/health")
 def health():
-    return {"ok":True}
\ No newline at end of file
+    return {"ok":True}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(await REGISTRY.render(), media_type="text/plain; version=0.0.4")
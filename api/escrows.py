@@ -0,0 +1,318 @@
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel, Field
+from sqlalchemy import and_, exists, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from adapters.metrics import TRANSITION_SECONDS, TRANSITIONS, timer
+from api.idempotency import IdempotencyConflict, hash_request
+from db.archive import archive_dir, find_archived, read_archived
+from db.destination_pool import DestinationPoolEmpty, claim_destination
+from db.escrow_bulk import create_escrows, escrow_row
+from db.escrow_transitions import TransitionConflict, transition
+from db.escrow_view import archived_view, encode_view, escrow_fields, load_view
+from db.models import Dispute, Escrow, EscrowDestination
+from db.outbox import emit, escrow_event
+from domain.state_machine import Event
+from domain.types import Asset, DisputeStatus, EscrowState, Role, SpeedProfile
+
+router = APIRouter(prefix="/escrows")
+
+DISPUTE_WINDOW = timedelta(hours=72) # dispute_deadline = delivered_at + 72h
+AUTO_RELEASE_AFTER = timedelta(days=7) # auto_release_at = delivered_at + 7d
+BULK_MAX_ITEMS = int(os.getenv("ESCROW_BULK_MAX_ITEMS", "1000"))
+
+
+class CreateEscrow(BaseModel):
+    asset:Asset
+    price:int
+    seller_payout_address:str
+    buyer_payout_address:str|None = None
+    payout_speed_profile:SpeedProfile|None = None
+
+
+class BulkEscrowItem(CreateEscrow):
+    #mesma chave/corpo de um POST /escrows: retry item a item ou pela rota unitaria devolve o mesmo escrow
+    idempotency_key:str|None = None
+
+
+class CreateEscrows(BaseModel):
+    items:list[BulkEscrowItem] = Field(min_length=1, max_length=BULK_MAX_ITEMS)
+
+
+class OpenDispute(BaseModel):
+    opened_by:Role
+    reason:str
+    evidence_url:str|None = None
+
+
+async def get_session(request:Request):
+    #uma sessao (e uma conexao do pool) por requisicao
+    async with request.app.state.Session() as session:
+        yield session
+
+
+def escrow_view(escrow:Escrow, destination:str|None)->dict:
+    return jsonable_encoder(escrow_fields(escrow, destination))
+
+
+async def idempotent(request:Request, session:AsyncSession, endpoint:str, key:str|None, payload:dict,
+                     operation:Callable[[], Awaitable[dict]],
+                     after_commit:Callable[[], Awaitable[None]]|None=None)->dict:
+    #operacao + gravacao da chave na mesma transacao; o Redis so e preenchido apos o commit
+    store = request.app.state.idempotency
+    request_hash = hash_request(payload)
+    try:
+        if key is not None:
+            replay = await store.lookup(session, key, endpoint, request_hash)
+            if replay is not None:
+                return replay
+        response = await operation()
+        expires_at = await store.store(session, key, endpoint, request_hash, response) if key is not None else None
+    except IdempotencyConflict as e:
+        raise HTTPException(409, str(e))
+    await session.commit()
+    #o GET logo depois da resposta nao pode pegar a view de antes do commit
+    await request.app.state.views.settle(session)
+    if key is not None:
+        await store.remember(key, endpoint, request_hash, response, expires_at)
+    if after_commit is not None:
+        await after_commit()
+    return response
+
+
+async def _load(session:AsyncSession, escrow_id:int)->tuple[Escrow,str|None]:
+    row = (await session.execute(
+        select(Escrow, EscrowDestination.destination)
+        .outerjoin(EscrowDestination, and_(EscrowDestination.escrow_id == Escrow.id, EscrowDestination.active.is_(True)))
+        .where(Escrow.id == escrow_id)
+    )).first()
+    if row is None:
+        raise HTTPException(404, "escrow nao encontrado")
+    return row[0], row[1]
+
+
+def _expected_version(if_match:str|None)->int|None:
+    #If-Match com o ETag do GET ("<version>-<hash>"): a transicao so aplica sobre essa versao
+    if if_match is None or if_match.strip() == "*":
+        return None
+    versions = set()
+    for tag in if_match.split(","):
+        version, _, _ = tag.strip().removeprefix("W/").strip('"').partition("-")
+        if not version.isdigit():
+            raise HTTPException(400, f"If-Match invalido: {tag.strip()}")
+        versions.add(int(version))
+    if len(versions) != 1:
+        raise HTTPException(412, "If-Match com mais de uma versao")
+    return versions.pop()
+
+
+async def _transition(session:AsyncSession, escrow_id:int, event:Event, action:str, where:tuple=(),
+                      values:dict|None=None, version:int|None=None)->Escrow:
+    #UPDATE condicional do state machine: se nao bateu, distingue 404, versao velha (412) e estado invalido/linha em uso
+    try:
+        return await session.run_sync(transition, escrow_id, event, where=where, values=values, version=version)
+    except TransitionConflict as e:
+        current, _ = await _load(session, escrow_id)
+        if version is not None and current.version != version:
+            raise HTTPException(412, f"escrow {escrow_id} esta na versao {current.version}, nao {version}") from e
+        raise HTTPException(409, f"escrow {escrow_id} em {current.state.value} nao permite {action}") from e
+
+
+async def _destination(session:AsyncSession, escrow_id:int)->str|None:
+    return await session.scalar(
+        select(EscrowDestination.destination)
+        .where(EscrowDestination.escrow_id == escrow_id, EscrowDestination.active.is_(True))
+    )
+
+
+async def _cancel_deadlines(request:Request, escrow_id:int, asset:Asset)->None:
+    await request.app.state.scheduler.cancel(escrow_id, asset)
+    await request.app.state.dispute_windows.cancel(escrow_id, asset)
+
+
+def _no_open_dispute():
+    return ~exists().where(Dispute.escrow_id == Escrow.id, Dispute.status == DisputeStatus.OPEN)
+
+
+@router.post("", status_code=201)
+async def create_escrow(body:CreateEscrow, request:Request, session:AsyncSession=Depends(get_session),
+                        idempotency_key:str|None=Header(None))->dict:
+    async def operation()->dict:
+        try:
+            amounts = request.app.state.fees.quote(body.asset, body.price, body.payout_speed_profile)
+        except ValueError as e:
+            raise HTTPException(422, str(e))
+        escrow = Escrow(
+            asset=body.asset, price=amounts.price, platform_fee=amounts.platform_fee, fn_est=amounts.fn_est,
+            buffer=amounts.buffer, deposit_total=amounts.deposit_total, state=EscrowState.CREATED,
+            seller_payout_address=body.seller_payout_address, buyer_payout_address=body.buyer_payout_address,
+            payout_speed_profile=body.payout_speed_profile,
+        )
+        try:
+            with timer(TRANSITION_SECONDS, "->CREATED"):
+                session.add(escrow)
+                await session.flush()
+                destination, _ = await session.run_sync(claim_destination, body.asset, escrow.id)
+                await session.run_sync(emit, [escrow_event("escrow.created", escrow)])
+        except DestinationPoolEmpty as e:
+            raise HTTPException(503, str(e))
+        TRANSITIONS.labels("->CREATED").inc()
+        return escrow_view(escrow, destination)
+    return await idempotent(request, session, "POST /escrows", idempotency_key, body.model_dump(mode="json"), operation)
+
+
+@router.post("/bulk")
+async def create_escrows_bulk(body:CreateEscrows, request:Request, session:AsyncSession=Depends(get_session),
+                              idempotency_key:str|None=Header(None))->dict:
+    """Lote de criacoes numa transacao. Resultado por item, na ordem do pedido: 201 criado,
+    200 replay de idempotency_key ja usada, 409 chave com outro corpo, 422 invalido. Itens
+    invalidos nao derrubam os outros; pool sem enderecos para o lote todo e 503 para o lote."""
+    store = request.app.state.idempotency
+    endpoint = "POST /escrows"
+    remembered:list[tuple[list[tuple[str,str,dict]],datetime]] = []
+
+    async def operation()->dict:
+        items = body.items
+        hashes = [hash_request(item.model_dump(mode="json", exclude={"idempotency_key"})) for item in items]
+        keys = list(dict.fromkeys(item.idempotency_key for item in items if item.idempotency_key is not None))
+        known = await store.lookup_many(session, keys, endpoint) if keys else {}
+        quotes = request.app.state.fees.quote_many((item.asset, item.price, item.payout_speed_profile) for item in items)
+
+        results:list[dict|None] = [None] * len(items)
+        pending:list[int] = []
+        first:dict[str,int] = {} # chave -> item que vai criar; repeticoes no lote viram replay dele
+        for i, (item, quote) in enumerate(zip(items, quotes)):
+            key = item.idempotency_key
+            if key is not None and (key in known or key in first):
+                stored_hash = known[key][0] if key in known else hashes[first[key]]
+                if stored_hash != hashes[i]:
+                    results[i] = {"index": i, "status": 409, "error": "Idempotency-Key ja usada com outra requisicao"}
+                elif key in known:
+                    results[i] = {"index": i, "status": 200, "escrow": known[key][1]}
+                continue
+            if isinstance(quote, ValueError):
+                results[i] = {"index": i, "status": 422, "error": str(quote)}
+                continue
+            if key is not None:
+                first[key] = i
+            pending.append(i)
+
+        rows = [escrow_row(items[i].asset, quotes[i], items[i].seller_payout_address, items[i].buyer_payout_address,
+                           items[i].payout_speed_profile) for i in pending]
+        try:
+            with timer(TRANSITION_SECONDS, "->CREATED"):
+                created = await session.run_sync(create_escrows, rows)
+        except DestinationPoolEmpty as e:
+            raise HTTPException(503, str(e))
+        TRANSITIONS.labels("->CREATED").inc(len(created))
+        for i, (escrow, destination) in zip(pending, created):
+            results[i] = {"index": i, "status": 201, "escrow": escrow_view(escrow, destination)}
+        for i, item in enumerate(items):
+            if results[i] is None:
+                results[i] = {"index": i, "status": 200, "escrow": results[first[item.idempotency_key]]["escrow"]}
+
+        entries = [(items[i].idempotency_key, hashes[i], results[i]["escrow"]) for i in first.values()]
+        if entries:
+            remembered.append((entries, await store.store_many(session, endpoint, entries)))
+        counts = {status: sum(1 for r in results if r["status"] == status) for status in (201, 200, 409, 422)}
+        return {"created": counts[201], "replayed": counts[200], "failed": counts[409] + counts[422], "items": results}
+
+    async def after_commit()->None:
+        for entries, expires_at in remembered:
+            await store.remember_many(endpoint, entries, expires_at)
+
+    return await idempotent(request, session, "POST /escrows/bulk", idempotency_key, body.model_dump(mode="json"),
+                            operation, after_commit)
+
+
+@router.get("/{escrow_id}")
+async def get_escrow(escrow_id:int, request:Request, session:AsyncSession=Depends(get_session),
+                     if_none_match:str|None=Header(None)):
+    #polling: view pronta no Redis (invalidada apos cada commit que toca o escrow); 304 se o ETag nao mudou
+    views = request.app.state.views
+    cached, gen = await views.get(escrow_id)
+    if cached is None:
+        view = await session.run_sync(load_view, escrow_id)
+        if view is None:
+            #CLOSED ja arquivado: mesma view, montada do documento do arquivo e cacheada como as outras
+            entry = await session.run_sync(find_archived, escrow_id)
+            if entry is None:
+                raise HTTPException(404, "escrow nao encontrado")
+            view = archived_view(await asyncio.to_thread(read_archived, archive_dir(), entry))
+        cached = encode_view(view)
+        await views.put(escrow_id, gen, *cached)
+    etag, body = cached
+    if if_none_match is not None and etag in (t.strip() for t in if_none_match.split(",")):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(body, media_type="application/json", headers={"ETag": etag})
+
+
+@router.post("/{escrow_id}/delivered")
+async def mark_delivered(escrow_id:int, request:Request, session:AsyncSession=Depends(get_session),
+                         idempotency_key:str|None=Header(None), if_match:str|None=Header(None))->dict:
+    version = _expected_version(if_match)
+    async def operation()->dict:
+        now = datetime.now(timezone.utc)
+        escrow = await _transition(
+            session, escrow_id, Event.DELIVER, "marcar entrega",
+            where=(Escrow.delivered_at.is_(None),),
+            values={"delivered_at": now, "dispute_deadline": now + DISPUTE_WINDOW, "auto_release_at": now + AUTO_RELEASE_AFTER},
+            version=version,
+        )
+        return escrow_view(escrow, await _destination(session, escrow_id))
+    endpoint = f"POST /escrows/{escrow_id}/delivered"
+    response = await idempotent(request, session, endpoint, idempotency_key, {}, operation)
+    #ZADD com o mesmo score: repetir num replay e inofensivo
+    asset = Asset(response["asset"])
+    await request.app.state.scheduler.schedule(escrow_id, asset, datetime.fromisoformat(response["auto_release_at"]))
+    await request.app.state.dispute_windows.schedule(escrow_id, asset, datetime.fromisoformat(response["dispute_deadline"]))
+    return response
+
+
+@router.post("/{escrow_id}/release")
+async def release(escrow_id:int, request:Request, session:AsyncSession=Depends(get_session),
+                  idempotency_key:str|None=Header(None), if_match:str|None=Header(None))->dict:
+    version = _expected_version(if_match)
+    async def operation()->dict:
+        escrow = await _transition(session, escrow_id, Event.RELEASE, "liberar", where=(_no_open_dispute(),), version=version)
+        return escrow_view(escrow, await _destination(session, escrow_id))
+    endpoint = f"POST /escrows/{escrow_id}/release"
+    response = await idempotent(request, session, endpoint, idempotency_key, {}, operation)
+    await _cancel_deadlines(request, escrow_id, Asset(response["asset"]))
+    return response
+
+
+@router.post("/{escrow_id}/disputes", status_code=201)
+async def open_dispute(escrow_id:int, body:OpenDispute, request:Request, session:AsyncSession=Depends(get_session),
+                       idempotency_key:str|None=Header(None), if_match:str|None=Header(None))->dict:
+    version = _expected_version(if_match)
+    async def operation()->dict:
+        now = datetime.now(timezone.utc)
+        escrow = await _transition(
+            session, escrow_id, Event.DISPUTE, "abrir disputa",
+            where=((Escrow.dispute_deadline.is_(None)) | (Escrow.dispute_deadline >= now),),
+            version=version,
+        )
+        dispute = Dispute(escrow_id=escrow_id, opened_by=body.opened_by, reason=body.reason,
+                          evidence_url=body.evidence_url, status=DisputeStatus.OPEN, price_at_open=escrow.price, opened_at=now)
+        session.add(dispute)
+        try:
+            await session.flush()
+        except IntegrityError:
+            raise HTTPException(409, f"escrow {escrow_id} ja tem disputa aberta")
+        return jsonable_encoder({
+            "id": dispute.id, "escrow_id": escrow_id, "asset": escrow.asset, "status": dispute.status,
+            "opened_by": dispute.opened_by, "reason": dispute.reason, "evidence_url": dispute.evidence_url,
+            "price_at_open": dispute.price_at_open, "opened_at": dispute.opened_at,
+        })
+    endpoint = f"POST /escrows/{escrow_id}/disputes"
+    response = await idempotent(request, session, endpoint, idempotency_key, body.model_dump(mode="json"), operation)
+    await _cancel_deadlines(request, escrow_id, Asset(response["asset"]))
+    return response
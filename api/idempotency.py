@@ -0,0 +1,111 @@
+import hashlib
+import json
+from datetime import datetime, timedelta, timezone
+
+from redis.asyncio import Redis
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import idempotency as db_idempotency
+
+DEFAULT_TTL = timedelta(hours=24)
+
+
+class IdempotencyConflict(Exception):
+    #Mesma Idempotency-Key reutilizada com outro corpo de requisicao
+    pass
+
+
+def hash_request(payload:dict)->str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str).encode()).hexdigest()
+
+
+class IdempotencyStore:
+    """Idempotencia em duas camadas: Redis na frente (request_hash + response_snapshot
+    com TTL derivado de expires_at) e idempotency_keys no Postgres como fonte duravel.
+
+    Replays respondem direto do Redis; no miss o Postgres e consultado e o Redis e
+    reaquecido. A gravacao no Postgres acontece na transacao da propria operacao
+    (`store`) e o Redis so e preenchido depois do commit (`remember`).
+    """
+
+    def __init__(self, redis:Redis, ttl:timedelta=DEFAULT_TTL, prefix:str="idem")->None:
+        self.redis = redis
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _key(self, key:str, endpoint:str)->str:
+        return f"{self.prefix}:{endpoint}:{key}"
+
+    def expires_at(self)->datetime:
+        return datetime.now(timezone.utc) + self.ttl
+
+    async def lookup(self, session:AsyncSession, key:str, endpoint:str, request_hash:str)->dict|None:
+        cached = await self.redis.get(self._key(key, endpoint))
+        if cached is not None:
+            entry = json.loads(cached)
+            return self._check(entry["request_hash"], entry["response"], request_hash)
+
+        found = await session.run_sync(db_idempotency.find, key, endpoint)
+        if found is None:
+            return None
+        stored_hash, response, expires_at = found
+        await self.remember(key, endpoint, stored_hash, response, expires_at)
+        return self._check(stored_hash, response, request_hash)
+
+    async def lookup_many(self, session:AsyncSession, keys:list[str], endpoint:str)->dict[str,tuple[str,dict]]:
+        #lookup de lote: MGET no Redis, um SELECT para os misses; devolve key -> (request_hash, response)
+        cached = await self.redis.mget([self._key(k, endpoint) for k in keys])
+        found:dict[str,tuple[str,dict]] = {}
+        missing = []
+        for key, raw in zip(keys, cached):
+            if raw is None:
+                missing.append(key)
+            else:
+                entry = json.loads(raw)
+                found[key] = (entry["request_hash"], entry["response"])
+        if missing:
+            stored = await session.run_sync(db_idempotency.find_many, missing, endpoint)
+            for key, (stored_hash, response, expires_at) in stored.items():
+                found[key] = (stored_hash, response)
+                await self.remember(key, endpoint, stored_hash, response, expires_at)
+        return found
+
+    async def store(self, session:AsyncSession, key:str, endpoint:str, request_hash:str, response:dict,
+                    expires_at:datetime|None=None)->datetime:
+        expires_at = expires_at or self.expires_at()
+        if not await session.run_sync(db_idempotency.store, key, endpoint, request_hash, response, expires_at):
+            raise IdempotencyConflict(f"requisicao concorrente com a mesma chave {key}")
+        return expires_at
+
+    async def store_many(self, session:AsyncSession, endpoint:str, entries:list[tuple[str,str,dict]],
+                         expires_at:datetime|None=None)->datetime:
+        #entries: (key, request_hash, response); qualquer chave perdida para outra requisicao derruba a transacao
+        expires_at = expires_at or self.expires_at()
+        stored = await session.run_sync(db_idempotency.store_many, endpoint, entries, expires_at)
+        lost = sorted({key for key, _, _ in entries} - stored)
+        if lost:
+            raise IdempotencyConflict(f"requisicao concorrente com as mesmas chaves {', '.join(lost[:5])}")
+        return expires_at
+
+    async def remember_many(self, endpoint:str, entries:list[tuple[str,str,dict]], expires_at:datetime)->None:
+        seconds = int((expires_at - datetime.now(timezone.utc)).total_seconds())
+        if seconds <= 0 or not entries:
+            return
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key, request_hash, response in entries:
+                pipe.set(self._key(key, endpoint), json.dumps({"request_hash": request_hash, "response": response}, default=str), ex=seconds)
+            await pipe.execute()
+
+    async def remember(self, key:str, endpoint:str, request_hash:str, response:dict, expires_at:datetime|None)->None:
+        ttl = (expires_at - datetime.now(timezone.utc)) if expires_at else self.ttl
+        seconds = int(ttl.total_seconds())
+        if seconds <= 0:
+            return
+        entry = json.dumps({"request_hash": request_hash, "response": response}, default=str)
+        await self.redis.set(self._key(key, endpoint), entry, ex=seconds)
+
+    @staticmethod
+    def _check(stored_hash:str, response:dict, request_hash:str)->dict:
+        if stored_hash != request_hash:
+            raise IdempotencyConflict("Idempotency-Key ja usada com outra requisicao")
+        return response
@@ -0,0 +1,34 @@
+import hmac
+import os
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from api.escrows import get_session
+from domain.types import Asset
+from worker.webhooks import record_event
+
+router = APIRouter(prefix="/webhooks")
+
+
+def _check_token(token:str|None)->None:
+    #segredo compartilhado com o watcher; sem WEBHOOK_TOKEN a ingestao fica desligada
+    expected = os.getenv("WEBHOOK_TOKEN", "")
+    if not expected:
+        raise HTTPException(503, "ingestao de webhooks desabilitada")
+    if token is None or not hmac.compare_digest(token, expected):
+        raise HTTPException(401, "token de webhook invalido")
+
+
+@router.post("/{asset}/{kind}", status_code=202)
+async def ingest(asset:Asset, kind:str, payload:dict, response:Response, session:AsyncSession=Depends(get_session),
+                 idempotency_key:str=Header(...), x_webhook_token:str|None=Header(None))->dict:
+    """Enfileira o webhook em webhook_events para o WebhookConsumerPool. Reentrega com a mesma
+    Idempotency-Key (por kind) responde 200 sem gravar de novo."""
+    _check_token(x_webhook_token)
+    event_id = await session.run_sync(record_event, asset.value, kind.upper(), idempotency_key, payload)
+    await session.commit()
+    if event_id is None:
+        response.status_code = 200
+        return {"duplicate": True}
+    return {"id": event_id, "duplicate": False}
@@ -0,0 +1,83 @@
+"""Carga na API de escrows: requisicoes/s e latencia p50/p99 por endpoint.
+
+Cria escrows, le, marca FUNDED direto no banco (--fund, precisa do .env do Postgres) e
+exercita delivered / disputes / release com `--concurrency` clientes simultaneos.
+
+    python bench/bench_api.py --url http://localhost:8000 --requests 2000 --concurrency 64 --fund
+"""
+import argparse, asyncio, statistics, sys, time, uuid
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+import httpx
+
+
+def percentile(samples:list[float], q:float)->float:
+    if len(samples) < 2:
+        return samples[0] if samples else 0.0
+    return statistics.quantiles(samples, n=100, method="inclusive")[int(q) - 1]
+
+
+async def load(client:httpx.AsyncClient, label:str, calls:list, concurrency:int)->list[httpx.Response]:
+    #calls: [(method, path, json)]; cada cliente pega a proxima da fila
+    latencies:list[float] = []
+    responses:list[httpx.Response|None] = [None] * len(calls)
+    cursor = iter(range(len(calls)))
+
+    async def client_loop()->None:
+        for i in cursor:
+            method, path, body = calls[i]
+            t0 = time.perf_counter()
+            responses[i] = await client.request(method, path, json=body, headers={"Idempotency-Key": uuid.uuid4().hex})
+            latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - t0
+    errors = sum(1 for r in responses if r.status_code >= 400)
+    print(f"{label:<10} {len(calls) / elapsed:>8,.0f} req/s  p50 {percentile(latencies, 50) * 1000:6.1f} ms  "
+          f"p99 {percentile(latencies, 99) * 1000:6.1f} ms  erros {errors}")
+    return responses
+
+
+def fund(ids:list[int])->None:
+    from sqlalchemy import update
+    from db.models import Escrow
+    from db.session import make_engine, make_sessionmaker
+    from domain.types import EscrowState
+    with make_sessionmaker(make_engine()).begin() as session:
+        session.execute(update(Escrow).where(Escrow.id.in_(ids)).values(state=EscrowState.FUNDED))
+
+
+async def run(args)->None:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30.0) as client:
+        body = {"asset": "BTC", "price": 100_000, "seller_payout_address": "tb1qseller", "payout_speed_profile": "normal"}
+        created = await load(client, "create", [("POST", "/escrows", body)] * args.requests, args.concurrency)
+        ids = [r.json()["id"] for r in created if r.status_code == 201]
+        await load(client, "get", [("GET", f"/escrows/{i}", None) for i in ids], args.concurrency)
+        if not args.fund or not ids:
+            return
+        fund(ids)
+        half = len(ids) // 2
+        await load(client, "delivered", [("POST", f"/escrows/{i}/delivered", None) for i in ids], args.concurrency)
+        dispute = {"opened_by": "BUYER", "reason": "bench"}
+        await load(client, "dispute", [("POST", f"/escrows/{i}/disputes", dispute) for i in ids[:half]], args.concurrency)
+        await load(client, "release", [("POST", f"/escrows/{i}/release", None) for i in ids[half:]], args.concurrency)
+
+
+def main()->None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--requests", type=int, default=2_000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--fund", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""Derivacao local de enderecos P2WPKH: serial vs ProcessPool, conferida pelos vetores BIP32/BIP84.
+
+    python bench/bench_hd.py --count 20000 --workers 4
+"""
+import argparse, os, sys, time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+from domain.hd import TEST_VECTORS, HdDeriver, _g_table, self_check
+
+
+def main()->None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=20_000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk", type=int, default=500)
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    _g_table()
+    self_check()
+    print(f"tabela + vetores: {time.perf_counter() - t0:.2f}s")
+
+    deriver = HdDeriver(TEST_VECTORS["bip84"][0])
+    t0 = time.perf_counter()
+    serial = deriver.derive_range(0, args.count)
+    elapsed = time.perf_counter() - t0
+    print(f"serial: {args.count / elapsed:,.0f} enderecos/s")
+
+    with ProcessPoolExecutor(args.workers) as pool:
+        deriver.derive_range_parallel(0, args.workers, pool, chunk=1) #aquece os processos (tabela)
+        t0 = time.perf_counter()
+        parallel = deriver.derive_range_parallel(0, args.count, pool, chunk=args.chunk)
+        elapsed = time.perf_counter() - t0
+    print(f"{args.workers} processos: {args.count / elapsed:,.0f} enderecos/s")
+    assert parallel == serial
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Journals/s do ledger: postagem um a um vs em lote (requer Postgres do .env).
+
+Roda dentro de uma transacao desfeita no final, entao nao deixa lixo no banco.
+
+    python bench/bench_ledger.py --journals 20000 --batch 500
+"""
+import argparse, sys, time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+from dotenv import load_dotenv
+load_dotenv(ROOT / ".env")
+
+from sqlalchemy.orm import Session
+
+from db.ledger import AccountKey, Journal, Leg, post_journal, post_journals
+from db.session import make_engine
+from domain.types import Asset
+
+
+def release_journal(n:int, escrows:int)->Journal:
+    #Liberacao tipica: escrow -> vendedor + plataforma
+    ref = str(n % escrows)
+    return Journal(
+        legs=[
+            Leg(AccountKey(Asset.BTC, "ESCROW", ref), Asset.BTC, -103_000),
+            Leg(AccountKey(Asset.BTC, "SELLER", ref), Asset.BTC, 100_000),
+            Leg(AccountKey(Asset.BTC, "PLATFORM", "platform"), Asset.BTC, 3_000),
+        ],
+        ref_type="bench", ref_id=ref,
+    )
+
+
+def main()->None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--journals", type=int, default=10_000)
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--escrows", type=int, default=2_000)
+    args = parser.parse_args()
+
+    engine = make_engine()
+    with engine.connect() as conn:
+        trans = conn.begin()
+        session = Session(bind=conn)
+
+        single = min(args.journals, 2_000)
+        t0 = time.perf_counter()
+        for n in range(single):
+            post_journal(session, release_journal(n, args.escrows))
+        session.flush()
+        elapsed = time.perf_counter() - t0
+        print(f"single : {single / elapsed:,.0f} journals/s ({single} journals)")
+
+        journals = [release_journal(n, args.escrows) for n in range(args.journals)]
+        t0 = time.perf_counter()
+        for i in range(0, len(journals), args.batch):
+            post_journals(session, journals[i:i + args.batch])
+        session.flush()
+        elapsed = time.perf_counter() - t0
+        print(f"batch  : {args.journals / elapsed:,.0f} journals/s (lotes de {args.batch})")
+
+        session.close()
+        trans.rollback()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+"""Ciclo de vida sintetico de N escrows contra o schema de db/models.py.
+
+CREATED -> FUNDED -> RELEASED | DISPUTED -> RESOLVED -> CLOSED, com depositos, webhooks,
+lancamentos no ledger, lotes de payout e outputs nas proporcoes de producao. Mede
+transicoes/s por fase, escritas por tabela (write amplification por escrow) e tamanho de
+tabelas/indices. O resultado sai em JSON para comparar versoes.
+
+Postgres (.env): roda num schema temporario, removido no final (--keep para inspecionar).
+SQLite: arquivo local; tamanhos via dbstat quando o SQLite foi compilado com ele.
+
+    python bench/bench_lifecycle.py --escrows 20000 --out results/lifecycle.json
+    python bench/bench_lifecycle.py --url sqlite:///bench_lifecycle.db --escrows 5000
+"""
+import argparse, itertools, json, os, platform, random, subprocess, sys, time, uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+from dotenv import load_dotenv
+load_dotenv(ROOT / ".env")
+
+from sqlalchemy import create_engine, insert, text, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from db.models import (Base, Deposit, Dispute, Escrow, EscrowDestination, LedgerAccount, LedgerEntry, Payout,
+                       PayoutBatch, PayoutOutput, WebhookEvent, WebhookEventKey)
+from db.partitions import ensure_partitions
+from db.session import database_url
+from domain.fees import platform_fee
+from domain.types import (Asset, DepositStatus, DisputeStatus, EscrowState, PayoutKind, PayoutStatus, Role,
+                          SpeedProfile)
+
+#Proporcoes observadas: ~20% dos escrows pagos em 2 depositos, 8% disputados, 90% BTC
+RATIOS = {"split_deposit": 0.2, "dispute": 0.08, "btc": 0.9, "webhook_dup": 0.1}
+PAYOUT_BATCH = 100 # escrows BTC por tx de payout
+
+
+class Recorder:
+    def __init__(self)->None:
+        self.phases:dict[str,dict] = {}
+        self.writes:Counter[str] = Counter()
+
+    def write(self, conn:Connection, table:str, stmt, rows=None)->list:
+        result = conn.execute(stmt, rows) if rows is not None else conn.execute(stmt)
+        self.writes[table] += len(rows) if rows is not None and not stmt.is_update else result.rowcount
+        return result
+
+    def phase(self, name:str, transitions:int, seconds:float)->None:
+        self.phases[name] = {"transitions": transitions, "seconds": round(seconds, 4),
+                             "per_sec": round(transitions / seconds, 1) if seconds else None}
+
+
+def chunks(items:list, size:int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _ids(result)->list[int]:
+    return list(result.scalars())
+
+
+def run_lifecycle(engine, n:int, batch:int, rng:random.Random)->Recorder:
+    rec = Recorder()
+    now = datetime.now(timezone.utc)
+    state:dict[int,dict] = {}
+
+    def timed(name:str, work)->None:
+        t0 = time.perf_counter()
+        transitions = 0
+        with engine.connect() as conn:
+            for part in chunks(sorted(state), batch):
+                transitions += work(conn, part)
+                conn.commit()
+        rec.phase(name, transitions, time.perf_counter() - t0)
+
+    #CREATED: escrow + destination de deposito
+    t0 = time.perf_counter()
+    with engine.connect() as conn:
+        for part in chunks(list(range(n)), batch):
+            rows = []
+            for _ in part:
+                asset = Asset.BTC if rng.random() < RATIOS["btc"] else Asset.XMR
+                price = rng.randint(10_000, 5_000_000)
+                fee, fn_est = platform_fee(price), rng.randint(500, 5_000)
+                rows.append({
+                    "asset": asset, "price": price, "platform_fee": fee, "fn_est": fn_est, "buffer": fn_est // 2,
+                    "deposit_total": price + fee + fn_est + fn_est // 2, "state": EscrowState.CREATED,
+                    "seller_payout_address": f"tb1qseller{rng.getrandbits(64):x}",
+                    "buyer_payout_address": f"tb1qbuyer{rng.getrandbits(64):x}",
+                    "payout_speed_profile": SpeedProfile.normal if asset == Asset.BTC else None,
+                    "created_at": now, "updated_at": now,
+                })
+            ids = _ids(rec.write(conn, "escrows", insert(Escrow).returning(Escrow.id, sort_by_parameter_order=True), rows))
+            for escrow_id, row in zip(ids, rows):
+                state[escrow_id] = row
+            rec.write(conn, "escrow_destinations", insert(EscrowDestination), [
+                {"escrow_id": i, "asset": state[i]["asset"], "destination": f"dest{i}-{uuid.uuid4().hex[:12]}",
+                 "meta": {"index": i}, "active": True, "created_at": now} for i in ids
+            ])
+            conn.commit()
+    rec.phase("create", n, time.perf_counter() - t0)
+
+    accounts:dict[tuple,int] = {}
+    #ids explicitos: no SQLite a PK composta (id, chave de particao) nao tem autoincremento
+    entry_ids, event_ids = itertools.count(1), itertools.count(1)
+
+    def account_ids(conn:Connection, keys:list[tuple])->list[int]:
+        missing = [k for k in dict.fromkeys(keys) if k not in accounts]
+        if missing:
+            result = rec.write(conn, "ledger_accounts", insert(LedgerAccount).returning(LedgerAccount.id, sort_by_parameter_order=True),
+                               [{"asset": a, "kind": kind, "ref_id": ref, "created_at": now} for a, kind, ref in missing])
+            accounts.update(zip(missing, _ids(result)))
+        return [accounts[k] for k in keys]
+
+    def post(conn:Connection, legs:list[tuple[tuple,int]], ref_type:str, ref_id:int)->list[dict]:
+        ids = account_ids(conn, [k for k, _ in legs])
+        journal_id = str(uuid.uuid4())
+        return [{"id": next(entry_ids), "journal_id": journal_id, "asset": k[0], "account_id": a, "amount": amount, "ref_type": ref_type,
+                 "ref_id": str(ref_id), "created_at": now} for (k, amount), a in zip(legs, ids)]
+
+    #Depositos: webhook (com reentregas duplicadas) -> deposit PENDING -> CONFIRMED -> FUNDED
+    def deposit(conn:Connection, part:list[int])->int:
+        events, deposits = [], []
+        for i in part:
+            s = state[i]
+            amounts = [s["deposit_total"]]
+            if rng.random() < RATIOS["split_deposit"]:
+                first = s["deposit_total"] // 3
+                amounts = [first, s["deposit_total"] - first]
+            for vout, amount in enumerate(amounts):
+                txid = uuid.uuid4().hex * 2
+                payload = {"txid": txid, "vout": vout, "address": f"dest{i}", "amount": amount, "height": 1000}
+                events.append({"id": next(event_ids), "provider": s["asset"].value, "kind": "DEPOSIT", "idempotency_key": f"{txid}:{vout}",
+                               "payload": payload, "processed": False, "received_at": now})
+                if rng.random() < RATIOS["webhook_dup"]:
+                    events.append({**events[-1], "id": next(event_ids), "idempotency_key": f"{txid}:{vout}:retry"})
+                deposits.append({"escrow_id": i, "asset": s["asset"], "txid": txid, "vout": vout, "destination": f"dest{i}",
+                                 "amount": amount, "confirmations_current": 0, "confirmed_height": 1000,
+                                 "status": DepositStatus.PENDING, "first_seen_at": now})
+        rec.write(conn, "webhook_event_keys", insert(WebhookEventKey),
+                  [{"idempotency_key": e["idempotency_key"], "kind": e["kind"], "received_at": now} for e in events])
+        ids = _ids(rec.write(conn, "webhook_events", insert(WebhookEvent).returning(WebhookEvent.id, sort_by_parameter_order=True), events))
+        rec.write(conn, "deposits", insert(Deposit), deposits)
+        rec.write(conn, "webhook_events", update(WebhookEvent).where(WebhookEvent.id.in_(ids))
+                  .values(processed=True, processed_at=now))
+        return len(part)
+
+    def fund(conn:Connection, part:list[int])->int:
+        rec.write(conn, "deposits", update(Deposit).where(Deposit.escrow_id.in_(part))
+                  .values(status=DepositStatus.CONFIRMED, confirmations_current=10, confirmed_at=now))
+        funded = rec.write(conn, "escrows", update(Escrow).where(Escrow.id.in_(part), Escrow.state == EscrowState.CREATED)
+                           .values(state=EscrowState.FUNDED, updated_at=now)).rowcount
+        entries = []
+        for i in part:
+            a, total = state[i]["asset"], state[i]["deposit_total"]
+            entries += post(conn, [((a, "EXTERNAL", "deposits"), -total), ((a, "ESCROW", str(i)), total)], "deposit", i)
+        rec.write(conn, "ledger_entries", insert(LedgerEntry), entries)
+        return funded
+
+    def deliver(conn:Connection, part:list[int])->int:
+        return rec.write(conn, "escrows", update(Escrow).where(Escrow.id.in_(part)).values(
+            delivered_at=now, dispute_deadline=now + timedelta(hours=72), auto_release_at=now + timedelta(days=7),
+            updated_at=now)).rowcount
+
+    disputed:set[int] = set()
+
+    def release_or_dispute(conn:Connection, part:list[int])->int:
+        opened = [i for i in part if rng.random() < RATIOS["dispute"]]
+        disputed.update(opened)
+        released = [i for i in part if i not in disputed]
+        n_released = rec.write(conn, "escrows", update(Escrow).where(Escrow.id.in_(released))
+                               .values(state=EscrowState.RELEASED, updated_at=now)).rowcount if released else 0
+        if not opened:
+            return n_released
+        rec.write(conn, "escrows", update(Escrow).where(Escrow.id.in_(opened)).values(state=EscrowState.DISPUTED, updated_at=now))
+        rec.write(conn, "disputes", insert(Dispute), [
+            {"escrow_id": i, "opened_by": Role.BUYER, "reason": "bench", "status": DisputeStatus.OPEN,
+             "price_at_open": state[i]["price"], "opened_at": now} for i in opened
+        ])
+        return n_released + len(opened)
+
+    def resolve(conn:Connection, part:list[int])->int:
+        ids = [i for i in part if i in disputed]
+        if not ids:
+            return 0
+        for i in ids:
+            price = state[i]["price"]
+            rec.write(conn, "disputes", update(Dispute).where(Dispute.escrow_id == i, Dispute.status == DisputeStatus.OPEN)
+                      .values(status=DisputeStatus.CLOSED, to_seller=price // 2, to_buyer=price - price // 2,
+                              resolved_by="bench", resolved_at=now))
+        return rec.write(conn, "escrows", update(Escrow).where(Escrow.id.in_(ids))
+                         .values(state=EscrowState.RESOLVED, updated_at=now)).rowcount
+
+    #Payout: BTC em lotes de PAYOUT_BATCH escrows por tx, XMR um por tx; ledger escrow -> seller/buyer/plataforma
+    def payout(conn:Connection, part:list[int])->int:
+        btc = [i for i in part if state[i]["asset"] == Asset.BTC]
+        groups = [(g, True) for g in chunks(btc, PAYOUT_BATCH)] + [([i], False) for i in part if state[i]["asset"] == Asset.XMR]
+        entries = []
+        for group, batched in groups:
+            txid = uuid.uuid4().hex * 2
+            batch_id = None
+            if batched:
+                batch_id = rec.write(conn, "payout_batches", insert(PayoutBatch).returning(PayoutBatch.id), [{
+                    "asset": Asset.BTC, "txid": txid, "status": PayoutStatus.BROADCAST, "feerate_profile": SpeedProfile.normal,
+                    "feerate_sat_vb": 10.0, "vbytes_est": 110 * len(group), "fee": sum(state[i]["fn_est"] for i in group),
+                    "created_at": now, "broadcast_at": now}]).scalar_one()
+            payouts = [{"escrow_id": i, "asset": state[i]["asset"], "txid": txid, "status": PayoutStatus.BROADCAST,
+                        "kind": PayoutKind.DISPUTE if i in disputed else PayoutKind.NORMAL,
+                        "feerate_profile": state[i]["payout_speed_profile"], "vbytes_est": 110,
+                        "fn_est_at_send": state[i]["fn_est"], "fn_real": state[i]["fn_est"], "broadcast_at": now,
+                        "batch_id": batch_id} for i in group]
+            payout_ids = _ids(rec.write(conn, "payouts", insert(Payout).returning(Payout.id, sort_by_parameter_order=True), payouts))
+            outputs = []
+            for payout_id, i in zip(payout_ids, group):
+                s = state[i]
+                a, seller, buyer = s["asset"], s["price"], s["buffer"]
+                if i in disputed:
+                    seller, buyer = s["price"] // 2, s["price"] - s["price"] // 2 + s["buffer"]
+                outputs += [{"payout_id": payout_id, "role": Role.SELLER, "address": s["seller_payout_address"], "amount": seller},
+                            {"payout_id": payout_id, "role": Role.BUYER, "address": s["buyer_payout_address"], "amount": buyer},
+                            {"payout_id": payout_id, "role": Role.PLATFORM, "address": "tb1qplatform", "amount": s["platform_fee"]}]
+                entries += post(conn, [((a, "ESCROW", str(i)), -s["deposit_total"]), ((a, "SELLER", str(i)), seller),
+                                       ((a, "BUYER", str(i)), buyer), ((a, "PLATFORM", "platform"), s["platform_fee"]),
+                                       ((a, "NETWORK_FEE", "miners"), s["fn_est"])], "payout", i)
+            rec.write(conn, "payout_outputs", insert(PayoutOutput), outputs)
+        rec.write(conn, "ledger_entries", insert(LedgerEntry), entries)
+        return len(part)
+
+    def close(conn:Connection, part:list[int])->int:
+        rec.write(conn, "payouts", update(Payout).where(Payout.escrow_id.in_(part))
+                  .values(status=PayoutStatus.CONFIRMED, confirmed_at=now))
+        rec.write(conn, "payout_batches", update(PayoutBatch).where(PayoutBatch.status == PayoutStatus.BROADCAST)
+                  .values(status=PayoutStatus.CONFIRMED, confirmed_at=now))
+        return rec.write(conn, "escrows", update(Escrow).where(Escrow.id.in_(part))
+                         .values(state=EscrowState.CLOSED, updated_at=now)).rowcount
+
+    timed("deposit", deposit)
+    timed("fund", fund)
+    timed("deliver", deliver)
+    timed("release_or_dispute", release_or_dispute)
+    timed("resolve", resolve)
+    timed("payout", payout)
+    timed("close", close)
+    return rec
+
+
+def table_sizes(conn:Connection, schema:str|None)->dict[str,dict]:
+    sizes = {t: {"rows": conn.execute(text(f"SELECT count(*) FROM {t}")).scalar(), "table_bytes": None, "index_bytes": None,
+                 "indexes": {}} for t in Base.metadata.tables}
+    if conn.dialect.name == "postgresql":
+        rows = conn.execute(text("""
+            SELECT i.tablename, i.indexname, pg_relation_size(format('%I.%I', i.schemaname, i.indexname)::regclass),
+                   pg_table_size(format('%I.%I', i.schemaname, i.tablename)::regclass)
+            FROM pg_indexes i WHERE i.schemaname = :schema
+        """), {"schema": schema})
+        for table, index, index_bytes, table_bytes in rows:
+            if table in sizes:
+                sizes[table]["indexes"][index] = index_bytes
+                sizes[table]["table_bytes"] = table_bytes
+    elif conn.dialect.name == "sqlite":
+        try:
+            pages = dict(conn.execute(text("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name")).all())
+        except Exception:
+            return sizes # SQLite sem dbstat
+        owners = dict(conn.execute(text("SELECT name, tbl_name FROM sqlite_master WHERE type = 'index'")).all())
+        for name, size in pages.items():
+            if name in sizes:
+                sizes[name]["table_bytes"] = size
+            elif owners.get(name) in sizes:
+                sizes[owners[name]]["indexes"][name] = size
+    for entry in sizes.values():
+        if entry["indexes"]:
+            entry["index_bytes"] = sum(entry["indexes"].values())
+    return sizes
+
+
+def git_version()->str|None:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def main()->None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default=None, help="padrao: Postgres do .env")
+    parser.add_argument("--escrows", type=int, default=10_000)
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default=None, help="arquivo JSON (padrao: stdout)")
+    parser.add_argument("--keep", action="store_true", help="nao apaga o schema/arquivo no final")
+    args = parser.parse_args()
+
+    url = args.url or database_url()
+    schema = None
+    if url.startswith("postgresql"):
+        schema = f"bench_{os.getpid()}"
+        engine = create_engine(url, connect_args={"options": f"-csearch_path={schema}"})
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE SCHEMA {schema}"))
+    else:
+        engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    if schema:
+        with Session(engine) as session, session.begin():
+            ensure_partitions(session)
+
+    try:
+        rec = run_lifecycle(engine, args.escrows, args.batch, random.Random(args.seed))
+        with engine.connect() as conn:
+            sizes = table_sizes(conn, schema)
+    finally:
+        if not args.keep:
+            if schema:
+                with engine.begin() as conn:
+                    conn.execute(text(f"DROP SCHEMA {schema} CASCADE"))
+            else:
+                Base.metadata.drop_all(engine)
+        engine.dispose()
+
+    tables = {}
+    for table, entry in sizes.items():
+        writes = rec.writes.get(table, 0)
+        tables[table] = {**entry, "row_writes": writes, "writes_per_escrow": round(writes / args.escrows, 3),
+                         "writes_per_row": round(writes / entry["rows"], 3) if entry["rows"] else None}
+    result = {
+        "version": git_version(), "dialect": engine.dialect.name, "python": platform.python_version(),
+        "escrows": args.escrows, "batch": args.batch, "seed": args.seed, "ratios": RATIOS,
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "phases": rec.phases,
+        "total_transitions_per_sec": round(sum(p["transitions"] for p in rec.phases.values())
+                                           / sum(p["seconds"] for p in rec.phases.values()), 1),
+        "tables": tables,
+    }
+    output = json.dumps(result, indent=2, default=str)
+    if args.out:
+        Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.out).write_text(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""Chamadas/s do JsonRpcClient contra o servidor fake: POST por chamada vs batch.
+
+    python bench/bench_rpc.py --calls 5000 --latency 0.002
+"""
+import argparse, asyncio, sys, time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+from adapters.bitcoin_core import BitcoinCoreAdapter
+from adapters.fake_rpc import fake_bitcoin_core
+from adapters.jsonrpc import JsonRpcClient
+
+
+async def run(calls:int, latency:float, batch:bool)->None:
+    server = fake_bitcoin_core(latency=latency)
+    rpc = JsonRpcClient("http://bitcoind/", batch=batch, transport=server.transport())
+    node = BitcoinCoreAdapter(rpc)
+    t0 = time.perf_counter()
+    hashes = await asyncio.gather(*(node.get_block_hash(h) for h in range(calls)))
+    elapsed = time.perf_counter() - t0
+    await rpc.aclose()
+    assert hashes[-1] == f"{calls - 1:064x}"
+    label = "batch " if batch else "single"
+    print(f"{label}: {calls / elapsed:,.0f} chamadas/s, {server.http_requests} POSTs para {server.rpc_calls} chamadas")
+
+
+def main()->None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=5_000)
+    parser.add_argument("--latency", type=float, default=0.002) # por POST
+    args = parser.parse_args()
+    asyncio.run(run(args.calls, args.latency, batch=False))
+    asyncio.run(run(args.calls, args.latency, batch=True))
+
+
+if __name__ == "__main__":
+    main()
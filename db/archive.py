@@ -0,0 +1,187 @@
+"""Arquivamento frio dos escrows CLOSED.
+
+Cada lote vira um arquivo JSONL.gz em ARCHIVE_DIR: uma linha por escrow com destinos,
+depositos, payouts (+ outputs) e disputas embutidos. O arquivo e escrito, relido e
+conferido contra o que foi lido do banco antes do DELETE, tudo na transacao que segura os
+escrows (SKIP LOCKED). escrow_archive guarda onde cada escrow foi parar para leitura sob
+demanda. Lancamentos do ledger e payout_batches ficam: sao historico contabil/on-chain.
+"""
+import enum
+import gzip
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session, selectinload
+
+from db.models import ArchivedEscrow, Deposit, Dispute, Escrow, EscrowDestination, Payout, PayoutOutput
+from domain.types import EscrowState
+
+ARCHIVE_FORMAT = 1
+
+
+class ArchiveMismatch(RuntimeError):
+    pass
+
+
+def archive_dir()->Path:
+    return Path(os.getenv("ARCHIVE_DIR", "archive"))
+
+
+def json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.value
+    raise TypeError(f"{type(value).__name__} nao serializavel")
+
+
+def _row(obj)->dict:
+    return {c.key: getattr(obj, c.key) for c in obj.__table__.columns}
+
+
+def escrow_document(escrow:Escrow)->dict:
+    return {
+        "format": ARCHIVE_FORMAT,
+        **_row(escrow),
+        "destinations": [_row(d) for d in escrow.destinations],
+        "deposits": [_row(d) for d in escrow.deposits],
+        "payouts": [{**_row(p), "outputs": [_row(o) for o in p.outputs]} for p in escrow.payouts],
+        "disputes": [_row(d) for d in escrow.disputes],
+    }
+
+
+def _shape(doc:dict)->tuple[int, ...]:
+    #o que a verificacao confere por escrow: quantidade de linhas filhas de cada tabela
+    return (len(doc["destinations"]), len(doc["deposits"]), len(doc["payouts"]),
+            sum(len(p["outputs"]) for p in doc["payouts"]), len(doc["disputes"]))
+
+
+def claim_closed(session:Session, before:datetime, limit:int)->list[Escrow]:
+    return list(session.scalars(
+        select(Escrow)
+        .where(Escrow.state == EscrowState.CLOSED, Escrow.updated_at < before)
+        .order_by(Escrow.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .options(
+            selectinload(Escrow.destinations), selectinload(Escrow.deposits),
+            selectinload(Escrow.payouts).selectinload(Payout.outputs), selectinload(Escrow.disputes),
+        )
+    ))
+
+
+def write_archive(path:Path, docs:list[dict])->None:
+    with open(path, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as gz:
+            for doc in docs:
+                gz.write(json.dumps(doc, default=json_default, separators=(",", ":")).encode() + b"\n")
+        raw.flush()
+        os.fsync(raw.fileno())
+
+
+def file_sha256(path:Path)->str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def iter_archive(path:Path):
+    with gzip.open(path, "rb") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def verify_archive(path:Path, expected:dict[int,tuple[int, ...]])->str:
+    """Rele o arquivo inteiro e confere ids e quantidade de linhas filhas; devolve o sha256."""
+    found = {doc["id"]: _shape(doc) for doc in iter_archive(path)}
+    if found != expected:
+        missing = sorted(set(expected) - set(found))
+        differ = sorted(i for i in expected.keys() & found.keys() if expected[i] != found[i])
+        raise ArchiveMismatch(f"{path.name}: faltando {missing[:10]}, divergentes {differ[:10]}")
+    return file_sha256(path)
+
+
+def delete_escrows(session:Session, escrow_ids:list[int], chunk:int=500)->None:
+    #filhos antes do pai; payout_outputs nao tem ON DELETE CASCADE
+    for i in range(0, len(escrow_ids), chunk):
+        part = escrow_ids[i:i + chunk]
+        payouts = select(Payout.id).where(Payout.escrow_id.in_(part)).scalar_subquery()
+        for stmt in (
+            delete(PayoutOutput).where(PayoutOutput.payout_id.in_(payouts)),
+            delete(Payout).where(Payout.escrow_id.in_(part)),
+            delete(Dispute).where(Dispute.escrow_id.in_(part)),
+            delete(Deposit).where(Deposit.escrow_id.in_(part)),
+            delete(EscrowDestination).where(EscrowDestination.escrow_id.in_(part)),
+            delete(Escrow).where(Escrow.id.in_(part)),
+        ):
+            session.execute(stmt.execution_options(synchronize_session=False))
+
+
+@dataclass(frozen=True)
+class ArchiveResult:
+    file:str|None
+    escrows:int
+
+
+def archive_closed(session:Session, directory:Path, older_than:timedelta, limit:int=500)->ArchiveResult:
+    """Arquiva um lote de escrows CLOSED ha mais de `older_than`. Se a transacao falhar depois
+    do arquivo escrito, ele fica orfao (sem linhas em escrow_archive) e o lote e refeito."""
+    now = datetime.now(timezone.utc)
+    escrows = claim_closed(session, now - older_than, limit)
+    if not escrows:
+        return ArchiveResult(None, 0)
+    docs = [escrow_document(e) for e in escrows]
+    name = f"escrows-{docs[0]['id']:012d}-{docs[-1]['id']:012d}-{now:%Y%m%dT%H%M%S}.jsonl.gz"
+    path, partial = directory / name, directory / f"{name}.partial"
+    write_archive(partial, docs)
+    sha256 = verify_archive(partial, {doc["id"]: _shape(doc) for doc in docs})
+    os.replace(partial, path)
+    session.execute(insert(ArchivedEscrow), [
+        {"escrow_id": e.id, "asset": e.asset, "archive_file": name, "sha256": sha256,
+         "closed_at": e.updated_at, "archived_at": now}
+        for e in escrows
+    ])
+    delete_escrows(session, [e.id for e in escrows])
+    return ArchiveResult(name, len(docs))
+
+
+#arquivos ja conferidos neste processo: (caminho, sha256) -> (mtime_ns, tamanho) vistos na conferencia
+_verified:dict[tuple[str,str],tuple[int,int]] = {}
+
+
+def verify_file(path:Path, sha256:str)->None:
+    """Confere o sha256 do arquivo uma vez por processo; so refaz se mtime/tamanho mudarem."""
+    stat = path.stat()
+    seen = (stat.st_mtime_ns, stat.st_size)
+    if _verified.get((str(path), sha256)) == seen:
+        return
+    if file_sha256(path) != sha256:
+        raise ArchiveMismatch(f"{path.name}: sha256 nao confere")
+    _verified[(str(path), sha256)] = seen
+
+
+def read_archived(directory:Path, entry:ArchivedEscrow, verify:bool=True)->dict:
+    path = directory / entry.archive_file
+    if verify:
+        verify_file(path, entry.sha256)
+    for doc in iter_archive(path):
+        if doc["id"] == entry.escrow_id:
+            return doc
+    raise ArchiveMismatch(f"{entry.archive_file}: escrow {entry.escrow_id} ausente")
+
+
+def find_archived(session:Session, escrow_id:int)->ArchivedEscrow|None:
+    return session.get(ArchivedEscrow, escrow_id)
+
+
+def load_archived(session:Session, escrow_id:int, directory:Path|None=None)->dict|None:
+    """Documento do escrow arquivado (mesmas colunas de escrows + filhos) ou None."""
+    entry = find_archived(session, escrow_id)
+    return read_archived(directory or archive_dir(), entry) if entry is not None else None
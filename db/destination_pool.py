@@ -0,0 +1,89 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import func, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from db.models import PooledDestination
+from domain.types import Asset
+
+
+class DestinationPoolEmpty(RuntimeError):
+    pass
+
+
+#Reserva N linhas livres do pool, associa cada uma a um escrow (pela ordem do array) e ja
+#cria os EscrowDestination, tudo num unico statement. SKIP LOCKED: criacoes concorrentes
+#nunca esperam nem pegam o mesmo endereco.
+_CLAIM = text("""
+WITH wanted AS (
+    SELECT escrow_id, ord FROM unnest(CAST(:escrow_ids AS integer[])) WITH ORDINALITY AS w(escrow_id, ord)
+), picked AS (
+    SELECT id, row_number() OVER (ORDER BY id) AS ord FROM (
+        SELECT id FROM destination_pool
+        WHERE asset = CAST(:asset AS asset) AND claimed_at IS NULL
+        ORDER BY id
+        LIMIT :n
+        FOR UPDATE SKIP LOCKED
+    ) free
+), claimed AS (
+    UPDATE destination_pool p
+    SET claimed_at = now(), escrow_id = w.escrow_id
+    FROM picked JOIN wanted w USING (ord)
+    WHERE p.id = picked.id
+    RETURNING p.escrow_id, p.asset, p.destination, p.meta
+)
+INSERT INTO escrow_destinations (escrow_id, asset, destination, meta, active, created_at)
+SELECT escrow_id, asset, destination, meta, TRUE, now() FROM claimed
+RETURNING escrow_id, destination, meta
+""")
+
+
+def claim_destinations(session:Session, asset:Asset, escrow_ids:list[int])->dict[int,tuple[str,dict]]:
+    #escrow_id -> (destination, meta); falha inteira se o pool nao tiver o suficiente
+    if not escrow_ids:
+        return {}
+    rows = session.execute(_CLAIM, {"escrow_ids": escrow_ids, "asset": asset.value, "n": len(escrow_ids)}).all()
+    if len(rows) < len(escrow_ids):
+        raise DestinationPoolEmpty(f"pool de {asset.value} sem enderecos livres ({len(rows)}/{len(escrow_ids)})")
+    return {escrow_id: (destination, meta) for escrow_id, destination, meta in rows}
+
+
+def claim_destination(session:Session, asset:Asset, escrow_id:int)->tuple[str,dict]:
+    return claim_destinations(session, asset, [escrow_id])[escrow_id]
+
+
+def available(session:Session)->dict[Asset,int]:
+    rows = session.execute(
+        select(PooledDestination.asset, func.count())
+        .where(PooledDestination.claimed_at.is_(None))
+        .group_by(PooledDestination.asset)
+    ).tuples()
+    levels = {asset: 0 for asset in Asset}
+    levels.update(dict(rows))
+    return levels
+
+
+#chaves de meta com indice de expressao (ix_destination_pool_index / _subaddr_index)
+INDEXED_META_KEYS = ("index", "subaddr_index")
+
+
+def next_index(session:Session, asset:Asset, meta_key:str)->int:
+    #proximo indice de derivacao/subaddress a partir do que ja foi para o pool. A chave vai
+    #literal no SQL para a expressao bater com a do indice (parametro nao casa no plano generico)
+    if meta_key not in INDEXED_META_KEYS:
+        raise ValueError(f"chave de meta sem indice: {meta_key}")
+    last = session.scalar(
+        select(func.max(text(f"(meta->>'{meta_key}')::int"))).where(PooledDestination.asset == asset)
+    )
+    return 0 if last is None else last + 1
+
+
+def add_to_pool(session:Session, asset:Asset, rows:list[tuple[str,dict]])->int:
+    if not rows:
+        return 0
+    now = datetime.now(timezone.utc)
+    stmt = pg_insert(PooledDestination).values(
+        [{"asset": asset, "destination": destination, "meta": meta, "created_at": now} for destination, meta in rows]
+    ).on_conflict_do_nothing(constraint="uq_destination_pool_destination")
+    return session.execute(stmt).rowcount
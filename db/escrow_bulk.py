@@ -0,0 +1,48 @@
+"""Criacao de escrows em lote (checkout de marketplace): poucos statements por lote, nao por escrow.
+
+INSERT multi-linha em escrows (insertmanyvalues, RETURNING na ordem dos parametros), um
+claim_destinations por ativo (que ja grava escrow_destinations no mesmo statement) e um
+INSERT multi-linha na outbox. Tudo na transacao do chamador: o lote entra inteiro ou nada.
+"""
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from sqlalchemy import Row, insert
+from sqlalchemy.orm import Session
+
+from db.destination_pool import claim_destinations
+from db.models import Escrow
+from db.outbox import emit, escrow_event
+from domain.types import Asset, EscrowAmounts, EscrowState, SpeedProfile
+
+_ESCROWS = Escrow.__table__
+
+
+def escrow_row(asset:Asset, amounts:EscrowAmounts, seller_payout_address:str, buyer_payout_address:str|None,
+               payout_speed_profile:SpeedProfile|None)->dict:
+    return {
+        "asset": asset, "price": amounts.price, "platform_fee": amounts.platform_fee, "fn_est": amounts.fn_est,
+        "buffer": amounts.buffer, "deposit_total": amounts.deposit_total,
+        "seller_payout_address": seller_payout_address, "buyer_payout_address": buyer_payout_address,
+        "payout_speed_profile": payout_speed_profile,
+    }
+
+
+def create_escrows(session:Session, rows:list[dict])->list[tuple[Row,str]]:
+    """Cria os escrows CREATED de `rows` (ver escrow_row) e devolve (escrow, destino) na mesma ordem.
+    DestinationPoolEmpty se o pool de algum ativo nao cobrir o lote todo."""
+    if not rows:
+        return []
+    now = datetime.now(timezone.utc)
+    escrows = session.execute(
+        insert(_ESCROWS).returning(*_ESCROWS.c, sort_by_parameter_order=True),
+        [{**row, "state": EscrowState.CREATED, "version": 0, "created_at": now, "updated_at": now} for row in rows],
+    ).all()
+    by_asset:dict[Asset,list[int]] = defaultdict(list)
+    for e in escrows:
+        by_asset[e.asset].append(e.id)
+    destinations:dict[int,tuple[str,dict]] = {}
+    for asset, ids in by_asset.items():
+        destinations.update(claim_destinations(session, asset, ids))
+    emit(session, [escrow_event("escrow.created", e) for e in escrows])
+    return [(e, destinations[e.id][0]) for e in escrows]
@@ -0,0 +1,153 @@
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from typing import Callable, Literal
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from adapters.metrics import TRANSITION_SECONDS, TRANSITIONS, timer
+from db.escrow_view import mark_dirty
+from db.ledger import AccountKey, Journal, Leg, post_journals
+from db.models import Dispute, Escrow
+from db.outbox import emit, escrow_event
+from domain.state_machine import TABLE, Event, Rule
+from domain.types import DisputeStatus
+
+LOCK_NOT_AVAILABLE = "55P03"
+
+#nowait: falha na hora se outra transacao segura a linha (transicao unitaria da API)
+#skip: lotes pulam linhas travadas (quem trava resolve ou o lote tenta de novo)
+#wait: espera o lock (passada de confirmacoes, que nao pode perder escrows)
+LockMode = Literal["nowait", "skip", "wait"]
+Effect = Callable[[Session, Rule, list[Escrow]], None]
+
+
+class TransitionConflict(RuntimeError):
+    #estado/versao mudou desde a leitura ou a linha esta travada por outra transicao
+    def __init__(self, escrow_id:int, event:Event, reason:str="estado ou versao mudou")->None:
+        super().__init__(f"escrow {escrow_id}: {event.value} rejeitado ({reason})")
+        self.escrow_id = escrow_id
+        self.event = event
+
+
+EFFECTS:dict[Event,list[Effect]] = {e: [] for e in Event}
+
+
+def effect(*events:Event)->Callable[[Effect], Effect]:
+    #efeitos rodam na mesma transacao do UPDATE, com todos os escrows que mudaram
+    def register(fn:Effect)->Effect:
+        for event in events:
+            EFFECTS[event].append(fn)
+        return fn
+    return register
+
+
+def transition_many(session:Session, event:Event, escrow_ids:list[int]|None=None, *, where:tuple=(),
+                    values:dict|None=None, version:int|None=None, lock:LockMode="skip")->list[Escrow]:
+    """Aplica `event` com um unico UPDATE condicional e devolve os escrows que mudaram.
+
+    O WHERE exige estado de origem valido (e `version`, se informada) e incrementa
+    version, entao duas transicoes concorrentes nunca aplicam sobre o mesmo estado.
+    Payouts nao precisam de job: RELEASED/RESOLVED ja e a fila que o PayoutBatcher le.
+    """
+    rule = TABLE[event]
+    conditions = [Escrow.state.in_(rule.sources), *where]
+    if escrow_ids is not None:
+        conditions.append(Escrow.id.in_(escrow_ids))
+    if version is not None:
+        conditions.append(Escrow.version == version)
+    target = select(Escrow.id).where(*conditions)
+    if lock != "wait":
+        target = target.with_for_update(nowait=lock == "nowait", skip_locked=lock == "skip")
+    stmt = (
+        update(Escrow)
+        .where(Escrow.id.in_(target.scalar_subquery()), Escrow.state.in_(rule.sources))
+        .values(state=rule.target, version=Escrow.version + 1, updated_at=datetime.now(timezone.utc), **(values or {}))
+        .returning(Escrow)
+        .execution_options(synchronize_session=False)
+    )
+    with timer(TRANSITION_SECONDS, rule.name):
+        try:
+            #nowait em savepoint: o lock negado desfaz so o UPDATE e a transacao segue usavel para reler o escrow
+            with session.begin_nested() if lock == "nowait" else nullcontext():
+                escrows = list(session.execute(stmt).scalars())
+        except OperationalError as e:
+            if getattr(e.orig, "sqlstate", None) == LOCK_NOT_AVAILABLE and escrow_ids and len(escrow_ids) == 1:
+                raise TransitionConflict(escrow_ids[0], event, "em uso por outra transicao") from e
+            raise
+        if escrows:
+            for fn in EFFECTS[event]:
+                fn(session, rule, escrows)
+            mark_dirty(session, (e.id for e in escrows))
+    TRANSITIONS.labels(rule.name).inc(len(escrows))
+    return escrows
+
+
+def transition(session:Session, escrow_id:int, event:Event, *, where:tuple=(), values:dict|None=None,
+               version:int|None=None)->Escrow:
+    escrows = transition_many(session, event, [escrow_id], where=where, values=values, version=version, lock="nowait")
+    if not escrows:
+        raise TransitionConflict(escrow_id, event)
+    return escrows[0]
+
+
+@effect(*Event)
+def _notify(session:Session, rule:Rule, escrows:list[Escrow])->None:
+    #outbox na mesma transacao: notificacao sai se, e so se, a transicao commitar
+    emit(session, [escrow_event(f"escrow.{rule.event.value}", e) for e in escrows])
+
+
+#Efeitos no ledger: deposito entra na conta do escrow (e sai se um reorg o derrubar); liberacao/resolucao credita as partes.
+#fn_est + buffer continuam no escrow ate o payout pagar a taxa de rede.
+
+@effect(Event.FUND)
+def _post_funding(session:Session, rule:Rule, escrows:list[Escrow])->None:
+    post_journals(session, [
+        Journal(legs=[
+            Leg(AccountKey(e.asset, "EXTERNAL", "deposits"), e.asset, -e.deposit_total),
+            Leg(AccountKey(e.asset, "ESCROW", str(e.id)), e.asset, e.deposit_total),
+        ], ref_type="escrow", ref_id=str(e.id), memo=rule.event.value)
+        for e in escrows
+    ])
+
+
+@effect(Event.UNFUND)
+def _reverse_funding(session:Session, rule:Rule, escrows:list[Escrow])->None:
+    post_journals(session, [
+        Journal(legs=[
+            Leg(AccountKey(e.asset, "ESCROW", str(e.id)), e.asset, -e.deposit_total),
+            Leg(AccountKey(e.asset, "EXTERNAL", "deposits"), e.asset, e.deposit_total),
+        ], ref_type="escrow", ref_id=str(e.id), memo=rule.event.value)
+        for e in escrows
+    ])
+
+
+def _split(escrow:Escrow, to_seller:int, to_buyer:int, memo:str)->Journal:
+    legs = [Leg(AccountKey(escrow.asset, "ESCROW", str(escrow.id)), escrow.asset, -(to_seller + to_buyer + escrow.platform_fee))]
+    if escrow.platform_fee:
+        legs.append(Leg(AccountKey(escrow.asset, "PLATFORM", "platform"), escrow.asset, escrow.platform_fee))
+    if to_seller:
+        legs.append(Leg(AccountKey(escrow.asset, "SELLER", str(escrow.id)), escrow.asset, to_seller))
+    if to_buyer:
+        legs.append(Leg(AccountKey(escrow.asset, "BUYER", str(escrow.id)), escrow.asset, to_buyer))
+    return Journal(legs=legs, ref_type="escrow", ref_id=str(escrow.id), memo=memo)
+
+
+@effect(Event.RELEASE, Event.AUTO_RELEASE)
+def _post_release(session:Session, rule:Rule, escrows:list[Escrow])->None:
+    post_journals(session, [_split(e, e.price, 0, rule.event.value) for e in escrows])
+
+
+@effect(Event.RESOLVE)
+def _post_resolution(session:Session, rule:Rule, escrows:list[Escrow])->None:
+    disputes = dict(session.execute(
+        select(Dispute.escrow_id, Dispute).where(
+            Dispute.escrow_id.in_([e.id for e in escrows]), Dispute.status == DisputeStatus.CLOSED)
+        .order_by(Dispute.resolved_at)
+    ).all())
+    journals = []
+    for e in escrows:
+        d = disputes[e.id]
+        journals.append(_split(e, d.to_seller or 0, d.to_buyer or 0, rule.event.value))
+    post_journals(session, journals)
@@ -0,0 +1,194 @@
+"""Read model do escrow para polling (GET /escrows/{id}), cacheado no Redis.
+
+A view desnormalizada (escrow + destino ativo + depositos, payouts e disputas) sai de uma
+unica query com joinedload e fica no Redis com ETag. Quem altera um escrow marca o id
+na sessao (`mark_dirty`); depois do commit os ids marcados sao invalidados. O contador de
+geracao por escrow impede que um leitor que carregou antes do commit regrave a view velha.
+Na API o endpoint espera a invalidacao (`settle`) antes de responder, entao o GET seguinte
+ja ve o estado novo.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import Future
+from contextlib import suppress
+from types import SimpleNamespace
+from typing import Callable, Iterable
+
+from redis.asyncio import Redis
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload
+
+from adapters.metrics import REGISTRY
+from db.archive import json_default
+from db.models import Escrow
+
+log = logging.getLogger("db.escrow_view")
+
+DIRTY = "escrow_view_dirty"
+PENDING = "escrow_view_pending"
+VIEW_TTL = int(os.getenv("ESCROW_VIEW_TTL_SECONDS", "300"))
+
+VIEW_LOOKUPS = REGISTRY.counter("escrow_view_lookups_total", "Leituras da view de polling por resultado", ("result",))
+
+#Grava a view so se ninguem invalidou o escrow desde que o leitor olhou a geracao
+_PUT_IF_CURRENT = """
+if (redis.call('GET', KEYS[2]) or '') ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+
+def escrow_fields(escrow:Escrow, destination:str|None)->dict:
+    return {
+        "id": escrow.id, "asset": escrow.asset, "state": escrow.state, "version": escrow.version, "price": escrow.price,
+        "platform_fee": escrow.platform_fee, "fn_est": escrow.fn_est, "buffer": escrow.buffer,
+        "deposit_total": escrow.deposit_total, "deposit_destination": destination,
+        "seller_payout_address": escrow.seller_payout_address, "buyer_payout_address": escrow.buyer_payout_address,
+        "payout_speed_profile": escrow.payout_speed_profile, "delivered_at": escrow.delivered_at,
+        "dispute_deadline": escrow.dispute_deadline, "auto_release_at": escrow.auto_release_at,
+        "created_at": escrow.created_at, "updated_at": escrow.updated_at,
+    }
+
+
+def load_view(session:Session, escrow_id:int)->dict|None:
+    #uma query: colecoes pequenas (1-2 linhas cada), o produto cartesiano do JOIN e desprezivel
+    escrow = session.execute(
+        select(Escrow)
+        .where(Escrow.id == escrow_id)
+        .options(joinedload(Escrow.destinations), joinedload(Escrow.deposits),
+                 joinedload(Escrow.payouts), joinedload(Escrow.disputes))
+    ).unique().scalar_one_or_none()
+    if escrow is None:
+        return None
+    return _view(escrow, escrow.destinations, escrow.deposits, escrow.payouts, escrow.disputes)
+
+
+def archived_view(doc:dict)->dict:
+    """Mesma view do load_view a partir do documento de db/archive (sem meta dos destinos nem outputs)."""
+    rows = lambda key: [SimpleNamespace(**row) for row in doc[key]]
+    return {**_view(SimpleNamespace(**doc), rows("destinations"), rows("deposits"), rows("payouts"), rows("disputes")),
+            "archived": True}
+
+
+def _view(escrow, destinations:list, deposits:list, payouts:list, disputes:list)->dict:
+    destination = next((d.destination for d in destinations if d.active), None)
+    return {
+        **escrow_fields(escrow, destination),
+        "deposits": [
+            {"txid": d.txid, "vout": d.vout, "amount": d.amount, "status": d.status,
+             "confirmations": d.confirmations_current, "confirmed_height": d.confirmed_height,
+             "first_seen_at": d.first_seen_at, "confirmed_at": d.confirmed_at}
+            for d in sorted(deposits, key=lambda d: d.id)
+        ],
+        "payouts": [
+            {"txid": p.txid, "kind": p.kind, "status": p.status, "broadcast_at": p.broadcast_at,
+             "confirmed_at": p.confirmed_at}
+            for p in sorted(payouts, key=lambda p: p.id)
+        ],
+        "disputes": [
+            {"id": d.id, "status": d.status, "opened_by": d.opened_by, "opened_at": d.opened_at,
+             "resolved_at": d.resolved_at, "to_seller": d.to_seller, "to_buyer": d.to_buyer}
+            for d in sorted(disputes, key=lambda d: d.id)
+        ],
+    }
+
+
+def encode_view(view:dict)->tuple[str,str]:
+    #(etag, corpo JSON); a versao no ETag deixa visivel quando a mudanca foi de estado
+    body = json.dumps(view, default=json_default, separators=(",", ":"))
+    return f'"{view["version"]}-{hashlib.sha256(body.encode()).hexdigest()[:16]}"', body
+
+
+def mark_dirty(session:Session, escrow_ids:Iterable[int])->None:
+    session.info.setdefault(DIRTY, set()).update(escrow_ids)
+
+
+_callbacks:list[Callable[[Session, set[int]], None]] = []
+
+
+def _after_commit(session:Session)->None:
+    ids = session.info.pop(DIRTY, None)
+    if ids:
+        for callback in _callbacks:
+            callback(session, ids)
+
+
+def _after_rollback(session:Session)->None:
+    session.info.pop(DIRTY, None)
+
+
+def on_commit(callback:Callable[[Session, set[int]], None])->None:
+    """Registra quem invalida o cache depois de cada commit que marcou escrows (todas as sessoes)."""
+    if not _callbacks:
+        event.listen(Session, "after_commit", _after_commit)
+        event.listen(Session, "after_rollback", _after_rollback)
+    _callbacks.append(callback)
+
+
+class EscrowViewCache:
+    def __init__(self, redis:Redis, ttl:int=VIEW_TTL, prefix:str="escrow:view")->None:
+        self.redis = redis
+        self.ttl = ttl
+        self.prefix = prefix
+        self._put = redis.register_script(_PUT_IF_CURRENT)
+
+    def _keys(self, escrow_id:int)->tuple[str,str]:
+        return f"{self.prefix}:{escrow_id}", f"{self.prefix}:{escrow_id}:gen"
+
+    async def get(self, escrow_id:int)->tuple[tuple[str,str]|None,str]:
+        #((etag, corpo) ou None, geracao lida junto para o put)
+        cached, gen = await self.redis.mget(self._keys(escrow_id))
+        gen = gen.decode() if gen else ""
+        VIEW_LOOKUPS.labels("miss" if cached is None else "hit").inc()
+        if cached is None:
+            return None, gen
+        etag, body = json.loads(cached)
+        return (etag, body), gen
+
+    async def put(self, escrow_id:int, gen:str, etag:str, body:str)->bool:
+        return bool(await self._put(keys=self._keys(escrow_id), args=[gen, json.dumps([etag, body]), self.ttl]))
+
+    async def invalidate(self, escrow_ids:Iterable[int])->None:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for escrow_id in escrow_ids:
+                view, gen = self._keys(escrow_id)
+                pipe.delete(view)
+                pipe.incr(gen)
+                pipe.expire(gen, 86400)
+            await pipe.execute()
+
+    def install(self, loop:asyncio.AbstractEventLoop)->None:
+        #commits acontecem em threads (worker) ou no proprio loop (API); os dois agendam no loop
+        def schedule(session:Session, ids:set[int])->None:
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is loop:
+                #commit da AsyncSession: a task fica na sessao para o endpoint esperar (settle)
+                task = loop.create_task(self.invalidate(ids))
+                task.add_done_callback(lambda t: _log_failure(t, ids))
+                session.info.setdefault(PENDING, []).append(task)
+            else:
+                future = asyncio.run_coroutine_threadsafe(self.invalidate(ids), loop)
+                future.add_done_callback(lambda f: _log_failure(f, ids))
+        on_commit(schedule)
+
+    async def settle(self, session:Session|AsyncSession)->None:
+        """Espera as invalidacoes dos commits desta sessao. Falha do Redis ja foi logada e nao
+        derruba a resposta: o commit valeu e a view velha expira pelo TTL."""
+        for task in session.info.pop(PENDING, []):
+            with suppress(Exception):
+                await task
+
+
+def _log_failure(future:asyncio.Future|Future, ids:set[int])->None:
+    if not future.cancelled() and future.exception() is not None:
+        log.warning("invalidacao da view falhou para %d escrows (%s); vale o TTL de %ds",
+                    len(ids), future.exception(), VIEW_TTL)
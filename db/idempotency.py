@@ -0,0 +1,68 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from db.models import IdempotencyKey
+
+
+def find(session:Session, key:str, endpoint:str)->tuple[str,dict,datetime|None]|None:
+    #(request_hash, response_snapshot, expires_at) se a chave existir e nao tiver expirado
+    row = session.execute(
+        select(IdempotencyKey.request_hash, IdempotencyKey.response_snapshot, IdempotencyKey.expires_at)
+        .where(IdempotencyKey.key == key, IdempotencyKey.endpoint == endpoint)
+    ).first()
+    if row is None or (row.expires_at is not None and row.expires_at <= datetime.now(timezone.utc)):
+        return None
+    return tuple(row)
+
+
+def find_many(session:Session, keys:list[str], endpoint:str)->dict[str,tuple[str,dict,datetime|None]]:
+    #find para um lote de chaves num SELECT so; vencidas ficam de fora
+    now = datetime.now(timezone.utc)
+    rows = session.execute(
+        select(IdempotencyKey.key, IdempotencyKey.request_hash, IdempotencyKey.response_snapshot, IdempotencyKey.expires_at)
+        .where(IdempotencyKey.key.in_(keys), IdempotencyKey.endpoint == endpoint)
+    )
+    return {
+        row.key: (row.request_hash, row.response_snapshot, row.expires_at)
+        for row in rows if row.expires_at is None or row.expires_at > now
+    }
+
+
+def _upsert(rows:list[dict], now:datetime):
+    stmt = pg_insert(IdempotencyKey).values(rows)
+    return stmt.on_conflict_do_update(
+        constraint="uq_idempotency",
+        set_={"request_hash": stmt.excluded.request_hash, "response_snapshot": stmt.excluded.response_snapshot,
+              "expires_at": stmt.excluded.expires_at, "created_at": stmt.excluded.created_at},
+        where=IdempotencyKey.expires_at <= now, # chave vencida ainda nao purgada pode ser reutilizada
+    ).returning(IdempotencyKey.key)
+
+
+def store(session:Session, key:str, endpoint:str, request_hash:str, response:dict, expires_at:datetime|None)->bool:
+    #False se outra requisicao com a mesma chave (ainda valida) gravou primeiro
+    return bool(store_many(session, endpoint, [(key, request_hash, response)], expires_at))
+
+
+def store_many(session:Session, endpoint:str, entries:list[tuple[str,str,dict]], expires_at:datetime|None)->set[str]:
+    #entries: (key, request_hash, response); devolve as chaves gravadas (as que faltam perderam a corrida)
+    now = datetime.now(timezone.utc)
+    rows = [
+        {"key": key, "endpoint": endpoint, "request_hash": request_hash, "response_snapshot": response,
+         "expires_at": expires_at, "created_at": now}
+        for key, request_hash, response in entries
+    ]
+    return set(session.execute(_upsert(rows, now)).scalars())
+
+
+def purge_expired(session:Session, batch:int=5000)->int:
+    #Apaga um lote de chaves vencidas (usa ix_idempotency_keys_expires_at)
+    expired = (
+        select(IdempotencyKey.id)
+        .where(IdempotencyKey.expires_at < datetime.now(timezone.utc))
+        .limit(batch)
+        .scalar_subquery()
+    )
+    return session.execute(delete(IdempotencyKey).where(IdempotencyKey.id.in_(expired))).rowcount
@@ -0,0 +1,192 @@
+import uuid
+from dataclasses import dataclass, field
+
+from sqlalchemy import func, insert, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from db.models import LedgerBalance, LedgerEntry
+from domain.types import Asset
+
+
+@dataclass(frozen=True)
+class AccountKey:
+    asset:Asset
+    kind:str # ESCROW, SELLER, BUYER, PLATFORM
+    ref_id:str
+
+
+@dataclass(frozen=True)
+class Leg:
+    account:int|AccountKey # id da conta ou chave (criada se nao existir)
+    asset:Asset
+    amount:int # positivo=credito, negativo=debito
+
+
+@dataclass
+class Journal:
+    legs:list[Leg]
+    ref_type:str
+    ref_id:str
+    memo:str|None = None
+    journal_id:str = field(default_factory=lambda: str(uuid.uuid4()))
+
+
+def check_balanced(journal:Journal)->None:
+    totals:dict[Asset,int] = {}
+    for leg in journal.legs:
+        if leg.amount == 0:
+            raise ValueError("lancamento com valor zero")
+        if isinstance(leg.account, AccountKey) and leg.account.asset != leg.asset:
+            raise ValueError(f"conta {leg.account} nao e de {leg.asset.value}")
+        totals[leg.asset] = totals.get(leg.asset, 0) + leg.amount
+    unbalanced = {a.value: t for a, t in totals.items() if t != 0}
+    if unbalanced:
+        raise ValueError(f"journal {journal.ref_type}:{journal.ref_id} nao fecha em zero: {unbalanced}")
+
+
+#Resolve/cria todas as contas em um round trip. As linhas inseridas pelo CTE nao sao
+#visiveis no SELECT do mesmo statement, por isso o UNION das duas partes. Uma conta que
+#outra transacao criou e commitou durante o statement nao aparece em nenhuma das duas
+#(o ON CONFLICT espera o commit, mas o snapshot do SELECT e anterior): ver resolve_accounts.
+_RESOLVE_ACCOUNTS = text("""
+WITH wanted AS (
+    SELECT DISTINCT * FROM unnest(CAST(:assets AS asset[]), CAST(:kinds AS text[]), CAST(:ref_ids AS text[]))
+        AS w(asset, kind, ref_id)
+), created AS (
+    INSERT INTO ledger_accounts (asset, kind, ref_id, created_at)
+    SELECT asset, kind, ref_id, now() FROM wanted
+    ON CONFLICT ON CONSTRAINT uq_ledger_accounts DO NOTHING
+    RETURNING id, asset, kind, ref_id
+)
+SELECT id, asset, kind, ref_id FROM created
+UNION ALL
+SELECT a.id, a.asset, a.kind, a.ref_id FROM ledger_accounts a
+JOIN wanted w ON (a.asset, a.kind, a.ref_id) = (w.asset, w.kind, w.ref_id)
+""")
+
+
+def _resolve(session:Session, keys:list[AccountKey])->dict[AccountKey,int]:
+    rows = session.execute(_RESOLVE_ACCOUNTS, {
+        "assets": [k.asset.value for k in keys],
+        "kinds": [k.kind for k in keys],
+        "ref_ids": [k.ref_id for k in keys],
+    })
+    return {AccountKey(Asset(asset), kind, ref_id): account_id for account_id, asset, kind, ref_id in rows}
+
+
+def resolve_accounts(session:Session, keys:set[AccountKey])->dict[AccountKey,int]:
+    if not keys:
+        return {}
+    ordered = sorted(keys, key=lambda k: (k.asset.value, k.kind, k.ref_id))
+    found = _resolve(session, ordered)
+    missing = [k for k in ordered if k not in found]
+    if missing:
+        #criadas por uma transacao concorrente que commitou durante o statement: um statement
+        #novo (READ COMMITTED) ja enxerga as linhas
+        found.update(_resolve(session, missing))
+        lost = [k for k in missing if k not in found]
+        if lost:
+            raise RuntimeError(f"contas do ledger nao resolvidas: {lost}")
+    return found
+
+
+def post_journals(session:Session, journals:list[Journal])->list[int]:
+    """Posta varios journals de uma vez: valida todos (soma zero por ativo), resolve as
+    contas em um round trip, insere as pernas em INSERT multi-VALUES e atualiza
+    ledger_balances num unico upsert. Tudo ou nada, na transacao da sessao."""
+    for journal in journals:
+        check_balanced(journal)
+    accounts = resolve_accounts(session, {leg.account for j in journals for leg in j.legs if isinstance(leg.account, AccountKey)})
+    rows = [
+        {"journal_id": j.journal_id, "asset": leg.asset,
+         "account_id": accounts[leg.account] if isinstance(leg.account, AccountKey) else leg.account,
+         "amount": leg.amount, "memo": j.memo, "ref_type": j.ref_type, "ref_id": j.ref_id}
+        for j in journals for leg in j.legs
+    ]
+    if not rows:
+        return []
+    entry_ids = list(session.scalars(insert(LedgerEntry).returning(LedgerEntry.id, sort_by_parameter_order=True), rows))
+    apply_balances(session, [(r["account_id"], r["asset"], r["amount"], i) for r, i in zip(rows, entry_ids)])
+    return entry_ids
+
+
+def post_journal(session:Session, journal:Journal)->list[int]:
+    return post_journals(session, [journal])
+
+
+def apply_balances(session:Session, entries:list[tuple[int,Asset,int,int]])->None:
+    """Soma os lancamentos (account_id, asset, amount, entry_id) em ledger_balances com um
+    unico upsert. Chamado na mesma transacao do INSERT em ledger_entries."""
+    deltas:dict[int,list] = {}
+    for account_id, asset, amount, entry_id in entries:
+        acc = deltas.setdefault(account_id, [asset, 0, entry_id])
+        acc[1] += amount
+        acc[2] = max(acc[2], entry_id)
+    if not deltas:
+        return
+    #Ordem fixa por conta evita deadlock entre postagens concorrentes
+    rows = [{"account_id": a, "asset": v[0], "balance": v[1], "last_entry_id": v[2]} for a, v in sorted(deltas.items())]
+    stmt = pg_insert(LedgerBalance).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[LedgerBalance.account_id],
+        set_={
+            "balance": LedgerBalance.balance + stmt.excluded.balance,
+            "last_entry_id": func.greatest(LedgerBalance.last_entry_id, stmt.excluded.last_entry_id),
+            "updated_at": func.now(),
+        },
+    )
+    session.execute(stmt)
+
+
+def get_balance(session:Session, account_id:int)->int:
+    return session.scalar(select(LedgerBalance.balance).where(LedgerBalance.account_id == account_id)) or 0
+
+
+def get_balances(session:Session, account_ids:list[int])->dict[int,int]:
+    rows = session.execute(select(LedgerBalance.account_id, LedgerBalance.balance).where(LedgerBalance.account_id.in_(account_ids)))
+    found = dict(rows.all())
+    return {a: found.get(a, 0) for a in account_ids}
+
+
+def _entry_totals():
+    return (
+        select(
+            LedgerEntry.account_id,
+            func.min(LedgerEntry.asset).label("asset"),
+            func.sum(LedgerEntry.amount).label("balance"),
+            func.max(LedgerEntry.id).label("last_entry_id"),
+        )
+        .group_by(LedgerEntry.account_id)
+        .subquery()
+    )
+
+
+def rebuild_balances(session:Session)->int:
+    #Recalcula tudo a partir de ledger_entries (recuperacao / migracao)
+    totals = _entry_totals()
+    stmt = pg_insert(LedgerBalance).from_select(
+        ["account_id", "asset", "balance", "last_entry_id", "updated_at"],
+        select(totals.c.account_id, totals.c.asset, totals.c.balance, totals.c.last_entry_id, func.now()),
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[LedgerBalance.account_id],
+        set_={"balance": stmt.excluded.balance, "last_entry_id": stmt.excluded.last_entry_id, "updated_at": func.now()},
+    )
+    return session.execute(stmt).rowcount
+
+
+def verify_balances(session:Session)->list[tuple[int,int,int]]:
+    """Compara ledger_balances com a soma de ledger_entries.
+    Devolve (account_id, saldo_materializado, saldo_real) de cada divergencia."""
+    totals = _entry_totals()
+    account = func.coalesce(LedgerBalance.account_id, totals.c.account_id)
+    stored = func.coalesce(LedgerBalance.balance, 0)
+    actual = func.coalesce(totals.c.balance, 0)
+    rows = session.execute(
+        select(account, stored, actual)
+        .select_from(LedgerBalance.__table__.outerjoin(totals, LedgerBalance.account_id == totals.c.account_id, full=True))
+        .where(stored != actual)
+        .order_by(account)
+    )
+    return list(rows.tuples())
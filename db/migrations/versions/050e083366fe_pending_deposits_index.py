@@ -0,0 +1,28 @@
+"""pending deposits index
+
+Revision ID: 050e083366fe
+Revises: 856ee29b9b98
+Create Date: 2026-10-18 09:12:40.118203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '050e083366fe'
+down_revision: Union[str, Sequence[str], None] = '856ee29b9b98'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_deposits_pending_asset_height', 'deposits', ['asset', 'confirmed_height'], unique=False, postgresql_where=sa.text("status = 'PENDING'"))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_deposits_pending_asset_height', table_name='deposits', postgresql_where=sa.text("status = 'PENDING'"))
@@ -0,0 +1,30 @@
+"""webhook events queue
+
+Revision ID: 3580489a3dd6
+Revises: 7c324e4159f2
+Create Date: 2026-10-18 11:58:12.640381
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3580489a3dd6'
+down_revision: Union[str, Sequence[str], None] = '7c324e4159f2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('webhook_events', sa.Column('received_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False))
+    op.create_index('ix_webhook_events_unprocessed', 'webhook_events', ['id'], unique=False, postgresql_where=sa.text('processed IS FALSE'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_webhook_events_unprocessed', table_name='webhook_events', postgresql_where=sa.text('processed IS FALSE'))
+    op.drop_column('webhook_events', 'received_at')
@@ -0,0 +1,29 @@
+"""escrow version
+
+Revision ID: 3fdcbfa623b9
+Revises: a33c91acf600
+Create Date: 2026-10-18 14:20:11.503127
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3fdcbfa623b9'
+down_revision: Union[str, Sequence[str], None] = 'a33c91acf600'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # server_default constante: no PG 11+ nao reescreve a tabela
+    op.add_column('escrows', sa.Column('version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('escrows', 'version')
@@ -0,0 +1,38 @@
+"""idempotency expiry
+
+Revision ID: 7c324e4159f2
+Revises: aa48d14ec7a6
+Create Date: 2026-10-18 11:20:33.904615
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c324e4159f2'
+down_revision: Union[str, Sequence[str], None] = 'aa48d14ec7a6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.alter_column('idempotency_keys', 'expires_at',
+               existing_type=sa.DateTime(),
+               type_=sa.DateTime(timezone=True),
+               existing_nullable=True,
+               postgresql_using="expires_at AT TIME ZONE 'UTC'")
+    op.create_index('ix_idempotency_keys_expires_at', 'idempotency_keys', ['expires_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_idempotency_keys_expires_at', table_name='idempotency_keys')
+    op.alter_column('idempotency_keys', 'expires_at',
+               existing_type=sa.DateTime(timezone=True),
+               type_=sa.DateTime(),
+               existing_nullable=True,
+               postgresql_using="expires_at AT TIME ZONE 'UTC'")
@@ -0,0 +1,176 @@
+"""monthly partitions and escrow archive
+
+Revision ID: 8d2f4b6a1c3e
+Revises: 3fdcbfa623b9
+Create Date: 2026-10-18 14:20:41.318207
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d2f4b6a1c3e'
+down_revision: Union[str, Sequence[str], None] = '3fdcbfa623b9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+#meses criados alem do corrente; o worker mantem a janela depois (db/partitions.py)
+MONTHS_AHEAD = 2
+
+LEDGER_COLUMNS = 'id, journal_id, asset, account_id, amount, memo, ref_type, ref_id, created_at'
+WEBHOOK_COLUMNS = 'id, provider, kind, idempotency_key, payload, processed, processed_at, received_at'
+
+
+def _monthly_partitions(table: str, column: str, source: str) -> None:
+    # Um particao por mes do dado mais antigo de `source` ate MONTHS_AHEAD meses a frente (UTC)
+    op.execute(f"""
+    DO $$
+    DECLARE m date;
+    BEGIN
+        FOR m IN SELECT generate_series(
+            coalesce((SELECT date_trunc('month', min({column}) AT TIME ZONE 'UTC') FROM {source}), date_trunc('month', now() AT TIME ZONE 'UTC')),
+            date_trunc('month', now() AT TIME ZONE 'UTC') + interval '{MONTHS_AHEAD} months',
+            interval '1 month')::date
+        LOOP
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF {table} FOR VALUES FROM (%L) TO (%L)',
+                '{table}_' || to_char(m, 'YYYYMM'),
+                (m::timestamp AT TIME ZONE 'UTC'),
+                ((m + interval '1 month')::timestamp AT TIME ZONE 'UTC'));
+        END LOOP;
+    END $$;
+    """)
+
+
+def _restart_identity(table: str) -> None:
+    op.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), coalesce(max(id), 0) + 1, false) FROM {table}")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # ledger_entries: copia para a tabela particionada por created_at
+    op.execute('ALTER TABLE ledger_entries RENAME TO ledger_entries_unpartitioned')
+    op.execute('ALTER TABLE ledger_entries_unpartitioned RENAME CONSTRAINT ledger_entries_pkey TO ledger_entries_unpartitioned_pkey')
+    op.drop_index('ix_ledger_entries_account_id', table_name='ledger_entries_unpartitioned')
+    op.drop_index('ix_ledger_entries_asset', table_name='ledger_entries_unpartitioned')
+    op.drop_index('ix_ledger_entries_journal_id', table_name='ledger_entries_unpartitioned')
+    op.create_table('ledger_entries',
+    sa.Column('id', sa.BigInteger(), sa.Identity(always=False), nullable=False),
+    sa.Column('journal_id', sa.String(length=36), nullable=False),
+    sa.Column('asset', postgresql.ENUM('BTC', 'XMR', name='asset', create_type=False), nullable=False),
+    sa.Column('account_id', sa.Integer(), nullable=False),
+    sa.Column('amount', sa.BigInteger(), nullable=False),
+    sa.Column('memo', sa.Text(), nullable=True),
+    sa.Column('ref_type', sa.Text(), nullable=False),
+    sa.Column('ref_id', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+    sa.CheckConstraint('amount <> 0', name='ck_ledger_entries_amount_nonzero'),
+    sa.ForeignKeyConstraint(['account_id'], ['ledger_accounts.id'], ),
+    sa.PrimaryKeyConstraint('id', 'created_at'),
+    postgresql_partition_by='RANGE (created_at)'
+    )
+    _monthly_partitions('ledger_entries', 'created_at', 'ledger_entries_unpartitioned')
+    op.execute(f'INSERT INTO ledger_entries ({LEDGER_COLUMNS}) SELECT {LEDGER_COLUMNS} FROM ledger_entries_unpartitioned')
+    op.drop_table('ledger_entries_unpartitioned')
+    _restart_identity('ledger_entries')
+    op.create_index('ix_ledger_entries_account_id', 'ledger_entries', ['account_id'], unique=False)
+    op.create_index('ix_ledger_entries_asset', 'ledger_entries', ['asset'], unique=False)
+    op.create_index('ix_ledger_entries_journal_id', 'ledger_entries', ['journal_id'], unique=False)
+
+    # webhook_events: dedupe sai para webhook_event_keys (UNIQUE nao pode ignorar received_at)
+    op.create_table('webhook_event_keys',
+    sa.Column('idempotency_key', sa.Text(), nullable=False),
+    sa.Column('kind', sa.Text(), nullable=False),
+    sa.Column('received_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('idempotency_key', 'kind')
+    )
+    op.create_index('ix_webhook_event_keys_received_at', 'webhook_event_keys', ['received_at'], unique=False)
+    op.execute('INSERT INTO webhook_event_keys (idempotency_key, kind, received_at) SELECT idempotency_key, kind, received_at FROM webhook_events')
+    op.execute('ALTER TABLE webhook_events RENAME TO webhook_events_unpartitioned')
+    op.execute('ALTER TABLE webhook_events_unpartitioned RENAME CONSTRAINT webhook_events_pkey TO webhook_events_unpartitioned_pkey')
+    op.drop_constraint('uq_webhook', 'webhook_events_unpartitioned', type_='unique')
+    op.drop_index('ix_webhook_events_unprocessed', table_name='webhook_events_unpartitioned', postgresql_where=sa.text('processed IS FALSE'))
+    op.create_table('webhook_events',
+    sa.Column('id', sa.BigInteger(), sa.Identity(always=False), nullable=False),
+    sa.Column('provider', sa.Text(), nullable=False),
+    sa.Column('kind', sa.Text(), nullable=False),
+    sa.Column('idempotency_key', sa.Text(), nullable=False),
+    sa.Column('payload', sa.JSON(), nullable=False),
+    sa.Column('processed', sa.Boolean(), nullable=False),
+    sa.Column('processed_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('received_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id', 'received_at'),
+    postgresql_partition_by='RANGE (received_at)'
+    )
+    _monthly_partitions('webhook_events', 'received_at', 'webhook_events_unpartitioned')
+    op.execute(f'INSERT INTO webhook_events ({WEBHOOK_COLUMNS}) SELECT {WEBHOOK_COLUMNS} FROM webhook_events_unpartitioned')
+    op.drop_table('webhook_events_unpartitioned')
+    _restart_identity('webhook_events')
+    op.create_index('ix_webhook_events_unprocessed', 'webhook_events', ['id'], unique=False, postgresql_where=sa.text('processed IS FALSE'))
+
+    op.create_table('escrow_archive',
+    sa.Column('escrow_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('asset', postgresql.ENUM('BTC', 'XMR', name='asset', create_type=False), nullable=False),
+    sa.Column('archive_file', sa.Text(), nullable=False),
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('closed_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('archived_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('escrow_id')
+    )
+    op.create_index('ix_escrow_archive_archive_file', 'escrow_archive', ['archive_file'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_escrow_archive_archive_file', table_name='escrow_archive')
+    op.drop_table('escrow_archive')
+
+    op.execute('ALTER TABLE webhook_events RENAME TO webhook_events_partitioned')
+    op.drop_index('ix_webhook_events_unprocessed', table_name='webhook_events_partitioned', postgresql_where=sa.text('processed IS FALSE'))
+    op.create_table('webhook_events',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('provider', sa.Text(), nullable=False),
+    sa.Column('kind', sa.Text(), nullable=False),
+    sa.Column('idempotency_key', sa.Text(), nullable=False),
+    sa.Column('payload', sa.JSON(), nullable=False),
+    sa.Column('processed', sa.Boolean(), nullable=False),
+    sa.Column('processed_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('received_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('idempotency_key', 'kind', name='uq_webhook')
+    )
+    op.execute(f'INSERT INTO webhook_events ({WEBHOOK_COLUMNS}) SELECT {WEBHOOK_COLUMNS} FROM webhook_events_partitioned')
+    op.drop_table('webhook_events_partitioned')
+    _restart_identity('webhook_events')
+    op.create_index('ix_webhook_events_unprocessed', 'webhook_events', ['id'], unique=False, postgresql_where=sa.text('processed IS FALSE'))
+    op.drop_index('ix_webhook_event_keys_received_at', table_name='webhook_event_keys')
+    op.drop_table('webhook_event_keys')
+
+    op.execute('ALTER TABLE ledger_entries RENAME TO ledger_entries_partitioned')
+    op.drop_index('ix_ledger_entries_account_id', table_name='ledger_entries_partitioned')
+    op.drop_index('ix_ledger_entries_asset', table_name='ledger_entries_partitioned')
+    op.drop_index('ix_ledger_entries_journal_id', table_name='ledger_entries_partitioned')
+    op.create_table('ledger_entries',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('journal_id', sa.String(length=36), nullable=False),
+    sa.Column('asset', postgresql.ENUM('BTC', 'XMR', name='asset', create_type=False), nullable=False),
+    sa.Column('account_id', sa.Integer(), nullable=False),
+    sa.Column('amount', sa.BigInteger(), nullable=False),
+    sa.Column('memo', sa.Text(), nullable=True),
+    sa.Column('ref_type', sa.Text(), nullable=False),
+    sa.Column('ref_id', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+    sa.CheckConstraint('amount <> 0', name='ck_ledger_entries_amount_nonzero'),
+    sa.ForeignKeyConstraint(['account_id'], ['ledger_accounts.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute(f'INSERT INTO ledger_entries ({LEDGER_COLUMNS}) SELECT {LEDGER_COLUMNS} FROM ledger_entries_partitioned')
+    op.drop_table('ledger_entries_partitioned')
+    _restart_identity('ledger_entries')
+    op.create_index('ix_ledger_entries_account_id', 'ledger_entries', ['account_id'], unique=False)
+    op.create_index('ix_ledger_entries_asset', 'ledger_entries', ['asset'], unique=False)
+    op.create_index('ix_ledger_entries_journal_id', 'ledger_entries', ['journal_id'], unique=False)
@@ -0,0 +1,42 @@
+"""destination pool
+
+Revision ID: a33c91acf600
+Revises: 3580489a3dd6
+Create Date: 2026-10-18 13:05:47.218864
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a33c91acf600'
+down_revision: Union[str, Sequence[str], None] = '3580489a3dd6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('destination_pool',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('asset', postgresql.ENUM('BTC', 'XMR', name='asset', create_type=False), nullable=False),
+    sa.Column('destination', sa.Text(), nullable=False),
+    sa.Column('meta', sa.JSON(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('claimed_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('escrow_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['escrow_id'], ['escrows.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('destination', name='uq_destination_pool_destination')
+    )
+    op.create_index('ix_destination_pool_available', 'destination_pool', ['asset', 'id'], unique=False, postgresql_where=sa.text('claimed_at IS NULL'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_destination_pool_available', table_name='destination_pool', postgresql_where=sa.text('claimed_at IS NULL'))
+    op.drop_table('destination_pool')
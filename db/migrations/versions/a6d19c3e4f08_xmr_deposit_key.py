@@ -0,0 +1,35 @@
+"""unique (txid, destination) for deposits without vout
+
+Revision ID: a6d19c3e4f08
+Revises: f27c6d0b9e14
+Create Date: 2026-10-18 21:40:12.583014
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a6d19c3e4f08'
+down_revision: Union[str, Sequence[str], None] = 'f27c6d0b9e14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    #duplicatas XMR que o ON CONFLICT em (txid, vout) deixou passar: fica a primeira vista
+    op.execute("""
+        DELETE FROM deposits d
+        USING deposits k
+        WHERE d.vout IS NULL AND k.vout IS NULL
+          AND d.txid = k.txid AND d.destination = k.destination AND d.id > k.id
+    """)
+    op.create_index('uq_deposits_txid_destination_novout', 'deposits', ['txid', 'destination'], unique=True, postgresql_where=sa.text('vout IS NULL'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('uq_deposits_txid_destination_novout', table_name='deposits', postgresql_where=sa.text('vout IS NULL'))
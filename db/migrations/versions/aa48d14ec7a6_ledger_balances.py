@@ -0,0 +1,43 @@
+"""ledger balances
+
+Revision ID: aa48d14ec7a6
+Revises: c99f5e3dfdd3
+Create Date: 2026-10-18 10:41:07.552930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'aa48d14ec7a6'
+down_revision: Union[str, Sequence[str], None] = 'c99f5e3dfdd3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('ledger_balances',
+    sa.Column('account_id', sa.Integer(), nullable=False),
+    sa.Column('asset', postgresql.ENUM('BTC', 'XMR', name='asset', create_type=False), nullable=False),
+    sa.Column('balance', sa.BigInteger(), nullable=False),
+    sa.Column('last_entry_id', sa.BigInteger(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+    sa.ForeignKeyConstraint(['account_id'], ['ledger_accounts.id'], ),
+    sa.PrimaryKeyConstraint('account_id')
+    )
+    # Backfill a partir do historico existente
+    op.execute(
+        "INSERT INTO ledger_balances (account_id, asset, balance, last_entry_id, updated_at) "
+        "SELECT account_id, min(asset::text)::asset, sum(amount), max(id), now() "
+        "FROM ledger_entries GROUP BY account_id"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('ledger_balances')
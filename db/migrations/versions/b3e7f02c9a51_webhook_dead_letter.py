@@ -0,0 +1,36 @@
+"""webhook events attempts and dead-letter
+
+Revision ID: b3e7f02c9a51
+Revises: a6d19c3e4f08
+Create Date: 2026-10-18 22:05:31.904127
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3e7f02c9a51'
+down_revision: Union[str, Sequence[str], None] = 'a6d19c3e4f08'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('webhook_events', sa.Column('attempts', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('webhook_events', sa.Column('last_error', sa.Text(), nullable=True))
+    op.add_column('webhook_events', sa.Column('dead_at', sa.DateTime(timezone=True), nullable=True))
+    op.drop_index('ix_webhook_events_unprocessed', table_name='webhook_events', postgresql_where=sa.text('processed IS FALSE'))
+    op.create_index('ix_webhook_events_unprocessed', 'webhook_events', ['id'], unique=False, postgresql_where=sa.text('processed IS FALSE AND dead_at IS NULL'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_webhook_events_unprocessed', table_name='webhook_events', postgresql_where=sa.text('processed IS FALSE AND dead_at IS NULL'))
+    op.create_index('ix_webhook_events_unprocessed', 'webhook_events', ['id'], unique=False, postgresql_where=sa.text('processed IS FALSE'))
+    op.drop_column('webhook_events', 'dead_at')
+    op.drop_column('webhook_events', 'last_error')
+    op.drop_column('webhook_events', 'attempts')
@@ -0,0 +1,49 @@
+"""outbox events and notification subscribers
+
+Revision ID: c41e7a9d05b2
+Revises: 8d2f4b6a1c3e
+Create Date: 2026-10-18 16:02:13.540877
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41e7a9d05b2'
+down_revision: Union[str, Sequence[str], None] = '8d2f4b6a1c3e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('outbox_events',
+    sa.Column('id', sa.BigInteger(), sa.Identity(always=False), nullable=False),
+    sa.Column('kind', sa.Text(), nullable=False),
+    sa.Column('escrow_id', sa.Integer(), nullable=False),
+    sa.Column('asset', postgresql.ENUM('BTC', 'XMR', name='asset', create_type=False), nullable=False),
+    sa.Column('payload', sa.JSON(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('notification_subscribers',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('url', sa.Text(), nullable=False),
+    sa.Column('secret', sa.Text(), nullable=False),
+    sa.Column('kinds', sa.JSON(), nullable=True),
+    sa.Column('max_inflight', sa.Integer(), server_default='4', nullable=False),
+    sa.Column('active', sa.Boolean(), server_default=sa.text('true'), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+    sa.CheckConstraint('max_inflight > 0', name='ck_notification_subscribers_max_inflight_pos'),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('notification_subscribers')
+    op.drop_table('outbox_events')
@@ -0,0 +1,28 @@
+"""payout batches keep the signed tx until the node accepts it
+
+Revision ID: c8a4e61b7d23
+Revises: b3e7f02c9a51
+Create Date: 2026-10-18 22:31:07.216445
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c8a4e61b7d23'
+down_revision: Union[str, Sequence[str], None] = 'b3e7f02c9a51'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('payout_batches', sa.Column('raw_tx', sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('payout_batches', 'raw_tx')
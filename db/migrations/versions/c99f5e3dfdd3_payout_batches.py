@@ -0,0 +1,54 @@
+"""payout batches
+
+Revision ID: c99f5e3dfdd3
+Revises: 050e083366fe
+Create Date: 2026-10-18 10:03:51.402117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c99f5e3dfdd3'
+down_revision: Union[str, Sequence[str], None] = '050e083366fe'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('payout_batches',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('asset', postgresql.ENUM('BTC', 'XMR', name='asset', create_type=False), nullable=False),
+    sa.Column('txid', sa.Text(), nullable=False),
+    sa.Column('status', postgresql.ENUM('BROADCAST', 'CONFIRMED', 'FAILED', name='payout_status', create_type=False), nullable=False),
+    sa.Column('feerate_profile', postgresql.ENUM('fast', 'normal', 'slow', name='feerate_profile', create_type=False), nullable=True),
+    sa.Column('feerate_sat_vb', sa.Float(), nullable=False),
+    sa.Column('vbytes_est', sa.Integer(), nullable=False),
+    sa.Column('fee', sa.BigInteger(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('broadcast_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('confirmed_at', sa.DateTime(timezone=True), nullable=True),
+    sa.CheckConstraint('fee >= 0', name='ck_payout_batches_fee_nonneg'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('txid', name='uq_payout_batches_txid')
+    )
+    op.create_index('ix_payout_batches_status', 'payout_batches', ['status'], unique=False)
+    op.add_column('payouts', sa.Column('batch_id', sa.Integer(), nullable=True))
+    op.create_foreign_key('fk_payouts_batch_id_payout_batches', 'payouts', 'payout_batches', ['batch_id'], ['id'])
+    op.create_index('ix_payouts_batch_id', 'payouts', ['batch_id'], unique=False)
+    op.drop_constraint('uq_payouts_txid', 'payouts', type_='unique')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_unique_constraint('uq_payouts_txid', 'payouts', ['txid'])
+    op.drop_index('ix_payouts_batch_id', table_name='payouts')
+    op.drop_constraint('fk_payouts_batch_id_payout_batches', 'payouts', type_='foreignkey')
+    op.drop_column('payouts', 'batch_id')
+    op.drop_index('ix_payout_batches_status', table_name='payout_batches')
+    op.drop_table('payout_batches')
@@ -0,0 +1,34 @@
+"""SIGNED payout status for RBF replacements awaiting the node
+
+Revision ID: d5f1a8c3b640
+Revises: c8a4e61b7d23
+Create Date: 2026-10-18 23:02:44.671390
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5f1a8c3b640'
+down_revision: Union[str, Sequence[str], None] = 'c8a4e61b7d23'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    #valor novo de enum so pode ser usado (no indice abaixo) depois de commitado
+    with op.get_context().autocommit_block():
+        op.execute("ALTER TYPE payout_status ADD VALUE IF NOT EXISTS 'SIGNED' BEFORE 'BROADCAST'")
+    op.create_index('uq_payout_batches_pending_replacement', 'payout_batches', ['replaces_id'], unique=True, postgresql_where=sa.text("status = 'SIGNED'"))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('uq_payout_batches_pending_replacement', table_name='payout_batches', postgresql_where=sa.text("status = 'SIGNED'"))
+    #Postgres nao remove valor de enum: substitutas pendentes viram FAILED e o SIGNED fica sem uso
+    op.execute("UPDATE payouts SET status = 'FAILED' WHERE status = 'SIGNED'")
+    op.execute("UPDATE payout_batches SET status = 'FAILED' WHERE status = 'SIGNED'")
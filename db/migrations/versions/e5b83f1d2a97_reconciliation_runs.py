@@ -0,0 +1,66 @@
+"""wallet reconciliation runs and discrepancies
+
+Revision ID: e5b83f1d2a97
+Revises: c41e7a9d05b2
+Create Date: 2026-10-18 18:41:05.117302
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5b83f1d2a97'
+down_revision: Union[str, Sequence[str], None] = 'c41e7a9d05b2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('reconciliation_runs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('asset', postgresql.ENUM('BTC', 'XMR', name='asset', create_type=False), nullable=False),
+    sa.Column('from_height', sa.Integer(), nullable=False),
+    sa.Column('to_height', sa.Integer(), nullable=False),
+    sa.Column('ledger_entry_id', sa.BigInteger(), nullable=False),
+    sa.Column('wallet_items', sa.Integer(), nullable=False),
+    sa.Column('db_items', sa.Integer(), nullable=False),
+    sa.Column('discrepancies', sa.Integer(), nullable=False),
+    sa.Column('started_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('finished_at', sa.DateTime(timezone=True), nullable=False),
+    sa.CheckConstraint('to_height >= from_height', name='ck_reconciliation_runs_range'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_reconciliation_runs_asset_to_height', 'reconciliation_runs', ['asset', 'to_height'], unique=False)
+    op.create_table('reconciliation_discrepancies',
+    sa.Column('id', sa.BigInteger(), sa.Identity(always=False), nullable=False),
+    sa.Column('run_id', sa.Integer(), nullable=False),
+    sa.Column('asset', postgresql.ENUM('BTC', 'XMR', name='asset', create_type=False), nullable=False),
+    sa.Column('kind', sa.Text(), nullable=False),
+    sa.Column('txid', sa.Text(), nullable=True),
+    sa.Column('vout', sa.Integer(), nullable=True),
+    sa.Column('address', sa.Text(), nullable=True),
+    sa.Column('height', sa.Integer(), nullable=True),
+    sa.Column('wallet_amount', sa.BigInteger(), nullable=True),
+    sa.Column('db_amount', sa.BigInteger(), nullable=True),
+    sa.Column('detail', sa.Text(), nullable=True),
+    sa.ForeignKeyConstraint(['run_id'], ['reconciliation_runs.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_reconciliation_discrepancies_run_id', 'reconciliation_discrepancies', ['run_id'], unique=False)
+    op.create_index('ix_reconciliation_discrepancies_txid', 'reconciliation_discrepancies', ['txid'], unique=False)
+    op.create_index('ix_deposits_asset_confirmed_height', 'deposits', ['asset', 'confirmed_height'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_deposits_asset_confirmed_height', table_name='deposits')
+    op.drop_index('ix_reconciliation_discrepancies_txid', table_name='reconciliation_discrepancies')
+    op.drop_index('ix_reconciliation_discrepancies_run_id', table_name='reconciliation_discrepancies')
+    op.drop_table('reconciliation_discrepancies')
+    op.drop_index('ix_reconciliation_runs_asset_to_height', table_name='reconciliation_runs')
+    op.drop_table('reconciliation_runs')
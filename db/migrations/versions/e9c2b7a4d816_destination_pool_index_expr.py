@@ -0,0 +1,30 @@
+"""expression indexes for the max derivation index in destination_pool
+
+Revision ID: e9c2b7a4d816
+Revises: d5f1a8c3b640
+Create Date: 2026-10-18 23:41:09.215337
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e9c2b7a4d816'
+down_revision: Union[str, Sequence[str], None] = 'd5f1a8c3b640'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_destination_pool_index', 'destination_pool', ['asset', sa.text("((meta->>'index')::int)")])
+    op.create_index('ix_destination_pool_subaddr_index', 'destination_pool', ['asset', sa.text("((meta->>'subaddr_index')::int)")])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_destination_pool_subaddr_index', table_name='destination_pool')
+    op.drop_index('ix_destination_pool_index', table_name='destination_pool')
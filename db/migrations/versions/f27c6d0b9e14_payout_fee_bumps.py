@@ -0,0 +1,41 @@
+"""payout fee bumps (RBF replacement chain and CPFP child)
+
+Revision ID: f27c6d0b9e14
+Revises: e5b83f1d2a97
+Create Date: 2026-10-18 20:12:48.305611
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f27c6d0b9e14'
+down_revision: Union[str, Sequence[str], None] = 'e5b83f1d2a97'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('payout_batches', sa.Column('replaces_id', sa.Integer(), nullable=True))
+    op.add_column('payout_batches', sa.Column('first_broadcast_at', sa.DateTime(timezone=True), nullable=True))
+    op.add_column('payout_batches', sa.Column('bumps', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('payout_batches', sa.Column('cpfp_txid', sa.Text(), nullable=True))
+    op.add_column('payout_batches', sa.Column('cpfp_fee', sa.BigInteger(), nullable=True))
+    op.create_foreign_key('fk_payout_batches_replaces_id_payout_batches', 'payout_batches', 'payout_batches', ['replaces_id'], ['id'])
+    op.create_index('ix_payout_batches_replaces_id', 'payout_batches', ['replaces_id'], unique=False)
+    op.execute("UPDATE payout_batches SET first_broadcast_at = broadcast_at")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_payout_batches_replaces_id', table_name='payout_batches')
+    op.drop_constraint('fk_payout_batches_replaces_id_payout_batches', 'payout_batches', type_='foreignkey')
+    op.drop_column('payout_batches', 'cpfp_fee')
+    op.drop_column('payout_batches', 'cpfp_txid')
+    op.drop_column('payout_batches', 'bumps')
+    op.drop_column('payout_batches', 'first_broadcast_at')
+    op.drop_column('payout_batches', 'replaces_id')
@@ -1,10 +1,10 @@
 from datetime import datetime, timezone
 import uuid
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
-from sqlalchemy import JSON, BigInteger, Boolean, CheckConstraint, DateTime, Enum, ForeignKey, Index, Integer, Text, UniqueConstraint, String
+from sqlalchemy import JSON, BigInteger, Boolean, CheckConstraint, DateTime, Enum, ForeignKey, Identity, Index, Integer, Text, UniqueConstraint, String
 from domain.types import *
 
-from sqlalchemy.sql import expression
+from sqlalchemy.sql import expression, func
 
 class Base(DeclarativeBase):
     pass
@@ -24,6 +24,7 @@ class Escrow(Base):
     buyer_payout_address:Mapped[str|None]=mapped_column(Text)
     payout_speed_profile:Mapped[SpeedProfile|None] = mapped_column(Enum(SpeedProfile,name="speed_profile"))
     state:Mapped[EscrowState] = mapped_column(Enum(EscrowState, name="escrow_state"), nullable=False, default=EscrowState.CREATED)
+    version:Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0") # +1 a cada transicao (concorrencia otimista)
     delivered_at:Mapped[datetime|None]=mapped_column(DateTime(timezone=True))
     dispute_deadline:Mapped[datetime | None] = mapped_column(DateTime(timezone=True)) # delivered_at + 72h
     auto_release_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True))  # delivered_at + 7d
@@ -80,6 +81,32 @@ class EscrowDestination(Base):
         )
 
 
+class PooledDestination(Base):
+    __tablename__ = "destination_pool"
+
+    # Enderecos/subaddresses gerados em lote pelo worker, reservados na criacao do escrow
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    asset: Mapped[Asset] = mapped_column(Enum(Asset, name="asset"), nullable=False)
+    destination: Mapped[str] = mapped_column(Text, nullable=False)
+    meta: Mapped[dict] = mapped_column(JSON, nullable=False, default=dict) # mesmo formato de EscrowDestination.meta
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
+    claimed_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True))
+    escrow_id: Mapped[int | None] = mapped_column(ForeignKey("escrows.id", ondelete="SET NULL"))
+
+    __table_args__ = (
+        UniqueConstraint("destination", name="uq_destination_pool_destination"),
+        Index(
+            "ix_destination_pool_available",
+            "asset",
+            "id",
+            postgresql_where=expression.text("claimed_at IS NULL")
+        ),
+        # max do indice de derivacao/subaddress por ativo (next_index): leitura na ponta do btree
+        Index("ix_destination_pool_index", "asset", expression.text("((meta->>'index')::int)")).ddl_if(dialect="postgresql"),
+        Index("ix_destination_pool_subaddr_index", "asset", expression.text("((meta->>'subaddr_index')::int)")).ddl_if(dialect="postgresql"),
+    )
+
+
 class Deposit(Base):
     __tablename__ = "deposits"
 
@@ -100,9 +127,26 @@ class Deposit(Base):
 
     __table_args__ = (
         UniqueConstraint("txid", "vout", name="uq_deposits_txid_vout"),
+        # XMR chega com vout NULL e NULLs nao colidem no unique acima: a chave e (txid, destino)
+        Index(
+            "uq_deposits_txid_destination_novout",
+            "txid",
+            "destination",
+            unique=True,
+            postgresql_where=expression.text("vout IS NULL")
+        ),
         Index("ix_deposits_escrow_id", "escrow_id"),
         Index("ix_deposits_destination", "destination"),
         Index("ix_deposits_status", "status"),
+        # Passada de confirmacoes por bloco so enxerga os PENDING do ativo
+        Index(
+            "ix_deposits_pending_asset_height",
+            "asset",
+            "confirmed_height",
+            postgresql_where=expression.text("status = 'PENDING'")
+        ),
+        # Conciliacao com a carteira varre por faixa de altura (worker/reconciliation.py)
+        Index("ix_deposits_asset_confirmed_height", "asset", "confirmed_height"),
         CheckConstraint("amount >= 0", name="ck_deposits_amount_nonneg"),
         CheckConstraint("confirmations_current >= 0", name="ck_deposits_confs_nonneg"),
         )
@@ -122,15 +166,18 @@ class Payout(Base):
     fn_real: Mapped[int | None]
     broadcast_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True))
     confirmed_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True))
+    batch_id: Mapped[int | None] = mapped_column(ForeignKey("payout_batches.id")) # varios escrows numa mesma tx BTC
 
 
     escrow = relationship("Escrow", back_populates="payouts")
     outputs = relationship("PayoutOutput", back_populates="payout")
+    batch = relationship("PayoutBatch", back_populates="payouts")
 
     __table_args__ = (
         Index("ix_payouts_escrow_id", "escrow_id"),
         Index("ix_payouts_status", "status"),
         Index("ix_payouts_txid", "txid"),
+        Index("ix_payouts_batch_id", "batch_id"),
               # Postgres: apenas 1 payout BROADCAST “vivo” por escrow
         Index(
             "uq_one_broadcast_payout_per_escrow",
@@ -138,7 +185,7 @@ class Payout(Base):
             unique=True,
             postgresql_where=(expression.text("status = 'BROADCAST'"))
         ),
-        UniqueConstraint("txid", name="uq_payouts_txid"),
+        # txid nao e mais unico: payouts de um mesmo lote dividem a tx (unicidade em payout_batches)
         # Checks básicos de não-negatividade quando presentes
         CheckConstraint("(fn_est_at_send IS NULL) OR (fn_est_at_send >= 0)", name="ck_payouts_fn_est_nonneg"),
         CheckConstraint("(fn_real IS NULL) OR (fn_real >= 0)", name="ck_payouts_fn_real_nonneg"),
@@ -146,6 +193,45 @@ class Payout(Base):
     )
 
 
+class PayoutBatch(Base):
+    __tablename__ = "payout_batches"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    asset: Mapped[Asset] = mapped_column(Enum(Asset, name="asset"), nullable=False)
+    txid: Mapped[str] = mapped_column(Text, nullable=False)
+    status: Mapped[PayoutStatus] = mapped_column(Enum(PayoutStatus, name="payout_status"), default=PayoutStatus.BROADCAST, nullable=False)
+    feerate_profile: Mapped[SpeedProfile | None] = mapped_column(Enum(SpeedProfile, name="feerate_profile"))
+    feerate_sat_vb: Mapped[float] = mapped_column(nullable=False)
+    vbytes_est: Mapped[int] = mapped_column(nullable=False)
+    fee: Mapped[int] = mapped_column(BigInteger, nullable=False) # soma dos fn_real dos payouts
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
+    broadcast_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True)) # NULL: gravado, node ainda nao aceitou
+    confirmed_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True))
+    # Fee bump (worker/payout_accelerator.py): RBF grava um lote novo que substitui este; CPFP fica no proprio lote
+    replaces_id: Mapped[int | None] = mapped_column(ForeignKey("payout_batches.id"))
+    first_broadcast_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True)) # do lote original da cadeia
+    bumps: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+    cpfp_txid: Mapped[str | None] = mapped_column(Text)
+    cpfp_fee: Mapped[int | None] = mapped_column(BigInteger)
+    raw_tx: Mapped[str | None] = mapped_column(Text) # hex assinado: gravado antes do broadcast para retransmitir
+
+    payouts = relationship("Payout", back_populates="batch")
+
+    __table_args__ = (
+        UniqueConstraint("txid", name="uq_payout_batches_txid"),
+        Index("ix_payout_batches_status", "status"),
+        Index("ix_payout_batches_replaces_id", "replaces_id"),
+        # No maximo uma substituta pendente (SIGNED) por lote
+        Index(
+            "uq_payout_batches_pending_replacement",
+            "replaces_id",
+            unique=True,
+            postgresql_where=expression.text("status = 'SIGNED'")
+        ),
+        CheckConstraint("fee >= 0", name="ck_payout_batches_fee_nonneg"),
+    )
+
+
 class PayoutOutput(Base):
     __tablename__ = "payout_outputs"
 
@@ -203,26 +289,53 @@ class IdempotencyKey(Base):
     request_hash: Mapped[str] = mapped_column(Text, nullable=False)
     response_snapshot: Mapped[dict] = mapped_column(JSON, nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc),nullable=False)
-    expires_at: Mapped[datetime | None]
+    expires_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True))
 
     __table_args__ = (
         UniqueConstraint("key", "endpoint", name="uq_idempotency"),
+        Index("ix_idempotency_keys_expires_at", "expires_at"),
     )
 
 
 class WebhookEvent(Base):
     __tablename__ = "webhook_events"
 
-    id: Mapped[int] = mapped_column(primary_key=True)
+    # Particionada por mes em received_at (db/partitions.py); a PK precisa incluir a chave de particao.
+    # sentinel explicito pelo mesmo motivo de LedgerEntry.id
+    id: Mapped[int] = mapped_column(BigInteger, Identity(), primary_key=True, insert_sentinel=True)
     provider: Mapped[str] = mapped_column(Text, nullable=False)  # BTC ou XMR
     kind: Mapped[str] = mapped_column(Text, nullable=False)      # DEPOSIT
     idempotency_key: Mapped[str] = mapped_column(Text, nullable=False)
     payload: Mapped[dict] = mapped_column(JSON, nullable=False)
     processed: Mapped[bool] = mapped_column(Boolean, default=False,nullable=False)
     processed_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True))
+    attempts: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False) # falhas do handler
+    last_error: Mapped[str | None] = mapped_column(Text)
+    dead_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True)) # dead-letter: fora da fila ate alguem limpar
+    received_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), primary_key=True, default=lambda: datetime.now(timezone.utc), server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        # Fila de consumo: so os nao processados e fora da dead-letter, em ordem de chegada
+        Index(
+            "ix_webhook_events_unprocessed",
+            "id",
+            postgresql_where=expression.text("processed IS FALSE AND dead_at IS NULL")
+        ),
+        {"postgresql_partition_by": "RANGE (received_at)"},
+    )
+
+
+class WebhookEventKey(Base):
+    __tablename__ = "webhook_event_keys"
+
+    # Dedupe dos webhooks: UNIQUE em tabela particionada teria que incluir received_at,
+    # entao a chave fica aqui (tabela estreita) e sai junto com a particao do mes
+    idempotency_key: Mapped[str] = mapped_column(Text, primary_key=True)
+    kind: Mapped[str] = mapped_column(Text, primary_key=True)
+    received_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
 
     __table_args__ = (
-        UniqueConstraint("idempotency_key", "kind", name="uq_webhook"),
+        Index("ix_webhook_event_keys_received_at", "received_at"),
     )
 
 class LedgerAccount(Base):
@@ -243,7 +356,10 @@ class LedgerAccount(Base):
 class LedgerEntry(Base):
     __tablename__ = "ledger_entries"
 
-    id: Mapped[int] = mapped_column(primary_key=True)
+    # Particionada por mes em created_at (db/partitions.py); a PK precisa incluir a chave de particao.
+    # sentinel: com PK composta o SQLAlchemy nao acha sozinho a coluna que ordena o RETURNING do
+    # INSERT multi-linha (post_journals, sort_by_parameter_order) e cairia em um INSERT por linha
+    id: Mapped[int] = mapped_column(BigInteger, Identity(), primary_key=True, insert_sentinel=True)
     journal_id: Mapped[str] = mapped_column(String(36), default=lambda: str(uuid.uuid4()), nullable=False)
     asset: Mapped[Asset] = mapped_column(Enum(Asset, name="asset"), nullable=False)
     account_id: Mapped[int] = mapped_column(ForeignKey("ledger_accounts.id"),nullable=False)
@@ -251,12 +367,109 @@ class LedgerEntry(Base):
     memo: Mapped[str | None] = mapped_column(Text)
     ref_type: Mapped[str] = mapped_column(Text)
     ref_id: Mapped[str] = mapped_column(Text)
-    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc),nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), primary_key=True, default=lambda: datetime.now(timezone.utc),nullable=False)
 
     __table_args__ = (
         Index("ix_ledger_entries_account_id", "account_id"),
         Index("ix_ledger_entries_journal_id", "journal_id"),
         Index("ix_ledger_entries_asset", "asset"),
         CheckConstraint("amount <> 0", name="ck_ledger_entries_amount_nonzero"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+    
+
+class LedgerBalance(Base):
+    __tablename__ = "ledger_balances"
+
+    # Saldo corrente por conta, atualizado na mesma transacao do lancamento
+    account_id: Mapped[int] = mapped_column(ForeignKey("ledger_accounts.id"), primary_key=True)
+    asset: Mapped[Asset] = mapped_column(Enum(Asset, name="asset"), nullable=False)
+    balance: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    last_entry_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc), nullable=False)
+
+
+class ArchivedEscrow(Base):
+    __tablename__ = "escrow_archive"
+
+    # Indice dos escrows CLOSED movidos para arquivos JSONL.gz (db/archive.py); sem FK, o escrow ja saiu
+    escrow_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    asset: Mapped[Asset] = mapped_column(Enum(Asset, name="asset"), nullable=False)
+    archive_file: Mapped[str] = mapped_column(Text, nullable=False) # relativo a ARCHIVE_DIR
+    sha256: Mapped[str] = mapped_column(String(64), nullable=False) # do arquivo inteiro
+    closed_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False) # updated_at do escrow
+    archived_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
+
+    __table_args__ = (
+        Index("ix_escrow_archive_archive_file", "archive_file"),
+    )
+
+
+class OutboxEvent(Base):
+    __tablename__ = "outbox_events"
+
+    # Gravado na mesma transacao da mudanca; o relay (worker/outbox.py) publica no Redis Stream e apaga
+    id: Mapped[int] = mapped_column(BigInteger, Identity(), primary_key=True)
+    kind: Mapped[str] = mapped_column(Text, nullable=False) # escrow.fund, deposit.confirmed, payout.broadcast...
+    escrow_id: Mapped[int] = mapped_column(Integer, nullable=False) # sem FK: o escrow pode ser arquivado antes
+    asset: Mapped[Asset] = mapped_column(Enum(Asset, name="asset"), nullable=False)
+    payload: Mapped[dict] = mapped_column(JSON, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
+
+
+class NotificationSubscriber(Base):
+    __tablename__ = "notification_subscribers"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    url: Mapped[str] = mapped_column(Text, nullable=False)
+    secret: Mapped[str] = mapped_column(Text, nullable=False) # HMAC-SHA256 do corpo em X-Escrow-Signature
+    kinds: Mapped[list[str] | None] = mapped_column(JSON) # None = todos os eventos
+    max_inflight: Mapped[int] = mapped_column(Integer, nullable=False, default=4, server_default="4") # POSTs simultaneos
+    active: Mapped[bool] = mapped_column(Boolean, nullable=False, default=True, server_default=expression.true())
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
+
+    __table_args__ = (
+        CheckConstraint("max_inflight > 0", name="ck_notification_subscribers_max_inflight_pos"),
+    )
+
+
+class ReconciliationRun(Base):
+    __tablename__ = "reconciliation_runs"
+
+    # Uma linha por janela conciliada (carteira x deposits/payouts/ledger); a maior to_height e o checkpoint
+    id: Mapped[int] = mapped_column(primary_key=True)
+    asset: Mapped[Asset] = mapped_column(Enum(Asset, name="asset"), nullable=False)
+    from_height: Mapped[int] = mapped_column(Integer, nullable=False)
+    to_height: Mapped[int] = mapped_column(Integer, nullable=False) # inclusive
+    ledger_entry_id: Mapped[int] = mapped_column(BigInteger, nullable=False) # lancamentos ate esse id ja conferidos
+    wallet_items: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    db_items: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    discrepancies: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    started_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    finished_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        Index("ix_reconciliation_runs_asset_to_height", "asset", "to_height"),
+        CheckConstraint("to_height >= from_height", name="ck_reconciliation_runs_range"),
+    )
+
+
+class ReconciliationDiscrepancy(Base):
+    __tablename__ = "reconciliation_discrepancies"
+
+    id: Mapped[int] = mapped_column(BigInteger, Identity(), primary_key=True)
+    run_id: Mapped[int] = mapped_column(ForeignKey("reconciliation_runs.id", ondelete="CASCADE"), nullable=False)
+    asset: Mapped[Asset] = mapped_column(Enum(Asset, name="asset"), nullable=False)
+    kind: Mapped[str] = mapped_column(Text, nullable=False) # missing_in_db, missing_in_wallet, amount_mismatch...
+    txid: Mapped[str | None] = mapped_column(Text)
+    vout: Mapped[int | None] = mapped_column(Integer)
+    address: Mapped[str | None] = mapped_column(Text)
+    height: Mapped[int | None] = mapped_column(Integer)
+    wallet_amount: Mapped[int | None] = mapped_column(BigInteger)
+    db_amount: Mapped[int | None] = mapped_column(BigInteger)
+    detail: Mapped[str | None] = mapped_column(Text)
+
+    __table_args__ = (
+        Index("ix_reconciliation_discrepancies_run_id", "run_id"),
+        Index("ix_reconciliation_discrepancies_txid", "txid"),
     )
-    
\ No newline at end of file
@@ -0,0 +1,54 @@
+"""Outbox transacional: eventos de notificacao gravados na mesma transacao da mudanca.
+
+Quem muda estado chama `emit` antes do commit; se a transacao cair, o evento cai junto.
+O relay (worker/outbox.py) le, publica no Redis Stream e apaga as linhas publicadas.
+"""
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+from sqlalchemy import Row, delete, insert, select
+from sqlalchemy.orm import Session
+
+from db.models import Escrow, OutboxEvent
+from domain.types import Asset
+
+
+@dataclass(frozen=True)
+class Outgoing:
+    kind:str
+    escrow_id:int
+    asset:Asset
+    payload:dict
+
+
+def emit(session:Session, events:list[Outgoing])->None:
+    #um INSERT multi-linha por chamada; payload ja precisa ser JSON puro
+    if not events:
+        return
+    now = datetime.now(timezone.utc)
+    session.execute(insert(OutboxEvent), [
+        {"kind": e.kind, "escrow_id": e.escrow_id, "asset": e.asset, "payload": e.payload, "created_at": now}
+        for e in events
+    ])
+
+
+def escrow_event(kind:str, escrow:Escrow)->Outgoing:
+    return Outgoing(kind, escrow.id, escrow.asset, {
+        "state": escrow.state.value, "version": escrow.version,
+        "auto_release_at": escrow.auto_release_at.isoformat() if escrow.auto_release_at else None,
+    })
+
+
+def claim_outbox(session:Session, limit:int)->list[Row]:
+    """Apaga e devolve ate `limit` eventos mais antigos (SKIP LOCKED: varios relays em paralelo).
+    Se a publicacao falhar, o rollback devolve as linhas; se o commit falhar depois dela, o
+    evento sai duas vezes. Entrega e at-least-once: assinantes deduplicam pelo id."""
+    oldest = select(OutboxEvent.id).order_by(OutboxEvent.id).limit(limit).with_for_update(skip_locked=True)
+    rows = session.execute(
+        delete(OutboxEvent)
+        .where(OutboxEvent.id.in_(oldest.scalar_subquery()))
+        .returning(OutboxEvent.id, OutboxEvent.kind, OutboxEvent.escrow_id, OutboxEvent.asset,
+                   OutboxEvent.payload, OutboxEvent.created_at)
+        .execution_options(synchronize_session=False)
+    ).all()
+    return sorted(rows, key=lambda e: e.id)
@@ -0,0 +1,82 @@
+from datetime import date, datetime, timezone
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+#tabela particionada por mes -> coluna da chave de particao
+PARTITIONED = {
+    "ledger_entries": "created_at",
+    "webhook_events": "received_at",
+}
+
+
+def month_start(moment:datetime|date)->date:
+    return date(moment.year, moment.month, 1)
+
+
+def add_months(month:date, n:int)->date:
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _utc(month:date)->datetime:
+    return datetime(month.year, month.month, 1, tzinfo=timezone.utc)
+
+
+def partition_name(table:str, month:date)->str:
+    return f"{table}_{month:%Y%m}"
+
+
+def create_partition(session:Session, table:str, month:date)->str:
+    #limites em UTC: [primeiro dia do mes, primeiro dia do mes seguinte)
+    name = partition_name(table, month)
+    session.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} "
+        f"FOR VALUES FROM ('{_utc(month).isoformat()}') TO ('{_utc(add_months(month, 1)).isoformat()}')"
+    ))
+    return name
+
+
+def list_partitions(session:Session, table:str)->list[tuple[str,date]]:
+    rows = session.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = CAST(:table AS regclass) ORDER BY c.relname"
+    ), {"table": table}).scalars()
+    prefix = f"{table}_"
+    return [(name, datetime.strptime(name[len(prefix):], "%Y%m").date()) for name in rows if name.startswith(prefix)]
+
+
+def ensure_partitions(session:Session, ahead:int=2, now:datetime|None=None)->list[str]:
+    """Cria o mes corrente e os `ahead` seguintes em todas as tabelas particionadas.
+    Sem particao DEFAULT: uma linha fora do range falha no INSERT em vez de cair num balde
+    que precisaria ser varrido a cada particao nova."""
+    current = month_start(now or datetime.now(timezone.utc))
+    created = []
+    for table in PARTITIONED:
+        existing = {name for name, _ in list_partitions(session, table)}
+        for n in range(ahead + 1):
+            name = partition_name(table, add_months(current, n))
+            if name not in existing:
+                created.append(create_partition(session, table, add_months(current, n)))
+    return created
+
+
+def drop_webhook_partitions(session:Session, keep_months:int, now:datetime|None=None)->list[str]:
+    """Remove particoes de webhook_events anteriores a `keep_months` meses, desde que todos
+    os eventos delas ja tenham sido processados. Junto saem as chaves de dedupe do periodo.
+    ledger_entries nunca e podado: e o historico contabil."""
+    cutoff = add_months(month_start(now or datetime.now(timezone.utc)), -keep_months)
+    dropped = []
+    for name, month in list_partitions(session, "webhook_events"):
+        if month >= cutoff:
+            continue
+        if session.execute(text(f"SELECT EXISTS (SELECT 1 FROM {name} WHERE processed IS FALSE)")).scalar():
+            continue
+        session.execute(text(f"ALTER TABLE webhook_events DETACH PARTITION {name}"))
+        session.execute(text(f"DROP TABLE {name}"))
+        session.execute(
+            text("DELETE FROM webhook_event_keys WHERE received_at >= :start AND received_at < :until"),
+            {"start": _utc(month), "until": _utc(add_months(month, 1))},
+        )
+        dropped.append(name)
+    return dropped
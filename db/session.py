@@ -0,0 +1,44 @@
+import os
+
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+
+def database_url(driver:str="psycopg")->str:
+    user = os.getenv("POSTGRES_USER")
+    password = os.getenv("POSTGRES_PASSWORD")
+    name = os.getenv("POSTGRES_DB")
+    host = os.getenv("POSTGRES_HOST", "db")
+    port = os.getenv("POSTGRES_PORT", "5432")
+    if not all([user, password, name]):
+        raise RuntimeError("POSTGRES_USER/POSTGRES_PASSWORD/POSTGRES_DB ausentes no .env")
+    return f"postgresql+{driver}://{user}:{password}@{host}:{port}/{name}"
+
+
+def make_engine(url:str|None=None, **kwargs):
+    return create_engine(url or database_url(), pool_pre_ping=True, future=True, **kwargs)
+
+
+def make_sessionmaker(engine=None)->sessionmaker:
+    return sessionmaker(bind=engine or make_engine(), expire_on_commit=False)
+
+
+def make_async_engine(url:str|None=None, **kwargs)->AsyncEngine:
+    #psycopg 3 async. prepare_threshold: execucoes antes do psycopg preparar o statement no
+    #servidor (0 = ja na primeira); com pgbouncer em transaction mode use DB_PREPARE_THRESHOLD=off
+    threshold = os.getenv("DB_PREPARE_THRESHOLD", "2")
+    options = dict(
+        pool_size=int(os.getenv("DB_POOL_SIZE", "20")),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "5")),
+        pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        pool_pre_ping=True,
+        connect_args={"prepare_threshold": None if threshold == "off" else int(threshold)},
+    )
+    options.update(kwargs)
+    return create_async_engine(url or database_url(), **options)
+
+
+def make_async_sessionmaker(engine:AsyncEngine|None=None)->async_sessionmaker:
+    return async_sessionmaker(bind=engine or make_async_engine(), expire_on_commit=False)
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import math
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Iterable, Optional
+
+from domain.types import Asset, EscrowAmounts, SpeedProfile, is_valid_speed, require_positive_int
+
+log = logging.getLogger("fees")
+
+PLATFORM_FEE_BPS = 300 # 3% de P
+
+#Tamanho estimado do payout: BTC em vbytes (1 input + seller/platform/buyer), XMR em bytes
+PAYOUT_SIZE_EST = {
+    Asset.BTC: 11 + 68 + 3 * 31,
+    Asset.XMR: 2000,
+}
+
+#Blocos alvo do estimatesmartfee por perfil
+CONF_TARGET = {
+    SpeedProfile.fast: 2,
+    SpeedProfile.normal: 6,
+    SpeedProfile.slow: 24,
+}
+
+#Usado quando o node nao responde e o cache ja passou do limite de staleness
+DEFAULT_FALLBACK = {
+    (Asset.BTC, SpeedProfile.fast): 25.0, # sat/vB
+    (Asset.BTC, SpeedProfile.normal): 10.0,
+    (Asset.BTC, SpeedProfile.slow): 3.0,
+    (Asset.XMR, None): 20_000.0, # atomic/byte
+}
+
+#taxa, ou (taxa, idade em segundos) quando a fonte e um cache como o hash do Redis
+Estimator = Callable[[Optional[SpeedProfile]], Awaitable[float|tuple[float,float]]]
+
+#Hash no Redis onde o worker publica as taxas do node para a API (que nao fala com os nodes)
+FEE_RATES_KEY = "fees:rates"
+
+
+def rate_field(asset:Asset, profile:SpeedProfile|None)->str:
+    return f"{asset.value}:{profile.value if profile else '-'}"
+
+
+def redis_estimator(redis, asset:Asset, key:str=FEE_RATES_KEY)->Estimator:
+    #campo "taxa@epoch da leitura no node": a idade vai junto e o oracle da API envelhece a taxa
+    #a partir dela, nao do momento em que leu o Redis
+    async def estimate(profile:SpeedProfile|None)->tuple[float,float]:
+        value = await redis.hget(key, rate_field(asset, profile))
+        if value is None:
+            raise LookupError(f"taxa {rate_field(asset, profile)} nao publicada")
+        rate, _, fetched_at = (value.decode() if isinstance(value, bytes) else value).partition("@")
+        if not fetched_at:
+            raise LookupError(f"taxa {rate_field(asset, profile)} sem horario da leitura")
+        return float(rate), max(time.time() - float(fetched_at), 0.0)
+    return estimate
+
+
+def platform_fee(price:int)->int:
+    return (price * PLATFORM_FEE_BPS + 9_999) // 10_000
+
+
+def quote_amounts(asset:Asset, price:int, feerate:float, buffer_ratio:float=0.5)->EscrowAmounts:
+    #D = P + 0,03P + fn_est + buffer
+    require_positive_int("price", price)
+    fn_est = math.ceil(feerate * PAYOUT_SIZE_EST[asset])
+    buffer = math.ceil(fn_est * buffer_ratio)
+    fee = platform_fee(price)
+    return EscrowAmounts(price=price, platform_fee=fee, fn_est=fn_est, buffer=buffer,
+                         deposit_total=price + fee + fn_est + buffer)
+
+
+def _require_speed(asset:Asset, speed:SpeedProfile|None)->None:
+    if not is_valid_speed(asset, speed):
+        raise ValueError(f"perfil de velocidade invalido para {asset.value}: {speed}")
+
+
+@dataclass(frozen=True)
+class FeeRate:
+    rate:float
+    fetched_at:float # time.monotonic()
+    source:str # node | fallback
+
+
+class FeeOracle:
+    """Cache local das taxas por (ativo, SpeedProfile), atualizado em background.
+
+    Leituras nunca chamam o node: devolvem o valor em cache enquanto ele tiver menos de
+    `max_stale` segundos; depois disso (node fora do ar) caem no fallback configurado.
+    """
+
+    def __init__(self, estimators:dict[Asset,Estimator], ttl:float=30.0, max_stale:float=600.0,
+                 fallback:dict[tuple[Asset,SpeedProfile|None],float]|None=None, buffer_ratio:float=0.5)->None:
+        self.estimators = estimators
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.fallback = dict(DEFAULT_FALLBACK if fallback is None else fallback)
+        self.buffer_ratio = buffer_ratio
+        self._cache:dict[tuple[Asset,SpeedProfile|None],FeeRate] = {}
+
+    @staticmethod
+    def profiles(asset:Asset)->tuple[SpeedProfile|None, ...]:
+        return tuple(SpeedProfile) if asset == Asset.BTC else (None,)
+
+    def rate(self, asset:Asset, profile:SpeedProfile|None)->FeeRate:
+        key = (asset, profile)
+        cached = self._cache.get(key)
+        if cached is not None and time.monotonic() - cached.fetched_at <= self.max_stale:
+            return cached
+        return FeeRate(self.fallback[key], time.monotonic(), "fallback")
+
+    def quote(self, asset:Asset, price:int, speed:SpeedProfile|None)->EscrowAmounts:
+        _require_speed(asset, speed)
+        return quote_amounts(asset, price, self.rate(asset, speed).rate, self.buffer_ratio)
+
+    def quote_many(self, items:Iterable[tuple[Asset,int,SpeedProfile|None]])->list[EscrowAmounts|ValueError]:
+        """Cota um lote com uma leitura de taxa por (ativo, perfil); item invalido vira o
+        ValueError na sua posicao em vez de derrubar o lote."""
+        rates:dict[tuple[Asset,SpeedProfile|None],float] = {}
+        quotes:list[EscrowAmounts|ValueError] = []
+        for asset, price, speed in items:
+            try:
+                _require_speed(asset, speed)
+                if (asset, speed) not in rates:
+                    rates[(asset, speed)] = self.rate(asset, speed).rate
+                quotes.append(quote_amounts(asset, price, rates[(asset, speed)], self.buffer_ratio))
+            except ValueError as e:
+                quotes.append(e)
+        return quotes
+
+    async def refresh(self)->None:
+        async def one(asset:Asset, estimator:Estimator, profile:SpeedProfile|None)->None:
+            try:
+                result = await estimator(profile)
+            except Exception:
+                log.warning("estimativa de taxa %s/%s falhou, mantendo cache", asset.value, profile, exc_info=True)
+                return
+            rate, age = result if isinstance(result, tuple) else (result, 0.0)
+            self._cache[(asset, profile)] = FeeRate(rate, time.monotonic() - age, "node")
+        await asyncio.gather(*(
+            one(asset, estimator, profile)
+            for asset, estimator in self.estimators.items()
+            for profile in self.profiles(asset)
+        ))
+
+    async def publish(self, redis, key:str=FEE_RATES_KEY)->None:
+        #so o que veio do node e ainda esta dentro de max_stale, com o epoch da leitura: com o
+        #node fora do ar a taxa velha para de ser publicada e a API cai no fallback junto com o worker
+        now, wall = time.monotonic(), time.time()
+        rates = {
+            rate_field(a, p): f"{r.rate}@{wall - (now - r.fetched_at)}"
+            for (a, p), r in self._cache.items()
+            if r.source == "node" and now - r.fetched_at <= self.max_stale
+        }
+        if rates:
+            async with redis.pipeline(transaction=True) as pipe:
+                pipe.hset(key, mapping=rates)
+                pipe.expire(key, int(self.max_stale))
+                await pipe.execute()
+
+    async def run(self, stopping:Callable[[], bool], sleep:Callable[[float], Awaitable[None]], redis=None)->None:
+        #`sleep` interrompivel pelo shutdown (runtime.sleep no worker), como os outros loops
+        while not stopping():
+            await self.refresh()
+            if redis is not None:
+                try:
+                    await self.publish(redis)
+                except Exception:
+                    log.warning("publicacao das taxas no Redis falhou; tenta de novo no proximo ciclo", exc_info=True)
+            await sleep(self.ttl)
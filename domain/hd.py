@@ -0,0 +1,285 @@
+"""Derivacao BIP32 publica (watch-only) e enderecos P2WPKH, sem node.
+
+So derivacao nao-hardened a partir de um xpub/tpub/zpub/vpub de conta. O no da chain
+(conta/0) fica em cache, entao cada novo indice custa uma derivacao filha: um HMAC-SHA512,
+uma multiplicacao pelo gerador (tabela pre-calculada) e uma soma de pontos.
+"""
+import hashlib
+import hmac
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+
+# secp256k1
+P = 2**256 - 2**32 - 977
+N = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
+G = (0x79BE667EF9DCBBAC55A06295CE870B07029BFCDB2DCE28D959F2815B16F81798,
+     0x483ADA7726A3C4655DA4FBFC0E1108A8FD17B448A68554199C47D08FFB10D4B8)
+
+#versoes de extended public key (mainnet / testnet, legacy e BIP84)
+XPUB_VERSIONS = {
+    bytes.fromhex("0488b21e"): "bc", # xpub
+    bytes.fromhex("04b24746"): "bc", # zpub
+    bytes.fromhex("043587cf"): "tb", # tpub
+    bytes.fromhex("045f1cbe"): "tb", # vpub
+}
+
+
+# --- aritmetica de curva (Jacobiano + tabela de base fixa) ---
+
+def _jac_double(X, Y, Z):
+    if not Y:
+        return 0, 0, 0
+    YY = Y * Y % P
+    S = 4 * X * YY % P
+    M = 3 * X * X % P
+    X3 = (M * M - 2 * S) % P
+    return X3, (M * (S - X3) - 8 * YY * YY) % P, 2 * Y * Z % P
+
+
+def _jac_add_affine(X1, Y1, Z1, x2, y2):
+    #soma mista: (X1,Y1,Z1) jacobiano + (x2,y2) afim
+    if not Z1:
+        return x2, y2, 1
+    Z1Z1 = Z1 * Z1 % P
+    U2 = x2 * Z1Z1 % P
+    S2 = y2 * Z1 * Z1Z1 % P
+    H = (U2 - X1) % P
+    r = (S2 - Y1) % P
+    if not H:
+        return _jac_double(X1, Y1, Z1) if not r else (0, 0, 0)
+    HH = H * H % P
+    HHH = H * HH % P
+    V = X1 * HH % P
+    X3 = (r * r - HHH - 2 * V) % P
+    return X3, (r * (V - X3) - Y1 * HHH) % P, Z1 * H % P
+
+
+def _to_affine(X, Y, Z):
+    zi = pow(Z, -1, P)
+    zi2 = zi * zi % P
+    return X * zi2 % P, Y * zi2 * zi % P
+
+
+_WINDOW = 8
+
+
+@lru_cache(maxsize=1)
+def _g_table()->list[list[tuple[int,int]]]:
+    #table[w][d] = d * 256^w * G, em afim; 32 janelas de 8 bits (~8k pontos, montada uma vez)
+    table = []
+    base = (G[0], G[1], 1)
+    for _ in range(256 // _WINDOW):
+        row = [None]
+        acc = (0, 0, 0)
+        bx, by = _to_affine(*base)
+        for _ in range(1, 1 << _WINDOW):
+            acc = _jac_add_affine(*acc, bx, by)
+            row.append(_to_affine(*acc))
+        table.append(row)
+        for _ in range(_WINDOW):
+            base = _jac_double(*base)
+    return table
+
+
+def _mul_g_jac(k:int):
+    table = _g_table()
+    acc = (0, 0, 0)
+    w = 0
+    while k:
+        d = k & 0xFF
+        if d:
+            acc = _jac_add_affine(*acc, *table[w][d])
+        k >>= _WINDOW
+        w += 1
+    return acc
+
+
+def point_from_bytes(data:bytes)->tuple[int,int]:
+    x = int.from_bytes(data[1:], "big")
+    y = pow((x * x * x + 7) % P, (P + 1) // 4, P)
+    if y & 1 != data[0] & 1:
+        y = P - y
+    return x, y
+
+
+def point_to_bytes(point:tuple[int,int])->bytes:
+    x, y = point
+    return bytes([2 + (y & 1)]) + x.to_bytes(32, "big")
+
+
+# --- hashes / codificacao ---
+
+def _b58decode_check(s:str)->bytes:
+    alphabet = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+    n = 0
+    for c in s:
+        n = n * 58 + alphabet.index(c)
+    raw = n.to_bytes((n.bit_length() + 7) // 8, "big")
+    raw = b"\x00" * (len(s) - len(s.lstrip("1"))) + raw
+    payload, checksum = raw[:-4], raw[-4:]
+    if hashlib.sha256(hashlib.sha256(payload).digest()).digest()[:4] != checksum:
+        raise ValueError("checksum base58 invalido")
+    return payload
+
+
+def _ripemd160_py(data:bytes)->bytes:
+    #fallback puro: OpenSSL 3 sem o provider legacy nao expoe ripemd160 no hashlib
+    import struct
+    r1 = [0,1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,7,4,13,1,10,6,15,3,12,0,9,5,2,14,11,8,
+          3,10,14,4,9,15,8,1,2,7,0,6,13,11,5,12,1,9,11,10,0,8,12,4,13,3,7,15,14,5,6,2,
+          4,0,5,9,7,12,2,10,14,1,3,8,11,6,15,13]
+    r2 = [5,14,7,0,9,2,11,4,13,6,15,8,1,10,3,12,6,11,3,7,0,13,5,10,14,15,8,12,4,9,1,2,
+          15,5,1,3,7,14,6,9,11,8,12,2,10,0,4,13,8,6,4,1,3,11,15,0,5,12,2,13,9,7,10,14,
+          12,15,10,4,1,5,8,7,6,2,13,14,0,3,9,11]
+    s1 = [11,14,15,12,5,8,7,9,11,13,14,15,6,7,9,8,7,6,8,13,11,9,7,15,7,12,15,9,11,7,13,12,
+          11,13,6,7,14,9,13,15,14,8,13,6,5,12,7,5,11,12,14,15,14,15,9,8,9,14,5,6,8,6,5,12,
+          9,15,5,11,6,8,13,12,5,12,13,14,11,8,5,6]
+    s2 = [8,9,9,11,13,15,15,5,7,7,8,11,14,14,12,6,9,13,15,7,12,8,9,11,7,7,12,7,6,15,13,11,
+          9,7,15,11,8,6,6,14,12,13,5,14,13,13,7,5,15,5,8,11,14,14,6,14,6,9,12,9,12,5,15,8,
+          8,5,12,9,12,5,14,6,8,13,6,5,15,13,11,11]
+    k1 = [0x00000000, 0x5A827999, 0x6ED9EBA1, 0x8F1BBCDC, 0xA953FD4E]
+    k2 = [0x50A28BE6, 0x5C4DD124, 0x6D703EF3, 0x7A6D76E9, 0x00000000]
+    fs = [lambda x, y, z: x ^ y ^ z, lambda x, y, z: (x & y) | (~x & z), lambda x, y, z: (x | ~y) ^ z,
+          lambda x, y, z: (x & z) | (y & ~z), lambda x, y, z: x ^ (y | ~z)]
+    rol = lambda x, n: ((x << n) | (x >> (32 - n))) & 0xFFFFFFFF
+    h = [0x67452301, 0xEFCDAB89, 0x98BADCFE, 0x10325476, 0xC3D2E1F0]
+    msg = data + b"\x80" + b"\x00" * ((55 - len(data)) % 64) + struct.pack("<Q", len(data) * 8)
+    for off in range(0, len(msg), 64):
+        x = struct.unpack("<16I", msg[off:off + 64])
+        al, bl, cl, dl, el = h
+        ar, br, cr, dr, er = h
+        for j in range(80):
+            rnd = j // 16
+            t = rol((al + fs[rnd](bl, cl, dl) + x[r1[j]] + k1[rnd]) & 0xFFFFFFFF, s1[j]) + el
+            al, el, dl, cl, bl = el, dl, rol(cl, 10), bl, t & 0xFFFFFFFF
+            t = rol((ar + fs[4 - rnd](br, cr, dr) + x[r2[j]] + k2[rnd]) & 0xFFFFFFFF, s2[j]) + er
+            ar, er, dr, cr, br = er, dr, rol(cr, 10), br, t & 0xFFFFFFFF
+        t = (h[1] + cl + dr) & 0xFFFFFFFF
+        h[1] = (h[2] + dl + er) & 0xFFFFFFFF
+        h[2] = (h[3] + el + ar) & 0xFFFFFFFF
+        h[3] = (h[4] + al + br) & 0xFFFFFFFF
+        h[4] = (h[0] + bl + cr) & 0xFFFFFFFF
+        h[0] = t
+    return struct.pack("<5I", *h)
+
+
+def hash160(data:bytes)->bytes:
+    sha = hashlib.sha256(data).digest()
+    try:
+        return hashlib.new("ripemd160", sha).digest()
+    except ValueError:
+        return _ripemd160_py(sha)
+
+
+_BECH32 = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
+
+
+def _bech32_polymod(values)->int:
+    gen = [0x3B6A57B2, 0x26508E6D, 0x1EA119FA, 0x3D4233DD, 0x2A1462B3]
+    chk = 1
+    for v in values:
+        top = chk >> 25
+        chk = (chk & 0x1FFFFFF) << 5 ^ v
+        for i in range(5):
+            chk ^= gen[i] if (top >> i) & 1 else 0
+    return chk
+
+
+def p2wpkh_address(pubkey:bytes, hrp:str)->str:
+    #segwit v0 (BIP173): witness version + programa de 20 bytes em grupos de 5 bits
+    acc, bits, data = 0, 0, [0]
+    for b in hash160(pubkey):
+        acc = (acc << 8) | b
+        bits += 8
+        while bits >= 5:
+            bits -= 5
+            data.append((acc >> bits) & 31)
+    if bits:
+        data.append((acc << (5 - bits)) & 31)
+    expanded = [ord(c) >> 5 for c in hrp] + [0] + [ord(c) & 31 for c in hrp]
+    polymod = _bech32_polymod(expanded + data + [0] * 6) ^ 1
+    checksum = [(polymod >> 5 * (5 - i)) & 31 for i in range(6)]
+    return hrp + "1" + "".join(_BECH32[d] for d in data + checksum)
+
+
+# --- BIP32 ---
+
+@dataclass(frozen=True)
+class ExtendedPublicKey:
+    key:bytes # 33 bytes comprimido
+    chain_code:bytes
+    hrp:str
+    depth:int = 0
+
+    @classmethod
+    def parse(cls, xpub:str, hrp:str|None=None)->"ExtendedPublicKey":
+        raw = _b58decode_check(xpub)
+        if len(raw) != 78 or raw[:4] not in XPUB_VERSIONS:
+            raise ValueError("extended public key invalida")
+        return cls(key=raw[45:78], chain_code=raw[13:45], hrp=hrp or XPUB_VERSIONS[raw[:4]], depth=raw[4])
+
+    def child(self, index:int)->"ExtendedPublicKey":
+        key, chain_code = ckd_pub(self.key, self.chain_code, index)
+        return ExtendedPublicKey(key, chain_code, self.hrp, self.depth + 1)
+
+    def address(self)->str:
+        return p2wpkh_address(self.key, self.hrp)
+
+
+def ckd_pub(key:bytes, chain_code:bytes, index:int, point:tuple[int,int]|None=None)->tuple[bytes,bytes]:
+    #`point` = key ja descomprimida; o no pai em cache evita a raiz quadrada por filho
+    if index >= 0x80000000:
+        raise ValueError("derivacao hardened exige chave privada")
+    digest = hmac.new(chain_code, key + index.to_bytes(4, "big"), hashlib.sha512).digest()
+    il = int.from_bytes(digest[:32], "big")
+    if il >= N:
+        raise ValueError(f"indice {index} invalido (IL >= n), pule para o proximo")
+    X, Y, Z = _mul_g_jac(il)
+    child = _to_affine(*_jac_add_affine(X, Y, Z, *(point or point_from_bytes(key))))
+    return point_to_bytes(child), digest[32:]
+
+
+def _derive_chunk(key:bytes, chain_code:bytes, hrp:str, start:int, count:int)->list[str]:
+    point = point_from_bytes(key)
+    return [p2wpkh_address(ckd_pub(key, chain_code, i, point)[0], hrp) for i in range(start, start + count)]
+
+
+class HdDeriver:
+    """Deriva enderecos de recebimento de uma conta BIP84 (xpub da conta, chain 0)."""
+
+    def __init__(self, account_xpub:str, chain:int=0, hrp:str|None=None)->None:
+        self.chain_node = ExtendedPublicKey.parse(account_xpub, hrp).child(chain) # cache do no pai
+
+    def address(self, index:int)->str:
+        return self.chain_node.child(index).address()
+
+    def derive_range(self, start:int, count:int)->list[str]:
+        node = self.chain_node
+        return _derive_chunk(node.key, node.chain_code, node.hrp, start, count)
+
+    def derive_range_parallel(self, start:int, count:int, pool:ProcessPoolExecutor, chunk:int=500)->list[str]:
+        node = self.chain_node
+        futures = [
+            pool.submit(_derive_chunk, node.key, node.chain_code, node.hrp, s, min(chunk, start + count - s))
+            for s in range(start, start + count, chunk)
+        ]
+        return [address for f in futures for address in f.result()]
+
+
+#BIP32 (vetor 1, m/0H -> m/0H/1) e BIP84 (mnemonic "abandon ... about", m/84'/0'/0'/0/i)
+TEST_VECTORS = {
+    "bip32": ("xpub68Gmy5EdvgibQVfPdqkBBCHxA5htiqg55crXYuXoQRKfDBFA1WEjWgP6LHhwBZeNK1VTsfTFUHCdrfp1bgwQ9xv5ski8PX9rL2dZXvgGDnw",
+              1, "xpub6ASuArnXKPbfEwhqN6e3mwBcDTgzisQN1wXN9BJcM47sSikHjJf3UFHKkNAWbWMiGj7Wf5uMash7SyYq527Hqck2AxYysAA7xmALppuCkwQ"),
+    "bip84": ("zpub6rFR7y4Q2AijBEqTUquhVz398htDFrtymD9xYYfG1m4wAcvPhXNfE3EfH1r1ADqtfSdVCToUG868RvUUkgDKf31mGDtKsAYz2oz2AGutZYs",
+              ["bc1qcr8te4kr609gcawutmrza0j4xv80jy8z306fyu", "bc1qnjg0jd8228aq7egyzacy8cys3knf9xvrerkf9g"]),
+}
+
+
+def self_check()->None:
+    xpub, index, expected = TEST_VECTORS["bip32"]
+    if ExtendedPublicKey.parse(xpub).child(index) != ExtendedPublicKey.parse(expected):
+        raise AssertionError("vetor BIP32 falhou")
+    zpub, addresses = TEST_VECTORS["bip84"]
+    if HdDeriver(zpub).derive_range(0, len(addresses)) != addresses:
+        raise AssertionError("vetor BIP84 falhou")
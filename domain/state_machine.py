@@ -0,0 +1,59 @@
+import enum
+from dataclasses import dataclass
+
+from domain.types import EscrowState
+
+
+class Event(str, enum.Enum):
+    FUND = "fund"
+    UNFUND = "unfund" # reorg derrubou depositos que completavam o FUNDED
+    DELIVER = "deliver" # marca delivered_at; continua FUNDED
+    RELEASE = "release"
+    AUTO_RELEASE = "auto_release"
+    DISPUTE = "dispute"
+    RESOLVE = "resolve"
+    CLOSE = "close"
+
+
+class InvalidTransition(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class Rule:
+    event:Event
+    sources:frozenset[EscrowState]
+    target:EscrowState
+
+    @property
+    def name(self)->str:
+        #label usado nas metricas, ex: FUNDED->RELEASED:auto_release
+        sources = "|".join(sorted(s.value for s in self.sources))
+        return f"{sources}->{self.target.value}:{self.event.value}"
+
+
+#CREATED -> FUNDED -> RELEASED | DISPUTED -> RESOLVED -> CLOSED
+RULES = (
+    Rule(Event.FUND, frozenset({EscrowState.CREATED}), EscrowState.FUNDED),
+    Rule(Event.UNFUND, frozenset({EscrowState.FUNDED}), EscrowState.CREATED),
+    Rule(Event.DELIVER, frozenset({EscrowState.FUNDED}), EscrowState.FUNDED),
+    Rule(Event.RELEASE, frozenset({EscrowState.FUNDED}), EscrowState.RELEASED),
+    Rule(Event.AUTO_RELEASE, frozenset({EscrowState.FUNDED}), EscrowState.RELEASED),
+    Rule(Event.DISPUTE, frozenset({EscrowState.FUNDED}), EscrowState.DISPUTED),
+    Rule(Event.RESOLVE, frozenset({EscrowState.DISPUTED}), EscrowState.RESOLVED),
+    Rule(Event.CLOSE, frozenset({EscrowState.RELEASED, EscrowState.RESOLVED}), EscrowState.CLOSED),
+)
+
+#Tabelas montadas uma vez no import: regra por evento e (estado, evento) -> destino
+TABLE:dict[Event,Rule] = {r.event: r for r in RULES}
+NEXT:dict[tuple[EscrowState,Event],EscrowState] = {(s, r.event): r.target for r in RULES for s in r.sources}
+ALLOWED:dict[EscrowState,frozenset[Event]] = {
+    state: frozenset(e for (s, e) in NEXT if s == state) for state in EscrowState
+}
+
+
+def next_state(state:EscrowState, event:Event)->EscrowState:
+    try:
+        return NEXT[(state, event)]
+    except KeyError:
+        raise InvalidTransition(f"{event.value} nao e permitido em {state.value}") from None
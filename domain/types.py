@@ -23,6 +23,7 @@ class PayoutKind(str,enum.Enum):
     DISPUTE="DISPUTE"
 
 class PayoutStatus(str,enum.Enum):
+    SIGNED="SIGNED" # substituta RBF gravada, aguardando o node aceitar
     BROADCAST="BROADCAST"
     CONFIRMED="CONFIRMED"
     FAILED="FAILED"
@@ -61,6 +62,12 @@ class EscrowAmounts:
     buffer:int #gordurinha para garantir execucao
     deposit_total:int # D = P + 0,03P + fn_est + buffer
 
+@dataclass(frozen=True)
+class BlockHeader:
+    height:int
+    hash:str
+    prev_hash:str # vazio no genesis
+
 def confirmations_min(asset:Asset)->int:
     return CONFIRMATIONS_MIN[asset]
 
@@ -0,0 +1,31 @@
+import asyncio
+
+from adapters.fake_rpc import fake_monero_wallet
+from adapters.jsonrpc import JsonRpcClient
+from adapters.monero_wallet import MoneroWalletAdapter
+
+
+def _transfer(txid:str, height:int)->dict:
+    return {"txid": txid, "address": f"8sub{txid}", "amount": 1_000, "height": height}
+
+
+def _incoming(transfers:list[dict], min_height:int, max_height:int)->list[dict]:
+    async def run()->list[dict]:
+        wallet = JsonRpcClient("http://wallet/", transport=fake_monero_wallet(transfers).transport())
+        try:
+            return await MoneroWalletAdapter(wallet, wallet).list_incoming(min_height, max_height)
+        finally:
+            await wallet.aclose()
+    return asyncio.run(run())
+
+
+def test_list_incoming_includes_min_height():
+    #rescan apos reorg pede [fork, tip]: deposito re-minerado no proprio fork tem que voltar
+    transfers = [_transfer("a", 99), _transfer("b", 100), _transfer("c", 101), _transfer("d", 102)]
+    found = _incoming(transfers, 100, 101)
+    assert [(t["txid"], t["height"]) for t in found] == [("b", 100), ("c", 101)]
+    assert all(t["vout"] is None for t in found)
+
+
+def test_list_incoming_single_block_range():
+    assert [t["txid"] for t in _incoming([_transfer("a", 100), _transfer("b", 101)], 100, 100)] == ["a"]
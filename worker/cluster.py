@@ -0,0 +1,228 @@
+"""Varios processos de worker: registro, shards por escrow/ativo e lideranca por tarefa.
+
+Cada no se registra no Redis (ZSET com o ultimo heartbeat + ativos que atende). A partir
+da lista de nos vivos, todos calculam a mesma divisao dos shards (escrow_id % SHARDS, por
+ativo) com rendezvous hashing: quando um no entra ou morre, so os shards dele mudam de dono.
+Tarefas que so podem rodar em um lugar (tip de cada ativo, prazos, manutencao) ficam com
+quem segura o advisory lock do Postgres da tarefa, numa conexao dedicada: se o processo
+morre, o Postgres solta o lock e outro no assume no proximo heartbeat.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from contextlib import suppress
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Iterable
+
+from redis.asyncio import Redis
+from sqlalchemy import Engine, create_engine, func, select, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.pool import NullPool
+
+from adapters.metrics import REGISTRY
+from domain.types import Asset
+from worker.runtime import requeue_processing
+
+log = logging.getLogger("worker.cluster")
+
+SHARDS = int(os.getenv("WORKER_SHARDS", "64"))
+MEMBERS_KEY = "workers:members" # ZSET: no -> epoch do ultimo heartbeat
+ASSETS_KEY = "workers:assets" # HASH: no -> "BTC,XMR"
+
+CLUSTER_NODES = REGISTRY.gauge("worker_cluster_nodes", "Nos vivos no cluster de workers")
+SHARDS_OWNED = REGISTRY.gauge("worker_shards_owned", "Shards atribuidos a este no", ("asset",))
+LEADERSHIP = REGISTRY.gauge("worker_leader", "1 se este no roda a tarefa singleton", ("duty",))
+REBALANCES = REGISTRY.counter("worker_rebalances_total", "Mudancas na divisao de shards vistas por este no")
+
+Duty = Callable[[], Awaitable[None]]
+
+
+def shard_of(escrow_id:int, shards:int=SHARDS)->int:
+    return escrow_id % shards
+
+
+def in_shards(column, owned:Iterable[int], shards:int=SHARDS):
+    #filtro SQL equivalente a shard_of(coluna) in owned
+    return (column % shards).in_(sorted(owned))
+
+
+def _weight(node:str, asset:Asset, shard:int)->int:
+    return int.from_bytes(hashlib.blake2b(f"{node}:{asset.value}:{shard}".encode(), digest_size=8).digest(), "big")
+
+
+def assign(members:dict[str,frozenset[Asset]], shards:int=SHARDS)->dict[str,dict[Asset,frozenset[int]]]:
+    """Dono de cada (ativo, shard): o no de maior peso entre os que atendem o ativo."""
+    owned:dict[str,dict[Asset,set[int]]] = {node: {a: set() for a in assets} for node, assets in members.items()}
+    for asset in Asset:
+        candidates = [node for node, assets in members.items() if asset in assets]
+        if not candidates:
+            continue
+        for shard in range(shards):
+            owner = max(candidates, key=lambda node: _weight(node, asset, shard))
+            owned[owner][asset].add(shard)
+    return {node: {a: frozenset(s) for a, s in by_asset.items()} for node, by_asset in owned.items()}
+
+
+def lock_key(name:str)->int:
+    #bigint estavel por nome de tarefa para pg_try_advisory_lock
+    return int.from_bytes(hashlib.blake2b(f"worker:{name}".encode(), digest_size=8).digest(), "big", signed=True)
+
+
+class AdvisoryLocks:
+    """Advisory locks de sessao numa conexao so (AUTOCOMMIT, fora do pool de trabalho).
+    Metodos sincronos: chamar via asyncio.to_thread."""
+
+    def __init__(self, engine:Engine)->None:
+        #mesmo banco, engine proprio sem pool: a conexao presa aos locks nao tira um slot
+        #dimensionado para os jobs, e reconectar abre uma conexao nova em vez de reusar uma do pool
+        self.url = engine.url if engine is not None else None
+        self.engine:Engine|None = None
+        self.conn:Connection|None = None
+        self.held:set[str] = set()
+
+    def _alive(self)->bool:
+        if self.conn is None:
+            return False
+        try:
+            self.conn.execute(text("SELECT 1"))
+            return True
+        except Exception:
+            #conexao caiu: o Postgres ja soltou os locks dela
+            log.warning("conexao dos advisory locks caiu; %d liderancas perdidas", len(self.held), exc_info=True)
+            self.close()
+            return False
+
+    def sync(self, names:Iterable[str])->set[str]:
+        """Confere a conexao e tenta pegar os locks que ainda nao tem; devolve os que segura."""
+        if not self._alive():
+            if self.engine is None:
+                self.engine = create_engine(self.url, poolclass=NullPool)
+            self.conn = self.engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+        for name in names:
+            if name not in self.held and self.conn.execute(select(func.pg_try_advisory_lock(lock_key(name)))).scalar():
+                self.held.add(name)
+        return set(self.held)
+
+    def close(self)->None:
+        #fechar a conexao solta todos os locks de sessao
+        self.held.clear()
+        if self.conn is not None:
+            with suppress(Exception):
+                self.conn.invalidate()
+                self.conn.close()
+            self.conn = None
+
+
+@dataclass
+class _Singleton:
+    name:str
+    fn:Duty
+    task:asyncio.Task|None = None
+
+
+class Cluster:
+    def __init__(self, redis:Redis, engine:Engine, name:str, assets:Iterable[Asset], shards:int=SHARDS,
+                 heartbeat:float=5.0, ttl:float=30.0)->None:
+        self.redis = redis
+        self.name = name
+        self.assets = frozenset(assets)
+        self.shards = shards
+        self.heartbeat_every = heartbeat
+        self.ttl = ttl
+        self.locks = AdvisoryLocks(engine)
+        self.members:dict[str,frozenset[Asset]] = {name: self.assets}
+        self.owned:dict[Asset,frozenset[int]] = assign(self.members, shards)[name]
+        self._singletons:dict[str,_Singleton] = {}
+
+    def singleton(self, name:str)->Callable[[Duty], Duty]:
+        #como runtime.background, mas so roda no no que segura o advisory lock `name`
+        def register(fn:Duty)->Duty:
+            self._singletons[name] = _Singleton(name, fn)
+            return fn
+        return register
+
+    def owned_shards(self, asset:Asset)->frozenset[int]:
+        return self.owned.get(asset, frozenset())
+
+    def owns(self, asset:Asset, escrow_id:int)->bool:
+        return shard_of(escrow_id, self.shards) in self.owned_shards(asset)
+
+    async def heartbeat(self)->None:
+        now = time.time()
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zadd(MEMBERS_KEY, {self.name: now})
+            pipe.hset(ASSETS_KEY, self.name, ",".join(sorted(a.value for a in self.assets)))
+            pipe.zrangebyscore(MEMBERS_KEY, "-inf", now - self.ttl)
+            pipe.zrangebyscore(MEMBERS_KEY, now - self.ttl, "+inf")
+            _, _, dead, alive = await pipe.execute()
+        for node in dead:
+            #qualquer no limpa os mortos; so quem removeu o membro devolve os jobs que ele segurava
+            #(um no com nome novo a cada start nunca drenaria a lista do antecessor)
+            if await self.redis.zrem(MEMBERS_KEY, node):
+                await self.redis.hdel(ASSETS_KEY, node)
+                moved = await requeue_processing(self.redis, node.decode())
+                if moved:
+                    log.warning("no %s morto: %d jobs em processamento devolvidos para a fila", node.decode(), moved)
+        names = [n.decode() for n in alive]
+        assets = await self.redis.hmget(ASSETS_KEY, names)
+        members = {n: frozenset(Asset(a) for a in (raw or b"").decode().split(",") if a) for n, raw in zip(names, assets)}
+        members[self.name] = self.assets
+        self._rebalance(members)
+
+    def _rebalance(self, members:dict[str,frozenset[Asset]])->None:
+        if members == self.members:
+            return
+        owned = assign(members, self.shards)[self.name]
+        if owned != self.owned:
+            REBALANCES.labels().inc()
+            log.info("rebalanceamento: %d nos, shards deste no %s",
+                     len(members), {a.value: len(s) for a, s in owned.items()})
+        self.members, self.owned = members, owned
+        CLUSTER_NODES.labels().set(len(members))
+        for asset in Asset:
+            SHARDS_OWNED.labels(asset.value).set(len(self.owned_shards(asset)))
+
+    async def elect(self)->None:
+        try:
+            held = await asyncio.to_thread(self.locks.sync, list(self._singletons))
+        except Exception:
+            #sem Postgres nao ha como provar lideranca: para tudo ate reconectar
+            log.warning("sem conexao para os advisory locks", exc_info=True)
+            await asyncio.to_thread(self.locks.close)
+            held = set()
+        for s in self._singletons.values():
+            running = s.task is not None and not s.task.done()
+            if s.name in held and not running:
+                if s.task is not None and not s.task.cancelled() and s.task.exception() is not None:
+                    log.error("tarefa %s terminou com erro; reiniciando", s.name, exc_info=s.task.exception())
+                log.info("lider de %s", s.name)
+                s.task = asyncio.create_task(s.fn())
+            elif s.name not in held and running:
+                log.warning("lideranca de %s perdida; parando", s.name)
+                s.task.cancel()
+            LEADERSHIP.labels(s.name).set(1 if s.name in held else 0)
+
+    async def _stop(self)->None:
+        tasks = [s.task for s in self._singletons.values() if s.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.to_thread(self.locks.close)
+        #saida limpa: os outros rebalanceiam no proximo heartbeat sem esperar o TTL
+        with suppress(Exception):
+            await self.redis.zrem(MEMBERS_KEY, self.name)
+            await self.redis.hdel(ASSETS_KEY, self.name)
+
+    async def run(self, runtime)->None:
+        try:
+            while not runtime.stopping:
+                try:
+                    await self.heartbeat()
+                except Exception:
+                    log.warning("falha no heartbeat do no %s", self.name, exc_info=True)
+                await self.elect()
+                await runtime.sleep(self.heartbeat_every)
+        finally:
+            await self._stop()
@@ -0,0 +1,209 @@
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+from sqlalchemy import case, func, select, update
+from sqlalchemy.orm import Session
+
+from adapters.metrics import LAG_BUCKETS, REGISTRY
+from adapters.ports import ChainPort
+from db.escrow_transitions import transition_many
+from db.escrow_view import mark_dirty
+from db.models import Deposit, Escrow
+from db.outbox import Outgoing, emit
+from domain.state_machine import Event
+from domain.types import Asset, DepositStatus, EscrowState, confirmations_min
+from worker.watch_index import owned_deposit_rows, upsert_deposits
+
+
+FUNDING_LAG = REGISTRY.histogram(
+    "confirmation_to_funded_seconds", "Do tip que completou as confirmacoes ate o commit do FUNDED", ("asset",), LAG_BUCKETS)
+REORGS = REGISTRY.counter("chain_reorgs_total", "Reorgs detectados pelo buffer de headers", ("asset",))
+REORG_STUCK = REGISTRY.counter(
+    "reorg_stuck_escrows_total", "Escrows ja liberados/disputados que perderam deposito confirmado num reorg", ("asset",))
+REORG_DEPTH = REGISTRY.histogram("chain_reorg_depth_blocks", "Blocos orfaos por reorg", ("asset",), (1, 2, 3, 4, 6, 10, 20, 50, 100))
+
+
+@dataclass(frozen=True)
+class ConfirmationPass:
+    asset:Asset
+    tip_height:int
+    confirmed_escrows:int #escrows com pelo menos um deposito que virou CONFIRMED
+    funded_escrow_ids:list[int]
+
+
+@dataclass(frozen=True)
+class TipChange:
+    height:int
+    fork_height:int|None = None #primeira altura orfa quando houve reorg
+
+
+class HeaderRing:
+    """Ultimos `depth` headers (altura -> hash) de um ativo.
+
+    Bloco novo encadeado no tip conhecido custa um fetch (o header do tip). Se o prev_hash
+    nao bate, volta buscando header por header ate reencontrar a cadeia no buffer; a altura
+    onde os hashes divergem e o fork e so [fork, tip] precisa ser reprocessado. Reorg mais
+    fundo que o buffer e tratado como fork no header mais antigo guardado.
+    """
+
+    def __init__(self, depth:int=100)->None:
+        self.depth = depth
+        self._hashes:dict[int,str] = {}
+
+    @property
+    def tip(self)->int|None:
+        return max(self._hashes) if self._hashes else None
+
+    def load(self, hashes:dict[int,str])->None:
+        self._hashes = dict(hashes)
+        self._trim()
+
+    def dump(self)->dict[int,str]:
+        return dict(self._hashes)
+
+    def _trim(self)->None:
+        if self._hashes:
+            floor = max(self._hashes) - self.depth
+            for height in [h for h in self._hashes if h <= floor]:
+                del self._hashes[height]
+
+    async def sync(self, port:ChainPort)->TipChange|None:
+        header = await port.get_tip_header()
+        known = self._hashes.get(header.height)
+        if known == header.hash and header.height == self.tip:
+            return None
+        if not self._hashes:
+            self._hashes[header.height] = header.hash
+            return TipChange(header.height)
+        lowest, highest = min(self._hashes), self.tip
+        fork = header.height + 1 if highest > header.height else None #cadeia nova mais curta
+        fetched = [header]
+        while True:
+            known = self._hashes.get(header.height)
+            if known is not None and known != header.hash:
+                fork = header.height
+            elif known == header.hash:
+                break
+            parent = header.height - 1
+            if self._hashes.get(parent) == header.prev_hash:
+                break
+            if parent < lowest:
+                fork = lowest
+                break
+            header = await port.get_block_header(parent)
+            fetched.append(header)
+        if fork is not None:
+            for height in [h for h in self._hashes if h >= fork]:
+                del self._hashes[height]
+        for h in fetched:
+            self._hashes[h.height] = h.hash
+        self._trim()
+        return TipChange(fetched[0].height, fork)
+
+
+@dataclass(frozen=True)
+class ReorgRollback:
+    asset:Asset
+    fork_height:int
+    deposits:int #depositos que estavam em blocos orfaos
+    unfunded_escrow_ids:list[int] #FUNDED -> CREATED
+    stuck_escrow_ids:list[int] #ja liberados/disputados: sem como desfazer sozinho
+
+
+def _confirmed_total():
+    return (
+        select(func.coalesce(func.sum(Deposit.amount), 0))
+        .where(Deposit.escrow_id == Escrow.id, Deposit.status == DepositStatus.CONFIRMED)
+        .scalar_subquery()
+    )
+
+
+def rollback_reorg(session:Session, asset:Asset, fork_height:int)->ReorgRollback:
+    """Depositos em blocos >= fork_height voltam para PENDING sem altura, num UPDATE so; o
+    rescan do range orfao (ou o proximo webhook) preenche a altura na cadeia nova. Escrows
+    FUNDED que perderam cobertura voltam para CREATED; os que ja passaram de FUNDED nao tem
+    como voltar e saem como evento escrow.reorg_uncovered na outbox, na mesma transacao."""
+    escrow_ids = list(session.execute(
+        update(Deposit)
+        .where(Deposit.asset == asset, Deposit.confirmed_height >= fork_height)
+        .values(status=DepositStatus.PENDING, confirmed_height=None, confirmations_current=0, confirmed_at=None)
+        .returning(Deposit.escrow_id)
+        .execution_options(synchronize_session=False)
+    ).scalars())
+    affected = sorted(set(escrow_ids))
+    mark_dirty(session, affected)
+    unfunded, stuck = [], []
+    if affected:
+        uncovered = _confirmed_total() < Escrow.deposit_total
+        unfunded = [e.id for e in transition_many(session, Event.UNFUND, affected, where=(uncovered,), lock="wait")]
+        rows = session.execute(
+            select(Escrow.id, Escrow.asset, Escrow.state, Escrow.deposit_total, _confirmed_total().label("confirmed"))
+            .where(
+                Escrow.id.in_(affected), uncovered,
+                Escrow.state.not_in([EscrowState.CREATED, EscrowState.FUNDED]),
+            )
+        ).all()
+        emit(session, [
+            Outgoing("escrow.reorg_uncovered", e.id, e.asset, {
+                "state": e.state.value, "fork_height": fork_height,
+                "deposit_total": e.deposit_total, "confirmed_total": e.confirmed,
+            })
+            for e in rows
+        ])
+        REORG_STUCK.labels(asset.value).inc(len(rows))
+        stuck = [e.id for e in rows]
+    return ReorgRollback(asset, fork_height, len(escrow_ids), unfunded, stuck)
+
+
+def rescan_range(session:Session, asset:Asset, outputs:list[dict], tip_height:int)->ConfirmationPass:
+    #Saidas do range orfao relidas do node; depois a passada normal recalcula confirmacoes
+    rows, _ = owned_deposit_rows(session, [(asset, p) for p in outputs])
+    upsert_deposits(session, rows)
+    return run_confirmation_pass(session, asset, tip_height)
+
+
+def run_confirmation_pass(session:Session, asset:Asset, tip_height:int)->ConfirmationPass:
+    """Recalcula as confirmacoes de todos os depositos PENDING do ativo em um unico UPDATE.
+
+    Depositos que atingem CONFIRMATIONS_MIN viram CONFIRMED e os escrows cujo total
+    confirmado cobre deposit_total passam de CREATED para FUNDED, tudo na mesma transacao.
+    """
+    required = confirmations_min(asset)
+    confs = tip_height - Deposit.confirmed_height + 1
+    reached = confs >= required
+    now = datetime.now(timezone.utc)
+
+    upd = (
+        update(Deposit)
+        .where(
+            Deposit.asset == asset,
+            Deposit.status == DepositStatus.PENDING,
+            Deposit.confirmed_height.is_not(None),
+            Deposit.confirmed_height <= tip_height,
+        )
+        .values(
+            confirmations_current=confs,
+            status=case((reached, DepositStatus.CONFIRMED), else_=DepositStatus.PENDING),
+            confirmed_at=case((reached, now), else_=Deposit.confirmed_at),
+        )
+        .returning(Deposit.escrow_id, Deposit.status, Deposit.txid, Deposit.vout, Deposit.amount)
+    )
+    #todos os tocados mudaram de confirmacoes (view de polling); so os CONFIRMED viram evento e podem fundear
+    touched = session.execute(upd).all()
+    mark_dirty(session, {d.escrow_id for d in touched})
+    confirmed = [d for d in touched if d.status == DepositStatus.CONFIRMED]
+    emit(session, [
+        Outgoing("deposit.confirmed", d.escrow_id, asset,
+                 {"txid": d.txid, "vout": d.vout, "amount": d.amount, "confirmations": required})
+        for d in confirmed
+    ])
+    escrow_ids = sorted({d.escrow_id for d in confirmed})
+
+    funded:list[int] = []
+    if escrow_ids:
+        #lock="wait": escrow pulado aqui nao voltaria na proxima passada (so entram os recem-confirmados)
+        funded = [e.id for e in transition_many(
+            session, Event.FUND, escrow_ids, where=(_confirmed_total() >= Escrow.deposit_total,), lock="wait",
+        )]
+
+    return ConfirmationPass(asset=asset, tip_height=tip_height, confirmed_escrows=len(escrow_ids), funded_escrow_ids=funded)
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+from sqlalchemy.orm import sessionmaker
+
+from adapters.bitcoin_core import BitcoinCoreAdapter
+from adapters.metrics import REGISTRY
+from adapters.ports import AddressSource, XmrWalletPort
+from db.destination_pool import add_to_pool, available, next_index
+from domain.hd import HdDeriver, self_check
+from domain.types import Asset
+
+log = logging.getLogger("worker.destinations")
+
+POOL_AVAILABLE = REGISTRY.gauge("destination_pool_available", "Enderecos livres no destination_pool", ("asset",))
+
+
+class XmrSubaddressSource:
+    #create_address com count: varios subaddresses por chamada ao wallet-rpc
+    meta_key = "subaddr_index"
+
+    def __init__(self, wallet:XmrWalletPort, account_index:int=0)->None:
+        self.wallet = wallet
+        self.account_index = account_index
+
+    async def generate(self, start:int, count:int)->list[tuple[str,dict]]:
+        created = await self.wallet.create_subaddresses(self.account_index, count)
+        return [(address, {"account_index": self.account_index, "subaddr_index": index}) for address, index in created]
+
+
+class DescriptorAddressSource:
+    #deriveaddresses sobre um descriptor watch-only (wpkh(xpub/0/*)): um RPC por range
+    meta_key = "index"
+
+    def __init__(self, node:BitcoinCoreAdapter, descriptor:str, path_prefix:str)->None:
+        self.node = node
+        self.descriptor = descriptor
+        self.path_prefix = path_prefix.rstrip("/")
+
+    async def generate(self, start:int, count:int)->list[tuple[str,dict]]:
+        if "#" not in self.descriptor:
+            self.descriptor = await self.node.descriptor_checksum(self.descriptor)
+        addresses = await self.node.derive_addresses(self.descriptor, start, count)
+        return [(address, {"path": f"{self.path_prefix}/{start + i}", "index": start + i}) for i, address in enumerate(addresses)]
+
+
+class HdAddressSource:
+    #derivacao local a partir do xpub da conta (sem node); ranges grandes vao para um ProcessPool
+    meta_key = "index"
+
+    def __init__(self, account_xpub:str, path_prefix:str, workers:int=0, hrp:str|None=None)->None:
+        self_check() # vetores BIP32/BIP84 antes de gravar qualquer endereco
+        self.deriver = HdDeriver(account_xpub, hrp=hrp)
+        self.path_prefix = path_prefix.rstrip("/")
+        self.pool = ProcessPoolExecutor(workers) if workers > 1 else None
+
+    async def generate(self, start:int, count:int)->list[tuple[str,dict]]:
+        if self.pool is None:
+            addresses = await asyncio.to_thread(self.deriver.derive_range, start, count)
+        else:
+            addresses = await asyncio.to_thread(self.deriver.derive_range_parallel, start, count, self.pool)
+        return [(address, {"path": f"{self.path_prefix}/{start + i}", "index": start + i}) for i, address in enumerate(addresses)]
+
+
+@dataclass
+class PoolStats:
+    levels:dict[Asset,int] = field(default_factory=dict)
+    refilled:dict[Asset,int] = field(default_factory=lambda: {a: 0 for a in Asset})
+    failures:dict[Asset,int] = field(default_factory=lambda: {a: 0 for a in Asset})
+
+
+class DestinationPoolRefiller:
+    """Mantem o destination_pool entre `low` e `high` enderecos livres por ativo.
+
+    Abaixo do low watermark gera enderecos em lotes (`chunk` por chamada de carteira)
+    ate o high watermark, para a criacao de escrow nunca depender da carteira.
+    """
+
+    def __init__(self, Session:sessionmaker, sources:dict[Asset,AddressSource], low:int=500, high:int=2000,
+                 chunk:dict[Asset,int]|None=None)->None:
+        self.Session = Session
+        self.sources = sources
+        self.low = low
+        self.high = high
+        self.chunk = chunk or {Asset.BTC: 1000, Asset.XMR: 64}
+        self.stats = PoolStats()
+
+    def _levels(self)->dict[Asset,int]:
+        with self.Session() as session:
+            return available(session)
+
+    def _store(self, asset:Asset, rows:list[tuple[str,dict]])->tuple[int,int]:
+        with self.Session.begin() as session:
+            inserted = add_to_pool(session, asset, rows)
+            return inserted, next_index(session, asset, self.sources[asset].meta_key)
+
+    def _start(self, asset:Asset)->int:
+        with self.Session() as session:
+            return next_index(session, asset, self.sources[asset].meta_key)
+
+    async def refill_once(self)->dict[Asset,int]:
+        self.stats.levels = await asyncio.to_thread(self._levels)
+        for asset, level in self.stats.levels.items():
+            POOL_AVAILABLE.labels(asset.value).set(level)
+        added:dict[Asset,int] = {}
+        for asset, source in self.sources.items():
+            level = self.stats.levels.get(asset, 0)
+            if level >= self.low:
+                continue
+            start = await asyncio.to_thread(self._start, asset)
+            added[asset] = 0
+            try:
+                while level < self.high:
+                    count = min(self.chunk[asset], self.high - level)
+                    inserted, start = await asyncio.to_thread(self._store, asset, await source.generate(start, count))
+                    level += inserted
+                    added[asset] += inserted
+                    if inserted == 0:
+                        break
+            except Exception:
+                self.stats.failures[asset] += 1
+                log.exception("falha reabastecendo pool de %s", asset.value)
+            self.stats.refilled[asset] += added[asset]
+            self.stats.levels[asset] = level
+            POOL_AVAILABLE.labels(asset.value).set(level)
+            log.info("pool %s: +%d enderecos, %d livres", asset.value, added[asset], level)
+        return added
+
+    async def run(self, runtime, interval:float=10.0)->None:
+        while not runtime.stopping:
+            await self.refill_once()
+            await runtime.sleep(interval)
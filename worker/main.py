@@ -1,5 +1,345 @@
-import time, os
-print("worker online(stub). REDIS_HOST=", os.getenv("REDIS_HOST"))
+import asyncio, functools, logging, os, sys, time
+from datetime import timedelta
+from pathlib import Path
 
-while True:
-    time.sleep(5)
\ No newline at end of file
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+import httpx
+
+from adapters.bitcoin_core import BitcoinCoreAdapter
+from adapters.jsonrpc import JsonRpcClient
+from adapters.metrics import REGISTRY, serve, track_pool
+from adapters.monero_wallet import MoneroWalletAdapter
+from adapters.ports import ChainPort
+from db.archive import archive_closed, archive_dir
+from db.escrow_view import EscrowViewCache
+from db.idempotency import purge_expired
+from db.partitions import drop_webhook_partitions, ensure_partitions
+from db.session import make_engine, make_sessionmaker
+from domain.fees import FeeOracle
+from domain.types import Asset, SpeedProfile
+from worker.cluster import Cluster
+from worker.confirmations import (FUNDING_LAG, REORG_DEPTH, REORGS, HeaderRing, rescan_range, rollback_reorg,
+                                  run_confirmation_pass)
+from worker.destination_pool import DescriptorAddressSource, DestinationPoolRefiller, HdAddressSource, XmrSubaddressSource
+from worker.outbox import DeliveryPool, OutboxRelay
+from worker.payout_accelerator import PayoutAccelerator
+from worker.payout_batcher import PayoutBatcher
+from worker.reconciliation import Reconciler
+from worker.runtime import DEFAULT_CONCURRENCY, QUEUE_DEPTH, Job, WorkerRuntime, enqueue, redis_from_env
+from worker.scheduler import (DeadlineScheduler, close_dispute_windows, dispute_scheduler, pending_deadlines,
+                              pending_dispute_windows, release_due_escrows)
+from worker.webhooks import WebhookConsumerPool
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+log = logging.getLogger("worker")
+
+POLL_SECONDS = float(os.getenv("TIP_POLL_SECONDS", "5"))
+HEADER_CACHE_DEPTH = int(os.getenv("HEADER_CACHE_DEPTH", "100"))
+IDEMPOTENCY_PURGE_SECONDS = float(os.getenv("IDEMPOTENCY_PURGE_SECONDS", "300"))
+METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9100"))
+PARTITION_CHECK_SECONDS = float(os.getenv("PARTITION_CHECK_SECONDS", "21600"))
+WEBHOOK_RETENTION_MONTHS = int(os.getenv("WEBHOOK_RETENTION_MONTHS", "3"))
+ARCHIVE_AFTER = timedelta(days=float(os.getenv("ARCHIVE_AFTER_DAYS", "30")))
+ARCHIVE_BATCH = int(os.getenv("ARCHIVE_BATCH", "500"))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+CLUSTER_HEARTBEAT_SECONDS = float(os.getenv("CLUSTER_HEARTBEAT_SECONDS", "5"))
+CLUSTER_NODE_TTL_SECONDS = float(os.getenv("CLUSTER_NODE_TTL_SECONDS", "30"))
+
+
+def build_bitcoin_core()->BitcoinCoreAdapter|None:
+    url = os.getenv("BTC_RPC_URL")
+    if not url:
+        return None
+    rpc = JsonRpcClient(url, auth=(os.getenv("BTC_RPC_USER", ""), os.getenv("BTC_RPC_PASSWORD", "")), batch=True)
+    return BitcoinCoreAdapter(rpc)
+
+
+def build_monero_wallet()->MoneroWalletAdapter|None:
+    wallet_url, daemon_url = os.getenv("XMR_WALLET_RPC_URL"), os.getenv("XMR_DAEMON_RPC_URL")
+    if not (wallet_url and daemon_url):
+        return None
+    auth = httpx.DigestAuth(os.getenv("XMR_WALLET_RPC_USER", ""), os.getenv("XMR_WALLET_RPC_PASSWORD", ""))
+    #wallet-rpc e single-threaded: poucas conexoes, sem batch
+    wallet = JsonRpcClient(wallet_url, auth=auth, max_connections=2, max_concurrency=4, timeout=30.0)
+    return MoneroWalletAdapter(wallet, JsonRpcClient(daemon_url))
+
+
+def served_assets(ports:dict[Asset,ChainPort])->list[Asset]:
+    #WORKER_ASSETS=BTC,XMR restringe o no; por padrao, os ativos com node configurado
+    names = os.getenv("WORKER_ASSETS")
+    return [Asset(a.strip()) for a in names.split(",") if a.strip()] if names else list(ports)
+
+
+async def main()->None:
+    redis = redis_from_env()
+    btc, xmr = build_bitcoin_core(), build_monero_wallet()
+    ports:dict[Asset,ChainPort] = {a: p for a, p in ((Asset.BTC, btc), (Asset.XMR, xmr)) if p is not None}
+    assets = served_assets(ports)
+    #so consome as filas dos ativos que atende
+    runtime = WorkerRuntime(redis, concurrency={a: DEFAULT_CONCURRENCY[a] for a in assets})
+    engine = make_engine(pool_size=sum(runtime.concurrency.values()))
+    Session = make_sessionmaker(engine)
+    track_pool(engine, "worker")
+    cluster = Cluster(redis, engine, runtime.consumer, assets, heartbeat=CLUSTER_HEARTBEAT_SECONDS, ttl=CLUSTER_NODE_TTL_SECONDS)
+    scheduler = DeadlineScheduler(redis)
+    dispute_windows = dispute_scheduler(redis)
+    #commits das threads do worker invalidam a view de polling da API
+    EscrowViewCache(redis).install(asyncio.get_running_loop())
+
+    @runtime.background
+    async def membership()->None:
+        await cluster.run(runtime)
+
+    @runtime.handler("confirmations")
+    async def confirmations(job:Job)->None:
+        height = job.payload["tip_height"]
+        def work():
+            with Session.begin() as session:
+                return run_confirmation_pass(session, job.asset, height)
+        result = await asyncio.to_thread(work)
+        if "seen_at" in job.payload:
+            lag = time.time() - job.payload["seen_at"]
+            for _ in result.funded_escrow_ids:
+                FUNDING_LAG.labels(job.asset.value).observe(lag)
+        log.info("tip %s=%d: %d escrows com deposito confirmado, %d FUNDED",
+                 job.asset.value, height, result.confirmed_escrows, len(result.funded_escrow_ids))
+
+    @runtime.handler("rescan")
+    async def rescan(job:Job)->None:
+        #so o range orfao: [fork, tip] relido do node
+        start, height = job.payload["from_height"], job.payload["tip_height"]
+        outputs = await ports[job.asset].list_incoming(start, height)
+        def work():
+            with Session.begin() as session:
+                return rescan_range(session, job.asset, outputs, height)
+        result = await asyncio.to_thread(work)
+        log.info("rescan %s [%d, %d]: %d saidas, %d FUNDED",
+                 job.asset.value, start, height, len(outputs), len(result.funded_escrow_ids))
+
+    async def handle_reorg(asset:Asset, fork:int, height:int, orphaned:int)->None:
+        REORGS.labels(asset.value).inc()
+        REORG_DEPTH.labels(asset.value).observe(orphaned)
+        def work():
+            with Session.begin() as session:
+                return rollback_reorg(session, asset, fork)
+        result = await asyncio.to_thread(work)
+        log.warning("reorg %s a partir de %d (%d blocos): %d depositos voltaram a PENDING, %d escrows voltaram a CREATED",
+                    asset.value, fork, orphaned, result.deposits, len(result.unfunded_escrow_ids))
+        if result.stuck_escrow_ids:
+            log.error("reorg %s: escrows ja liberados/disputados sem deposito confirmado: %s",
+                      asset.value, result.stuck_escrow_ids)
+        await enqueue(redis, Job("rescan", asset, {"from_height": fork, "tip_height": height}))
+
+    @runtime.handler("auto_release")
+    async def auto_release(job:Job)->None:
+        ids = job.payload["escrow_ids"]
+        def work():
+            with Session.begin() as session:
+                return release_due_escrows(session, ids), pending_deadlines(session, ids)
+        released, postponed = await asyncio.to_thread(work)
+        for escrow_id, asset, at in postponed:
+            await scheduler.schedule(escrow_id, asset, at)
+        log.info("auto-release %s: %d liberados de %d", job.asset.value, len(released), len(ids))
+
+    @runtime.handler("dispute_window")
+    async def dispute_window(job:Job)->None:
+        ids = job.payload["escrow_ids"]
+        def work():
+            with Session.begin() as session:
+                return close_dispute_windows(session, ids), pending_dispute_windows(session, ids)
+        closed, postponed = await asyncio.to_thread(work)
+        for escrow_id, asset, at in postponed:
+            await dispute_windows.schedule(escrow_id, asset, at)
+        log.info("janela de disputa %s: %d encerradas de %d", job.asset.value, len(closed), len(ids))
+
+    @cluster.singleton("deadlines")
+    async def deadlines()->None:
+        #o lider reconstroi o indice de prazos a partir do banco antes de servir
+        with Session() as session:
+            log.info("%d prazos de auto-release e %d de disputa carregados",
+                     await scheduler.rebuild(session), await dispute_windows.rebuild(session))
+        await asyncio.gather(scheduler.run(runtime), dispute_windows.run(runtime))
+
+    estimators = {}
+    if btc:
+        estimators[Asset.BTC] = btc.estimate_feerate
+    if xmr:
+        estimators[Asset.XMR] = xmr.estimate_fee
+    fees = FeeOracle(estimators, ttl=float(os.getenv("FEE_REFRESH_SECONDS", "30")))
+
+    @runtime.background
+    async def refresh_fees()->None:
+        await fees.run(lambda: runtime.stopping, runtime.sleep, redis)
+
+    if btc is not None and Asset.BTC in assets:
+        batcher = PayoutBatcher(
+            Session, btc, fees, os.environ["BTC_PLATFORM_ADDRESS"],
+            window=float(os.getenv("PAYOUT_BATCH_WINDOW_SECONDS", "60")),
+            max_outputs=int(os.getenv("PAYOUT_BATCH_MAX_OUTPUTS", "200")),
+            shards=lambda: cluster.owned_shards(Asset.BTC),
+        )
+        accelerator = PayoutAccelerator(Session, btc, fees, os.environ["BTC_PLATFORM_ADDRESS"],
+                                        shards=lambda: cluster.owned_shards(Asset.BTC))
+
+        @runtime.background
+        async def payout_batches()->None:
+            while not runtime.stopping:
+                for profile in (*SpeedProfile, None):
+                    try:
+                        await batcher.flush(profile)
+                    except Exception:
+                        log.exception("falha no lote de payouts %s", profile)
+                try:
+                    await batcher.resume_unsent()
+                except Exception:
+                    log.exception("falha retransmitindo lotes de payout")
+                try:
+                    await batcher.track_confirmations()
+                except Exception:
+                    log.exception("falha conferindo confirmacoes de payouts")
+                try:
+                    await accelerator.run_once()
+                except Exception:
+                    log.exception("falha no fee bump de payouts parados")
+                await runtime.sleep(5)
+
+    webhooks = WebhookConsumerPool(Session, consumers=int(os.getenv("WEBHOOK_CONSUMERS", "4")))
+
+    @runtime.background
+    async def consume_webhooks()->None:
+        await webhooks.run(runtime)
+
+    relay = OutboxRelay(Session, redis, batch=int(os.getenv("OUTBOX_RELAY_BATCH", "500")))
+
+    @runtime.background
+    async def relay_outbox()->None:
+        await relay.run(runtime)
+
+    @runtime.background
+    async def deliver_notifications()->None:
+        async with httpx.AsyncClient(timeout=float(os.getenv("OUTBOX_HTTP_TIMEOUT_SECONDS", "10"))) as http:
+            pool = DeliveryPool(Session, redis, http, runtime.consumer,
+                                consumers=int(os.getenv("OUTBOX_CONSUMERS", "4")),
+                                batch=int(os.getenv("OUTBOX_DELIVERY_BATCH", "100")))
+            await pool.run(runtime)
+
+    sources = {}
+    if os.getenv("BTC_DEPOSIT_XPUB"):
+        #xpub da conta (m/84'/c'/a'): derivacao local, sem RPC
+        sources[Asset.BTC] = HdAddressSource(
+            os.environ["BTC_DEPOSIT_XPUB"], os.getenv("BTC_DEPOSIT_PATH_PREFIX", "m/84'/1'/0'/0"),
+            workers=int(os.getenv("BTC_DERIVE_WORKERS", "0")), hrp=os.getenv("BTC_ADDRESS_HRP") or None)
+    elif btc and os.getenv("BTC_DEPOSIT_DESCRIPTOR"):
+        sources[Asset.BTC] = DescriptorAddressSource(
+            btc, os.environ["BTC_DEPOSIT_DESCRIPTOR"], os.getenv("BTC_DEPOSIT_PATH_PREFIX", "m/84'/1'/0'/0"))
+    if xmr:
+        sources[Asset.XMR] = XmrSubaddressSource(xmr, int(os.getenv("XMR_ACCOUNT_INDEX", "0")))
+    pool = DestinationPoolRefiller(
+        Session, sources,
+        low=int(os.getenv("DESTINATION_POOL_LOW", "500")),
+        high=int(os.getenv("DESTINATION_POOL_HIGH", "2000")),
+    )
+
+    if sources:
+        @cluster.singleton("destinations")
+        async def refill_destinations()->None:
+            await pool.run(runtime)
+
+    @cluster.singleton("idempotency_purge")
+    async def purge_idempotency_keys()->None:
+        #Lotes pequenos para nao segurar lock/WAL; repete ate esvaziar, depois dorme
+        def work():
+            with Session.begin() as session:
+                return purge_expired(session, batch=5000)
+        while not runtime.stopping:
+            total = 0
+            while (deleted := await asyncio.to_thread(work)):
+                total += deleted
+            if total:
+                log.info("%d idempotency keys expiradas removidas", total)
+            await runtime.sleep(IDEMPOTENCY_PURGE_SECONDS)
+
+    @cluster.singleton("partitions")
+    async def maintain_partitions()->None:
+        #meses a frente em ledger_entries/webhook_events; particoes antigas de webhooks ja processados saem
+        def work():
+            with Session.begin() as session:
+                return ensure_partitions(session), drop_webhook_partitions(session, WEBHOOK_RETENTION_MONTHS)
+        while not runtime.stopping:
+            try:
+                created, dropped = await asyncio.to_thread(work)
+                if created or dropped:
+                    log.info("particoes criadas %s, removidas %s", created, dropped)
+            except Exception:
+                log.exception("falha na manutencao de particoes")
+            await runtime.sleep(PARTITION_CHECK_SECONDS)
+
+    @cluster.singleton("archive")
+    async def archive_closed_escrows()->None:
+        #um arquivo e uma transacao por lote; repete ate nao sobrar CLOSED antigo, depois dorme
+        directory = archive_dir()
+        directory.mkdir(parents=True, exist_ok=True)
+        def work():
+            with Session.begin() as session:
+                return archive_closed(session, directory, ARCHIVE_AFTER, ARCHIVE_BATCH)
+        while not runtime.stopping:
+            try:
+                while not runtime.stopping and (result := await asyncio.to_thread(work)).escrows:
+                    log.info("%d escrows arquivados em %s", result.escrows, result.file)
+            except Exception:
+                log.exception("falha arquivando escrows CLOSED")
+            await runtime.sleep(ARCHIVE_INTERVAL_SECONDS)
+
+    async def watch_tip(asset:Asset, port:ChainPort)->None:
+        #buffer de headers persistido no Redis: detecta reorg que atravesse um restart ou troca de lider
+        key = f"headers:{asset.value}"
+        ring = HeaderRing(HEADER_CACHE_DEPTH)
+        ring.load({int(h): v.decode() for h, v in (await redis.hgetall(key)).items()})
+        while not runtime.stopping:
+            snapshot, previous = ring.dump(), ring.tip
+            try:
+                change = await ring.sync(port)
+                if change is not None:
+                    if change.fork_height is not None:
+                        await handle_reorg(asset, change.fork_height, change.height, previous - change.fork_height + 1)
+                    else:
+                        await enqueue(redis, Job("confirmations", asset, {"tip_height": change.height, "seen_at": time.time()}))
+                    async with redis.pipeline(transaction=True) as pipe:
+                        pipe.delete(key)
+                        pipe.hset(key, mapping=ring.dump())
+                        await pipe.execute()
+            except Exception:
+                #volta o buffer: o proximo poll detecta (e trata) a mesma mudanca de novo
+                ring.load(snapshot)
+                log.warning("falha acompanhando o tip de %s", asset.value, exc_info=True)
+            await runtime.sleep(POLL_SECONDS)
+
+    for asset in assets:
+        if asset in ports:
+            cluster.singleton(f"tips:{asset.value}")(functools.partial(watch_tip, asset, ports[asset]))
+            #carteira x deposits/payouts/ledger, retomando do checkpoint gravado
+            cluster.singleton(f"reconcile:{asset.value}")(functools.partial(Reconciler(Session, asset, ports[asset]).run, runtime))
+
+    @REGISTRY.collector
+    async def collect_deadlines()->None:
+        for deadlines in (scheduler, dispute_windows):
+            QUEUE_DEPTH.labels(deadlines.key).set(await redis.zcard(deadlines.key))
+
+    @runtime.background
+    async def metrics_server()->None:
+        server = await serve(REGISTRY, "0.0.0.0", METRICS_PORT)
+        async with server:
+            while not runtime.stopping:
+                await runtime.sleep(60)
+
+    try:
+        await runtime.run()
+    finally:
+        await redis.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,289 @@
+"""Notificacoes de escrow: outbox -> Redis Stream -> assinantes (HTTP).
+
+O relay apaga lotes de outbox_events e publica cada evento no stream OUTBOX_STREAM.
+A entrega e um consumer group: cada consumidor le um lote, agrupa por assinante e faz
+um POST por assinante com todos os eventos dele; mais consumidores (neste ou em outros
+processos) dividem o stream. Falha vira retry com backoff exponencial em um ZSET e,
+esgotadas as tentativas, dead letter. Enquanto um assinante esta em backoff, eventos
+novos para ele vao direto para o retry: um endpoint lento ou fora do ar nao segura os outros.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+import uuid
+from dataclasses import dataclass
+
+import httpx
+from redis.asyncio import Redis
+from redis.exceptions import ResponseError
+from sqlalchemy import Row, select
+from sqlalchemy.orm import Session, sessionmaker
+
+from adapters.metrics import REGISTRY
+from db.models import NotificationSubscriber
+from db.outbox import claim_outbox
+from worker.runtime import QUEUE_DEPTH
+
+log = logging.getLogger("worker.outbox")
+
+OUTBOX_STREAM = os.getenv("OUTBOX_STREAM", "outbox:events")
+DELIVERY_GROUP = "delivery"
+RETRY_KEY = f"{OUTBOX_STREAM}:retry" # ZSET: lote pendente -> quando tentar de novo
+BACKOFF_KEY = f"{OUTBOX_STREAM}:backoff" # HASH: assinante -> ate quando nao receber POST novo
+DEAD_STREAM = f"{OUTBOX_STREAM}:dead"
+#MAXLEN aproximado: precisa ficar bem acima do que os consumidores podem atrasar
+STREAM_MAXLEN = int(os.getenv("OUTBOX_STREAM_MAXLEN", "1000000"))
+SIGNATURE_HEADER = "X-Escrow-Signature"
+
+RETRY_BASE = float(os.getenv("OUTBOX_RETRY_BASE_SECONDS", "5"))
+RETRY_CAP = float(os.getenv("OUTBOX_RETRY_CAP_SECONDS", "3600"))
+MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "10"))
+
+RELAY_LAG = REGISTRY.histogram("outbox_relay_lag_seconds", "Do commit do evento na outbox ate o XADD", ("asset",))
+DELIVERIES = REGISTRY.counter("outbox_deliveries_total", "Eventos entregues aos assinantes por resultado", ("result",))
+
+#Arrenda os retries vencidos (score vira agora + lease): outro processo nao pega o mesmo lote,
+#e se este morrer no meio o lote volta a vencer sozinho
+_LEASE_DUE = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, member in ipairs(due) do
+    redis.call('ZADD', KEYS[1], ARGV[3], member)
+end
+return due
+"""
+
+
+def event_body(e:Row)->dict:
+    return {"id": e.id, "type": e.kind, "escrow_id": e.escrow_id, "asset": e.asset.value,
+            "created_at": e.created_at.isoformat(), "data": e.payload}
+
+
+def sign(secret:str, body:bytes)->str:
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+class OutboxRelay:
+    """Publica outbox_events no stream em lotes. Pode rodar em todo worker: SKIP LOCKED."""
+
+    def __init__(self, Session:sessionmaker, redis:Redis, batch:int=500, idle:float=0.5)->None:
+        self.Session = Session
+        self.redis = redis
+        self.batch = batch
+        self.idle = idle
+
+    async def relay_once(self)->int:
+        #DELETE ... RETURNING, XADD e commit; se o XADD falhar, o rollback devolve as linhas
+        with self.Session() as session:
+            events = await asyncio.to_thread(claim_outbox, session, self.batch)
+            if not events:
+                return 0
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for e in events:
+                    pipe.xadd(OUTBOX_STREAM, {"body": json.dumps(event_body(e), separators=(",", ":"))},
+                              maxlen=STREAM_MAXLEN, approximate=True)
+                await pipe.execute()
+            await asyncio.to_thread(session.commit)
+        now = time.time()
+        for e in events:
+            RELAY_LAG.labels(e.asset.value).observe(max(now - e.created_at.timestamp(), 0.0))
+        return len(events)
+
+    async def run(self, runtime)->None:
+        while not runtime.stopping:
+            try:
+                n = await self.relay_once()
+            except Exception:
+                log.exception("falha publicando a outbox")
+                n = 0
+            if n < self.batch:
+                await runtime.sleep(self.idle)
+
+
+@dataclass(frozen=True)
+class Subscriber:
+    id:int
+    url:str
+    secret:str
+    kinds:frozenset[str]|None
+    max_inflight:int
+
+    def wants(self, kind:str)->bool:
+        return self.kinds is None or kind in self.kinds
+
+
+def load_subscribers(session:Session)->dict[int,Subscriber]:
+    return {
+        s.id: Subscriber(s.id, s.url, s.secret, frozenset(s.kinds) if s.kinds is not None else None, s.max_inflight)
+        for s in session.scalars(select(NotificationSubscriber).where(NotificationSubscriber.active.is_(True)))
+    }
+
+
+class DeliveryPool:
+    """Consumidores do grupo DELIVERY_GROUP entregando o stream aos assinantes.
+
+    Um lote lido do stream so recebe XACK depois que cada assinante foi entregue ou
+    teve o seu pedaco agendado para retry; o que ficar pendente de um consumidor morto
+    e reivindicado (XAUTOCLAIM) depois de `claim_idle` segundos.
+    """
+
+    def __init__(self, Session:sessionmaker, redis:Redis, http:httpx.AsyncClient, name:str, consumers:int=4,
+                 batch:int=100, max_attempts:int=MAX_ATTEMPTS, claim_idle:float=60.0, refresh:float=30.0)->None:
+        self.Session = Session
+        self.redis = redis
+        self.http = http
+        self.name = name
+        self.consumers = consumers
+        self.batch = batch
+        self.max_attempts = max_attempts
+        self.claim_idle = claim_idle
+        self.refresh = refresh
+        self.subscribers:dict[int,Subscriber] = {}
+        self._slots:dict[int,asyncio.Semaphore] = {}
+        self._lease = redis.register_script(_LEASE_DUE)
+        REGISTRY.collector(self.collect_metrics)
+
+    async def collect_metrics(self)->None:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.xlen(OUTBOX_STREAM)
+            pipe.zcard(RETRY_KEY)
+            pipe.xlen(DEAD_STREAM)
+            stream, retry, dead = await pipe.execute()
+        for key, depth in ((OUTBOX_STREAM, stream), (RETRY_KEY, retry), (DEAD_STREAM, dead)):
+            QUEUE_DEPTH.labels(key).set(depth)
+
+    async def ensure_group(self)->None:
+        try:
+            await self.redis.xgroup_create(OUTBOX_STREAM, DELIVERY_GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def load(self)->None:
+        with self.Session() as session:
+            self.subscribers = await asyncio.to_thread(load_subscribers, session)
+
+    def _slot(self, sub:Subscriber)->asyncio.Semaphore:
+        #contrapressao por assinante: no maximo max_inflight POSTs simultaneos neste processo
+        slot = self._slots.get(sub.id)
+        if slot is None:
+            slot = self._slots[sub.id] = asyncio.Semaphore(sub.max_inflight)
+        return slot
+
+    async def _schedule(self, subscriber_id:int, events:list[dict], attempt:int, at:float)->None:
+        member = json.dumps({"subscriber": subscriber_id, "attempt": attempt, "events": events, "nonce": uuid.uuid4().hex})
+        await self.redis.zadd(RETRY_KEY, {member: at})
+
+    async def _failed(self, sub:Subscriber, events:list[dict], attempt:int, error:str)->None:
+        if attempt >= self.max_attempts:
+            await self.redis.xadd(DEAD_STREAM, {
+                "subscriber": sub.id, "attempts": attempt, "error": error[:500],
+                "events": json.dumps(events, separators=(",", ":")),
+            }, maxlen=STREAM_MAXLEN, approximate=True)
+            DELIVERIES.labels("dead").inc(len(events))
+            log.warning("assinante %d: %d eventos no dead letter apos %d tentativas (%s)", sub.id, len(events), attempt, error)
+            return
+        until = time.time() + min(RETRY_BASE * 2 ** (attempt - 1), RETRY_CAP)
+        await self._schedule(sub.id, events, attempt, until)
+        await self.redis.hset(BACKOFF_KEY, str(sub.id), until)
+        DELIVERIES.labels("retry").inc(len(events))
+
+    async def _deliver(self, sub:Subscriber, events:list[dict], attempt:int)->None:
+        #nunca levanta por causa do assinante: falha vira retry/dead letter
+        body = json.dumps({"events": events}, separators=(",", ":")).encode()
+        try:
+            async with self._slot(sub):
+                response = await self.http.post(sub.url, content=body, headers={
+                    "Content-Type": "application/json", SIGNATURE_HEADER: sign(sub.secret, body)})
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            reason = str(e).partition("\n")[0]
+            await self._failed(sub, events, attempt + 1, f"{type(e).__name__}: {reason}")
+            return
+        DELIVERIES.labels("ok").inc(len(events))
+        if attempt:
+            await self.redis.hdel(BACKOFF_KEY, str(sub.id))
+
+    async def dispatch(self, events:list[dict])->None:
+        now = time.time()
+        backoff = {int(k): float(v) for k, v in (await self.redis.hgetall(BACKOFF_KEY)).items()}
+        sends = []
+        for sub in self.subscribers.values():
+            mine = [e for e in events if sub.wants(e["type"])]
+            if not mine:
+                continue
+            if backoff.get(sub.id, 0.0) > now:
+                #assinante falhando: enfileira atras do backoff sem gastar tentativa
+                await self._schedule(sub.id, mine, 0, backoff[sub.id])
+                DELIVERIES.labels("deferred").inc(len(mine))
+            else:
+                sends.append(self._deliver(sub, mine, 0))
+        await asyncio.gather(*sends)
+
+    async def _read(self, consumer:str, claim:bool)->list[tuple[bytes,dict]]:
+        if claim:
+            _, claimed, *_ = await self.redis.xautoclaim(
+                OUTBOX_STREAM, DELIVERY_GROUP, consumer, int(self.claim_idle * 1000), count=self.batch)
+            claimed = [(mid, fields) for mid, fields in claimed if fields]
+            if claimed:
+                return claimed
+        reply = await self.redis.xreadgroup(DELIVERY_GROUP, consumer, {OUTBOX_STREAM: ">"}, count=self.batch, block=1000)
+        return reply[0][1] if reply else []
+
+    async def _consume(self, runtime, consumer:str)->None:
+        last_claim = 0.0
+        while not runtime.stopping:
+            claim = time.monotonic() - last_claim >= self.claim_idle
+            if claim:
+                last_claim = time.monotonic()
+            try:
+                messages = await self._read(consumer, claim)
+                if not messages:
+                    continue
+                await self.dispatch([json.loads(fields[b"body"]) for _, fields in messages])
+                await self.redis.xack(OUTBOX_STREAM, DELIVERY_GROUP, *(mid for mid, _ in messages))
+            except Exception:
+                log.exception("consumidor %s: falha entregando lote", consumer)
+                await runtime.sleep(1.0)
+
+    async def _retry(self, runtime)->None:
+        while not runtime.stopping:
+            try:
+                now = time.time()
+                due = await self._lease(keys=[RETRY_KEY], args=[now, self.batch, now + self.claim_idle])
+                await asyncio.gather(*(self._retry_one(raw) for raw in due))
+            except Exception:
+                log.exception("falha reenviando notificacoes")
+                due = []
+            if len(due) < self.batch:
+                await runtime.sleep(1.0)
+
+    async def _retry_one(self, raw:bytes)->None:
+        item = json.loads(raw)
+        sub = self.subscribers.get(item["subscriber"])
+        if sub is None:
+            #assinante removido/desativado: descarta
+            DELIVERIES.labels("dropped").inc(len(item["events"]))
+        else:
+            await self._deliver(sub, item["events"], item["attempt"])
+        await self.redis.zrem(RETRY_KEY, raw)
+
+    async def _reload(self, runtime)->None:
+        while not runtime.stopping:
+            await runtime.sleep(self.refresh)
+            try:
+                await self.load()
+            except Exception:
+                log.exception("falha recarregando assinantes")
+
+    async def run(self, runtime)->None:
+        await self.ensure_group()
+        await self.load()
+        await asyncio.gather(
+            *(self._consume(runtime, f"{self.name}-{i}") for i in range(self.consumers)),
+            self._retry(runtime),
+            self._reload(runtime),
+        )
@@ -0,0 +1,486 @@
+"""Payouts BTC parados no mempool: fee bump por RBF ou, sem orcamento para isso, CPFP.
+
+Um lote BROADCAST que passa do prazo do seu SpeedProfile (CONF_TARGET blocos * slack) e
+replanejado com plan_batch numa taxa maior: a diferenca sai do reembolso ao comprador, ou
+seja, do fn_est + buffer depositado, sem passar de fn_est + buffer por escrow. A tx nova
+gasta os mesmos depositos (BIP125) e vira um lote novo com `replaces_id`, gravado como
+SIGNED antes do broadcast. So quando o node aceita (ou ja conhece a txid) o antigo e seus
+payouts vao para FAILED e a substituta para BROADCAST, na mesma transacao, por causa de
+uq_one_broadcast_payout_per_escrow. Erro no broadcast nao decide nada: a substituta fica
+SIGNED e a passada seguinte pergunta ao node pelas duas txids. Se o orcamento nao cobre as
+regras de substituicao,
+um filho CPFP gasta a saida da plataforma (se a carteira a controla), limitado a soma dos
+buffers do lote.
+
+O acrescimo de taxa e lancado no ledger (ESCROW -> EXTERNAL:network_fees; no CPFP a
+plataforma paga). Se a tx original confirmar no lugar da substituta, a cadeia volta para
+o lote vencedor e os lancamentos do bump sao estornados.
+"""
+import asyncio
+import logging
+import math
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+
+from sqlalchemy import Row, and_, exists, or_, select, update
+from sqlalchemy.orm import Session, aliased
+
+from adapters.metrics import REGISTRY
+from adapters.ports import BtcWalletPort
+from db.escrow_view import mark_dirty
+from db.ledger import AccountKey, Journal, Leg, post_journals
+from db.models import Deposit, Dispute, Escrow, Payout, PayoutBatch
+from domain.fees import CONF_TARGET, FeeOracle
+from domain.types import BTC_DUST_SATS, Asset, DepositStatus, DisputeStatus, PayoutStatus, Role, SpeedProfile
+from worker.cluster import in_shards
+from worker.payout_batcher import (INPUT_VBYTES, TX_OVERHEAD_VBYTES, UNSENT_GRACE, UNSENT_TIMEOUT, BatchPlan, check_plan,
+                                   mark_broadcast, mark_confirmed, output_vbytes, plan_batch, record_batch)
+
+log = logging.getLogger("worker.payouts")
+
+BLOCK_SECONDS = 600
+BUMP_SLACK = float(os.getenv("PAYOUT_BUMP_SLACK", "1.5")) # prazo = CONF_TARGET * 10min * slack
+BUMP_FACTOR = float(os.getenv("PAYOUT_BUMP_FACTOR", "1.5")) # taxa minima do bump sobre a atual
+MAX_BUMPS = int(os.getenv("PAYOUT_MAX_BUMPS", "3"))
+INCREMENTAL_RELAY_SAT_VB = 1.0 # BIP125: a substituta paga pelo proprio tamanho alem da taxa antiga
+
+FEE_BUMPS = REGISTRY.counter("payout_fee_bumps_total", "Tentativas de fee bump de lotes de payout parados",
+                             ("asset", "method", "result"))
+
+NETWORK_FEES = AccountKey(Asset.BTC, "EXTERNAL", "network_fees")
+PLATFORM = AccountKey(Asset.BTC, "PLATFORM", "platform")
+
+
+def bump_after(profile:SpeedProfile|None)->timedelta:
+    return timedelta(seconds=CONF_TARGET[profile or SpeedProfile.normal] * BLOCK_SECONDS * BUMP_SLACK)
+
+
+def stuck_batches(session:Session, now:datetime, max_bumps:int=MAX_BUMPS,
+                  shards:frozenset[int]|None=None)->list[PayoutBatch]:
+    #lote com filho CPFP nao e mais substituido: o RBF do pai derrubaria o filho ja lancado;
+    #lote com substituta SIGNED espera ela se resolver (settle_pending)
+    overdue = or_(*(
+        and_(PayoutBatch.feerate_profile.is_(None) if p is None else PayoutBatch.feerate_profile == p,
+             PayoutBatch.broadcast_at < now - bump_after(p))
+        for p in (*SpeedProfile, None)
+    ))
+    replacement = aliased(PayoutBatch)
+    pending = exists().where(replacement.replaces_id == PayoutBatch.id, replacement.status == PayoutStatus.SIGNED)
+    stmt = select(PayoutBatch).where(
+        PayoutBatch.asset == Asset.BTC, PayoutBatch.status == PayoutStatus.BROADCAST,
+        PayoutBatch.bumps < max_bumps, PayoutBatch.cpfp_txid.is_(None), overdue, ~pending,
+    ).order_by(PayoutBatch.broadcast_at)
+    if shards is not None:
+        stmt = stmt.where(in_shards(PayoutBatch.id, shards))
+    return list(session.scalars(stmt))
+
+
+def load_replan(session:Session, batch_id:int):
+    #os mesmos escrows do lote, com depositos CONFIRMED e disputas fechadas, como em load_batch
+    fees = dict(session.execute(select(Payout.escrow_id, Payout.fn_real).where(Payout.batch_id == batch_id)).all())
+    escrows = list(session.scalars(select(Escrow).where(Escrow.id.in_(fees)).order_by(Escrow.id)))
+    deposits:dict[int,list[Deposit]] = {e.id: [] for e in escrows}
+    for d in session.scalars(select(Deposit).where(Deposit.escrow_id.in_(fees), Deposit.status == DepositStatus.CONFIRMED)):
+        deposits[d.escrow_id].append(d)
+    disputes = {
+        d.escrow_id: d for d in session.scalars(
+            select(Dispute).where(Dispute.escrow_id.in_(fees), Dispute.status == DisputeStatus.CLOSED))
+    }
+    return escrows, deposits, disputes, {k: v or 0 for k, v in fees.items()}
+
+
+def cap_to_buffer(plan:BatchPlan, escrows:list[Escrow], old_fees:dict[int,int])->None:
+    #taxa de cada escrow ate fn_est + buffer (ou a que ja pagava, se maior); o excesso volta ao comprador
+    caps = {e.id: e.fn_est + e.buffer for e in escrows}
+    for e in plan.escrows:
+        give = e.fn_real - max(caps[e.escrow_id], old_fees[e.escrow_id])
+        buyer = next((i for i, o in enumerate(e.outputs) if o[0] == Role.BUYER), None)
+        if give > 0 and buyer is not None:
+            role, address, amount = e.outputs[buyer]
+            e.outputs[buyer] = (role, address, amount + give)
+            e.fn_real -= give
+
+
+def _fee_journal(escrow_id:int, amount:int, batch_id:int, memo:str)->Journal:
+    return Journal(legs=[
+        Leg(AccountKey(Asset.BTC, "ESCROW", str(escrow_id)), Asset.BTC, -amount),
+        Leg(NETWORK_FEES, Asset.BTC, amount),
+    ], ref_type="payout_batch", ref_id=str(batch_id), memo=memo)
+
+
+def _cpfp_journal(amount:int, batch_id:int, memo:str)->Journal:
+    return Journal(legs=[Leg(PLATFORM, Asset.BTC, -amount), Leg(NETWORK_FEES, Asset.BTC, amount)],
+                   ref_type="payout_batch", ref_id=str(batch_id), memo=memo)
+
+
+def record_replacement(session:Session, old_id:int, plan:BatchPlan, txid:str, raw_tx:str)->int|None:
+    """Grava a substituta RBF como SIGNED, sem mexer no lote antigo. None se o antigo deixou
+    de ser BROADCAST (confirmou ou foi trocado) ou ja tem substituta pendente."""
+    old = session.execute(
+        select(PayoutBatch.bumps, PayoutBatch.first_broadcast_at)
+        .where(PayoutBatch.id == old_id, PayoutBatch.status == PayoutStatus.BROADCAST)
+        .with_for_update()
+    ).first()
+    if old is None:
+        return None
+    if session.scalar(select(PayoutBatch.id).where(PayoutBatch.replaces_id == old_id, PayoutBatch.status == PayoutStatus.SIGNED)):
+        return None
+    batch = record_batch(session, plan, txid, raw_tx, PayoutStatus.SIGNED)
+    batch.replaces_id = old_id
+    batch.bumps = old.bumps + 1
+    batch.first_broadcast_at = old.first_broadcast_at
+    session.flush()
+    return batch.id
+
+
+def activate_replacement(session:Session, new_id:int)->bool:
+    """Node aceitou a substituta: antigo e seus payouts para FAILED, substituta para BROADCAST e
+    acrescimo de taxa no ledger, numa transacao. False se algum dos dois ja mudou de estado."""
+    old_id = session.scalar(
+        select(PayoutBatch.replaces_id).where(PayoutBatch.id == new_id, PayoutBatch.status == PayoutStatus.SIGNED)
+        .with_for_update()
+    )
+    if old_id is None:
+        return False
+    replaced = session.execute(
+        update(PayoutBatch)
+        .where(PayoutBatch.id == old_id, PayoutBatch.status == PayoutStatus.BROADCAST)
+        .values(status=PayoutStatus.FAILED)
+        .returning(PayoutBatch.id)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if replaced is None:
+        return False
+    #libera uq_one_broadcast_payout_per_escrow antes de promover os payouts novos
+    old_fees = dict(session.execute(
+        update(Payout)
+        .where(Payout.batch_id == old_id, Payout.status == PayoutStatus.BROADCAST)
+        .values(status=PayoutStatus.FAILED)
+        .returning(Payout.escrow_id, Payout.fn_real)
+        .execution_options(synchronize_session=False)
+    ).all())
+    new_fees = dict(session.execute(
+        update(Payout)
+        .where(Payout.batch_id == new_id, Payout.status == PayoutStatus.SIGNED)
+        .values(status=PayoutStatus.BROADCAST)
+        .returning(Payout.escrow_id, Payout.fn_real)
+        .execution_options(synchronize_session=False)
+    ).all())
+    session.execute(
+        update(PayoutBatch).where(PayoutBatch.id == new_id)
+        .values(status=PayoutStatus.BROADCAST).execution_options(synchronize_session=False))
+    mark_broadcast(session, new_id)
+    post_journals(session, [
+        _fee_journal(escrow_id, fee - (old_fees.get(escrow_id) or 0), new_id, "fee_bump")
+        for escrow_id, fee in new_fees.items() if (fee or 0) > (old_fees.get(escrow_id) or 0)
+    ])
+    return True
+
+
+def drop_replacement(session:Session, new_id:int)->None:
+    #substituta que o node nunca aceitou: o lote antigo segue BROADCAST como estava
+    session.execute(
+        update(Payout).where(Payout.batch_id == new_id, Payout.status == PayoutStatus.SIGNED)
+        .values(status=PayoutStatus.FAILED).execution_options(synchronize_session=False))
+    session.execute(
+        update(PayoutBatch).where(PayoutBatch.id == new_id, PayoutBatch.status == PayoutStatus.SIGNED)
+        .values(status=PayoutStatus.FAILED).execution_options(synchronize_session=False))
+    mark_dirty(session, session.scalars(select(Payout.escrow_id).where(Payout.batch_id == new_id)))
+
+
+def pending_replacements(session:Session, now:datetime, shards:frozenset[int]|None=None)->list[Row]:
+    #substitutas SIGNED com a txid do lote que substituem
+    old = aliased(PayoutBatch)
+    stmt = (
+        select(PayoutBatch.id, PayoutBatch.txid, PayoutBatch.raw_tx, PayoutBatch.created_at, old.txid.label("old_txid"))
+        .join(old, old.id == PayoutBatch.replaces_id)
+        .where(PayoutBatch.status == PayoutStatus.SIGNED, PayoutBatch.created_at < now - UNSENT_GRACE)
+    )
+    if shards is not None:
+        stmt = stmt.where(in_shards(PayoutBatch.id, shards))
+    return session.execute(stmt).all()
+
+
+def restore_batch(session:Session, current_id:int, winner_id:int)->str:
+    """Desfaz a cadeia de substituicoes de `current_id` ate `winner_id` (ancestral): o vencedor
+    volta a BROADCAST e os acrescimos de taxa lancados desde ele sao estornados. Devolve o txid
+    do vencedor."""
+    dropped, batch_id = [], current_id
+    while batch_id != winner_id:
+        dropped.append(batch_id)
+        batch_id = session.scalar(select(PayoutBatch.replaces_id).where(PayoutBatch.id == batch_id))
+        if batch_id is None:
+            raise ValueError(f"lote {winner_id} nao esta na cadeia de {current_id}")
+    current_fees = dict(session.execute(select(Payout.escrow_id, Payout.fn_real).where(Payout.batch_id == current_id)).all())
+    session.execute(
+        update(Payout).where(Payout.batch_id.in_(dropped), Payout.status == PayoutStatus.BROADCAST)
+        .values(status=PayoutStatus.FAILED).execution_options(synchronize_session=False))
+    session.execute(
+        update(PayoutBatch).where(PayoutBatch.id.in_(dropped))
+        .values(status=PayoutStatus.FAILED).execution_options(synchronize_session=False))
+    winner_fees = dict(session.execute(
+        update(Payout).where(Payout.batch_id == winner_id)
+        .values(status=PayoutStatus.BROADCAST)
+        .returning(Payout.escrow_id, Payout.fn_real)
+        .execution_options(synchronize_session=False)
+    ).all())
+    txid = session.execute(
+        update(PayoutBatch).where(PayoutBatch.id == winner_id)
+        .values(status=PayoutStatus.BROADCAST)
+        .returning(PayoutBatch.txid)
+        .execution_options(synchronize_session=False)
+    ).scalar_one()
+    journals = [
+        _fee_journal(escrow_id, -(fee - (winner_fees.get(escrow_id) or 0)), current_id, "fee_bump_reverted")
+        for escrow_id, fee in current_fees.items() if (fee or 0) > (winner_fees.get(escrow_id) or 0)
+    ]
+    #filho CPFP de um lote descartado gastava uma saida que nao existe mais
+    journals += [
+        _cpfp_journal(-fee, batch_id, "cpfp_reverted")
+        for batch_id, fee in session.execute(
+            select(PayoutBatch.id, PayoutBatch.cpfp_fee).where(PayoutBatch.id.in_(dropped), PayoutBatch.cpfp_fee.is_not(None)))
+    ]
+    post_journals(session, journals)
+    mark_dirty(session, current_fees)
+    return txid
+
+
+def record_cpfp(session:Session, batch_id:int, txid:str, fee:int)->bool:
+    bumped = session.execute(
+        update(PayoutBatch)
+        .where(PayoutBatch.id == batch_id, PayoutBatch.status == PayoutStatus.BROADCAST, PayoutBatch.cpfp_txid.is_(None))
+        .values(cpfp_txid=txid, cpfp_fee=fee, bumps=PayoutBatch.bumps + 1)
+        .returning(PayoutBatch.id)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if bumped is None:
+        return False
+    post_journals(session, [_cpfp_journal(fee, batch_id, "cpfp")])
+    return True
+
+
+def revert_cpfp(session:Session, batch_id:int, fee:int)->None:
+    session.execute(
+        update(PayoutBatch).where(PayoutBatch.id == batch_id)
+        .values(cpfp_txid=None, cpfp_fee=None, bumps=PayoutBatch.bumps - 1)
+        .execution_options(synchronize_session=False))
+    post_journals(session, [_cpfp_journal(-fee, batch_id, "cpfp_reverted")])
+
+
+def replaced_chain(session:Session, batch_id:int)->list[tuple[int,str]]:
+    #(id, txid) dos lotes que `batch_id` substituiu, do mais novo ao original
+    chain = []
+    replaces = session.scalar(select(PayoutBatch.replaces_id).where(PayoutBatch.id == batch_id))
+    while replaces is not None:
+        row = session.execute(select(PayoutBatch.txid, PayoutBatch.replaces_id).where(PayoutBatch.id == replaces)).one()
+        chain.append((replaces, row.txid))
+        replaces = row.replaces_id
+    return chain
+
+
+class PayoutAccelerator:
+    """Procura lotes BROADCAST atrasados e aplica um fee bump por passada."""
+
+    def __init__(self, Session, wallet:BtcWalletPort, fees:FeeOracle, platform_address:str, max_bumps:int=MAX_BUMPS,
+                 factor:float=BUMP_FACTOR, shards:Callable[[], frozenset[int]]|None=None)->None:
+        self.Session = Session
+        self.wallet = wallet
+        self.fees = fees
+        self.platform_address = platform_address
+        self.max_bumps = max_bumps
+        self.factor = factor
+        self.shards = shards
+
+    def _owned(self)->frozenset[int]|None:
+        return self.shards() if self.shards is not None else None
+
+    def _target(self, batch:PayoutBatch)->float:
+        #a estimativa fast do momento, e pelo menos factor x a taxa que ficou parada
+        fast = self.fees.rate(Asset.BTC, SpeedProfile.fast).rate
+        return max(fast, batch.feerate_sat_vb * self.factor, batch.feerate_sat_vb + INCREMENTAL_RELAY_SAT_VB)
+
+    async def _resolve_replacement(self, new_id:int, old_txid:str, txid:str, raw:str, created_at:datetime|None=None)->str:
+        """Broadcast da substituta SIGNED e decisao pelo que o node sabe, nunca pela excecao:
+        txid conhecida -> ativa; conflitada, original confirmada ou recusada alem de
+        UNSENT_TIMEOUT -> descarta; senao continua pendente para a proxima passada."""
+        try:
+            await self.wallet.broadcast(raw)
+            accepted = True
+        except Exception:
+            log.warning("broadcast da substituta %s falhou; conferindo no node", txid, exc_info=True)
+            accepted = False
+        confirmations = None if accepted else await self.wallet.get_confirmations(txid)
+        if accepted or (confirmations is not None and confirmations >= 0):
+            def activate():
+                with self.Session.begin() as session:
+                    return activate_replacement(session, new_id)
+            return "ok" if await asyncio.to_thread(activate) else "raced"
+        original = await self.wallet.get_confirmations(old_txid)
+        expired = created_at is not None and datetime.now(timezone.utc) - created_at > UNSENT_TIMEOUT
+        if confirmations is None and (original or 0) < 1 and not expired:
+            return "pending"
+        def drop():
+            with self.Session.begin() as session:
+                drop_replacement(session, new_id)
+        await asyncio.to_thread(drop)
+        log.warning("substituta %s descartada (substituta=%s, original %s=%s)", txid, confirmations, old_txid, original)
+        return "rejected"
+
+    async def settle_pending(self)->int:
+        """Substitutas SIGNED de passadas anteriores (broadcast com erro ou worker caiu antes dele)."""
+        def load():
+            with self.Session() as session:
+                return pending_replacements(session, datetime.now(timezone.utc), self._owned())
+        settled = 0
+        for r in await asyncio.to_thread(load):
+            result = await self._resolve_replacement(r.id, r.old_txid, r.txid, r.raw_tx, r.created_at)
+            if result != "pending":
+                FEE_BUMPS.labels(Asset.BTC.value, "rbf", f"settled_{result}").inc()
+                settled += 1
+        return settled
+
+    async def settle_children(self)->int:
+        """Filho CPFP gravado que a carteira nao conhece (worker caiu antes do broadcast):
+        estorna para o lote poder receber outro bump."""
+        def load():
+            with self.Session() as session:
+                stmt = select(PayoutBatch.id, PayoutBatch.cpfp_txid, PayoutBatch.cpfp_fee).where(
+                    PayoutBatch.status == PayoutStatus.BROADCAST, PayoutBatch.cpfp_txid.is_not(None))
+                shards = self._owned()
+                if shards is not None:
+                    stmt = stmt.where(in_shards(PayoutBatch.id, shards))
+                return session.execute(stmt).all()
+        reverted = 0
+        for batch in await asyncio.to_thread(load):
+            if await self.wallet.get_confirmations(batch.cpfp_txid) is not None:
+                continue
+            def undo():
+                with self.Session.begin() as session:
+                    revert_cpfp(session, batch.id, batch.cpfp_fee)
+            await asyncio.to_thread(undo)
+            log.warning("lote %d: filho CPFP %s nunca chegou ao node; estornado", batch.id, batch.cpfp_txid)
+            reverted += 1
+        return reverted
+
+    async def settle_replaced(self)->int:
+        """Substituta conflitada: a tx de um lote anterior confirmou no lugar dela. Volta a cadeia
+        para esse lote e confirma por ele."""
+        def load():
+            with self.Session() as session:
+                stmt = select(PayoutBatch.id, PayoutBatch.txid).where(
+                    PayoutBatch.status == PayoutStatus.BROADCAST, PayoutBatch.replaces_id.is_not(None))
+                shards = self._owned()
+                if shards is not None:
+                    stmt = stmt.where(in_shards(PayoutBatch.id, shards))
+                return [(b.id, b.txid, replaced_chain(session, b.id)) for b in session.execute(stmt)]
+        settled = 0
+        for batch_id, txid, chain in await asyncio.to_thread(load):
+            confirmations = await self.wallet.get_confirmations(txid)
+            if confirmations is None or confirmations >= 0:
+                continue
+            winner = None
+            for old_id, old_txid in chain:
+                if (await self.wallet.get_confirmations(old_txid) or 0) >= 1:
+                    winner = old_id
+                    break
+            if winner is None:
+                log.error("lote %d (%s) conflitado sem ancestral confirmado", batch_id, txid)
+                continue
+            def persist():
+                with self.Session.begin() as session:
+                    mark_confirmed(session, [restore_batch(session, batch_id, winner)])
+            await asyncio.to_thread(persist)
+            FEE_BUMPS.labels(Asset.BTC.value, "rbf", "original_confirmed").inc()
+            log.warning("lote %d: a tx original do lote %d confirmou antes da substituta %s", batch_id, winner, txid)
+            settled += 1
+        return settled
+
+    async def bump_stuck(self)->int:
+        shards = self._owned()
+        if shards is not None and not shards:
+            return 0
+        def load():
+            with self.Session() as session:
+                return stuck_batches(session, datetime.now(timezone.utc), self.max_bumps, shards)
+        bumped = 0
+        for batch in await asyncio.to_thread(load):
+            try:
+                method, result = await self.bump(batch)
+            except Exception:
+                log.exception("falha no fee bump do lote %d (%s)", batch.id, batch.txid)
+                method, result = "rbf", "error"
+            FEE_BUMPS.labels(batch.asset.value, method, result).inc()
+            bumped += result == "ok"
+        return bumped
+
+    async def bump(self, batch:PayoutBatch)->tuple[str,str]:
+        if await self.wallet.get_confirmations(batch.txid) != 0:
+            return "rbf", "skipped" # confirmou (o batcher fecha) ou foi substituida (settle_replaced)
+        def load():
+            with self.Session() as session:
+                return load_replan(session, batch.id)
+        escrows, deposits, disputes, old_fees = await asyncio.to_thread(load)
+        if len(escrows) != len(old_fees) or not all(deposits.values()):
+            return "rbf", "skipped" # escrow arquivado ou deposito derrubado por reorg: nao replaneja
+        target = self._target(batch)
+        plan = plan_batch(escrows, deposits, disputes, target, self.platform_address, batch.feerate_profile)
+        cap_to_buffer(plan, escrows, old_fees)
+        check_plan(plan)
+        if (plan.fee >= batch.fee + math.ceil(INCREMENTAL_RELAY_SAT_VB * plan.vbytes_est)
+                and plan.fee / plan.vbytes_est > batch.fee / batch.vbytes_est):
+            return "rbf", await self._replace(batch, plan)
+        return "cpfp", await self._child(batch, escrows, target)
+
+    async def _replace(self, batch:PayoutBatch, plan:BatchPlan)->str:
+        txid, raw = await self.wallet.sign_transaction(plan.inputs, plan.outputs)
+        def persist():
+            with self.Session.begin() as session:
+                return record_replacement(session, batch.id, plan, txid, raw)
+        new_id = await asyncio.to_thread(persist)
+        if new_id is None:
+            return "raced"
+        result = await self._resolve_replacement(new_id, batch.txid, txid, raw)
+        if result == "ok":
+            log.info("lote %d: RBF %s -> %s, fee %d -> %d sats (%.1f sat/vB)",
+                     batch.id, batch.txid, txid, batch.fee, plan.fee, plan.fee / plan.vbytes_est)
+        return result
+
+    async def _child(self, batch:PayoutBatch, escrows:list[Escrow], target:float)->str:
+        output = await self.wallet.wallet_output(batch.txid, self.platform_address)
+        if output is None:
+            return "no_budget"
+        vout, amount = output
+        child_vbytes = TX_OVERHEAD_VBYTES + INPUT_VBYTES + output_vbytes(self.platform_address)
+        #o pacote pai+filho precisa atingir `target`; o filho paga a diferenca, ate a soma dos buffers
+        fee = math.ceil(target * (batch.vbytes_est + child_vbytes)) - batch.fee
+        fee = min(fee, sum(e.buffer for e in escrows), amount - BTC_DUST_SATS)
+        if fee < math.ceil(INCREMENTAL_RELAY_SAT_VB * child_vbytes):
+            return "no_budget"
+        txid, raw = await self.wallet.sign_transaction([(batch.txid, vout)], {self.platform_address: amount - fee})
+        def persist():
+            with self.Session.begin() as session:
+                return record_cpfp(session, batch.id, txid, fee)
+        if not await asyncio.to_thread(persist):
+            return "raced"
+        try:
+            await self.wallet.broadcast(raw)
+        except Exception:
+            #timeout pode ter sido aceito: so estorna se a carteira nao conhece o filho
+            if await self.wallet.get_confirmations(txid) is not None:
+                log.warning("broadcast do filho CPFP %s do lote %d falhou, mas o node ja o tem", txid, batch.id, exc_info=True)
+                return "ok"
+            log.warning("node recusou o filho CPFP %s do lote %d", txid, batch.id, exc_info=True)
+            def undo():
+                with self.Session.begin() as session:
+                    revert_cpfp(session, batch.id, fee)
+            await asyncio.to_thread(undo)
+            return "rejected"
+        log.info("lote %d: CPFP %s gastando %s:%d, fee %d sats", batch.id, txid, batch.txid, vout, fee)
+        return "ok"
+
+    async def run_once(self)->int:
+        await self.settle_pending()
+        await self.settle_children()
+        await self.settle_replaced()
+        return await self.bump_stuck()
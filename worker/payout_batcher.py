@@ -0,0 +1,421 @@
+import asyncio
+import logging
+import math
+from dataclasses import dataclass, field
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+
+from sqlalchemy import Row, exists, func, select, update
+from sqlalchemy.orm import Session
+
+from adapters.metrics import LAG_BUCKETS, REGISTRY
+from adapters.ports import BtcWalletPort
+from db.escrow_transitions import transition_many
+from db.escrow_view import mark_dirty
+from db.models import Deposit, Dispute, Escrow, Payout, PayoutBatch, PayoutOutput
+from db.outbox import Outgoing, emit
+from domain.fees import FeeOracle
+from domain.state_machine import Event
+from domain.types import (BTC_DUST_SATS, Asset, DepositStatus, DisputeStatus, EscrowState, PayoutKind,
+                          PayoutStatus, Role, SpeedProfile)
+from worker.cluster import in_shards
+
+log = logging.getLogger("worker.payouts")
+
+PAYOUT_CONFIRM_SECONDS = REGISTRY.histogram(
+    "payout_broadcast_to_confirm_seconds", "Do broadcast do lote de payout ate a 1a confirmacao", ("asset",), LAG_BUCKETS)
+BUMP_OUTCOME_SECONDS = REGISTRY.histogram(
+    "payout_bump_outcome_seconds", "Do primeiro broadcast ate a confirmacao, por fee bump aplicado (none, rbf, cpfp)",
+    ("asset", "bump"), LAG_BUCKETS)
+
+UNSENT_GRACE = timedelta(seconds=30) # lote gravado ha menos que isso pode estar no meio do flush
+UNSENT_TIMEOUT = timedelta(seconds=float(os.getenv("PAYOUT_UNSENT_TIMEOUT_SECONDS", "3600")))
+
+#Tamanhos aproximados em vbytes (inputs P2WPKH das destinations do escrow)
+TX_OVERHEAD_VBYTES = 11
+INPUT_VBYTES = 68
+
+
+def output_vbytes(address:str)->int:
+    lower = address.lower()
+    if lower.startswith(("bc1p", "tb1p", "bcrt1p")):
+        return 43 # P2TR
+    if lower.startswith(("bc1q", "tb1q", "bcrt1q")):
+        return 31 if len(address) < 50 else 43 # P2WPKH / P2WSH
+    if address[:1] in ("3", "2"):
+        return 32 # P2SH
+    return 34 # P2PKH
+
+
+@dataclass
+class EscrowPayout:
+    escrow_id:int
+    kind:PayoutKind
+    fn_est:int
+    inputs:list[tuple[str,int,int]] # (txid, vout, amount)
+    outputs:list[tuple[Role,str,int]] = field(default_factory=list)
+    vbytes_est:int = 0
+    fn_real:int = 0
+
+
+@dataclass
+class BatchPlan:
+    profile:SpeedProfile|None
+    feerate:float
+    escrows:list[EscrowPayout]
+
+    @property
+    def inputs(self)->list[tuple[str,int]]:
+        return [(txid, vout) for e in self.escrows for txid, vout, _ in e.inputs]
+
+    @property
+    def outputs(self)->dict[str,int]:
+        #Outputs com o mesmo endereco (ex: plataforma) viram um so na tx
+        merged:dict[str,int] = {}
+        for e in self.escrows:
+            for _, address, amount in e.outputs:
+                merged[address] = merged.get(address, 0) + amount
+        return merged
+
+    @property
+    def fee(self)->int:
+        return sum(e.fn_real for e in self.escrows)
+
+    @property
+    def vbytes_est(self)->int:
+        return sum(e.vbytes_est for e in self.escrows)
+
+
+def plan_batch(escrows:list[Escrow], deposits:dict[int,list[Deposit]], disputes:dict[int,Dispute],
+               feerate:float, platform_address:str, profile:SpeedProfile|None)->BatchPlan:
+    """Divide uma tx com varios escrows em contas exatas por escrow.
+
+    Cada escrow paga seus inputs, seus outputs e uma fatia igual do overhead da tx e do
+    output (compartilhado) da plataforma. A sobra do orcamento de taxa (fn_est + buffer
+    depositados) volta para o comprador se passar do dust; senao fica como miner fee.
+    Assim inputs - outputs de cada escrow == fn_real, e a soma dos fn_real == taxa da tx.
+    ValueError se algum escrow nao fecha (ver check_plan): nada e assinado.
+    """
+    n = len(escrows)
+    shared = TX_OVERHEAD_VBYTES + output_vbytes(platform_address)
+    plans = []
+    for i, escrow in enumerate(escrows):
+        ins = [(d.txid, d.vout, d.amount) for d in deposits[escrow.id]]
+        total_in = sum(amount for _, _, amount in ins)
+        dispute = disputes.get(escrow.id)
+        plan = EscrowPayout(escrow.id, PayoutKind.DISPUTE if dispute else PayoutKind.NORMAL, escrow.fn_est, ins)
+
+        seller = (dispute.to_seller or 0) if dispute else escrow.price
+        buyer_address = escrow.buyer_payout_address
+        buyer = (dispute.to_buyer or 0) if dispute else 0
+        #Valores abaixo do dust nao viram output e ficam como miner fee
+        own = [(Role.SELLER, escrow.seller_payout_address, seller)] if seller >= BTC_DUST_SATS else []
+        buyer = buyer if buyer >= BTC_DUST_SATS else 0
+        if buyer and not buyer_address:
+            #_eligible ja segura esses escrows; a parte do comprador nunca vira miner fee
+            raise ValueError(f"escrow {escrow.id}: disputa destina {buyer} sats ao comprador sem buyer_payout_address")
+
+        vbytes = len(ins) * INPUT_VBYTES + shared // n + (1 if i < shared % n else 0)
+        vbytes += sum(output_vbytes(o[1]) for o in own) + (output_vbytes(buyer_address) if buyer else 0)
+        budget = total_in - escrow.platform_fee - sum(o[2] for o in own) - buyer
+
+        #Sobra do orcamento de taxa volta ao comprador quando compensa o output
+        if buyer_address:
+            extra = 0 if buyer else output_vbytes(buyer_address)
+            refund = budget - math.ceil(feerate * (vbytes + extra))
+            if refund > 0 and (buyer or refund >= BTC_DUST_SATS):
+                buyer += refund
+                vbytes += extra
+        if buyer:
+            own.append((Role.BUYER, buyer_address, buyer))
+
+        plan.outputs = own + [(Role.PLATFORM, platform_address, escrow.platform_fee)]
+        plan.vbytes_est = vbytes
+        plan.fn_real = total_in - sum(o[2] for o in plan.outputs)
+        plans.append(plan)
+    batch = BatchPlan(profile, feerate, plans)
+    check_plan(batch)
+    return batch
+
+
+def check_plan(plan:BatchPlan)->None:
+    #cada escrow paga a propria taxa com os proprios depositos: nenhum subsidia outro e a tx nunca gasta mais do que entra
+    for e in plan.escrows:
+        total_in = sum(amount for _, _, amount in e.inputs)
+        total_out = sum(amount for _, _, amount in e.outputs)
+        if e.fn_real < 0 or total_out > total_in or total_in - total_out != e.fn_real:
+            raise ValueError(f"escrow {e.escrow_id}: entradas {total_in}, saidas {total_out}, fn_real {e.fn_real}")
+    total_in = sum(amount for e in plan.escrows for _, _, amount in e.inputs)
+    if sum(plan.outputs.values()) + plan.fee != total_in:
+        raise ValueError(f"lote nao fecha: entradas {total_in}, saidas {sum(plan.outputs.values())}, fee {plan.fee}")
+
+
+def _eligible(profile:SpeedProfile|None, shards:frozenset[int]|None=None):
+    live = exists().where(
+        Payout.escrow_id == Escrow.id,
+        Payout.status.in_([PayoutStatus.BROADCAST, PayoutStatus.CONFIRMED]),
+    )
+    #disputa com parte do comprador espera ate existir buyer_payout_address
+    owes_buyer = exists().where(
+        Dispute.escrow_id == Escrow.id, Dispute.status == DisputeStatus.CLOSED, Dispute.to_buyer >= BTC_DUST_SATS,
+    )
+    conditions = (
+        Escrow.asset == Asset.BTC,
+        Escrow.state.in_([EscrowState.RELEASED, EscrowState.RESOLVED]),
+        Escrow.payout_speed_profile == profile,
+        ~live,
+        Escrow.buyer_payout_address.is_not(None) | ~owes_buyer,
+    )
+    #com varios workers cada um so monta lotes dos shards que possui (worker/cluster.py)
+    return conditions if shards is None else (*conditions, in_shards(Escrow.id, shards))
+
+
+def pending_summary(session:Session, profile:SpeedProfile|None,
+                    shards:frozenset[int]|None=None)->tuple[int, datetime|None]:
+    #Quantos escrows aguardam payout e desde quando (para decidir se fecha o lote)
+    return session.execute(
+        select(func.count(), func.min(Escrow.updated_at)).where(*_eligible(profile, shards))
+    ).one()
+
+
+def load_batch(session:Session, profile:SpeedProfile|None, max_escrows:int, shards:frozenset[int]|None=None):
+    escrows = list(session.scalars(
+        select(Escrow).where(*_eligible(profile, shards)).order_by(Escrow.updated_at).limit(max_escrows)
+    ))
+    ids = [e.id for e in escrows]
+    deposits:dict[int,list[Deposit]] = {i: [] for i in ids}
+    for d in session.scalars(select(Deposit).where(Deposit.escrow_id.in_(ids), Deposit.status == DepositStatus.CONFIRMED)):
+        deposits[d.escrow_id].append(d)
+    disputes = {
+        d.escrow_id: d for d in session.scalars(
+            select(Dispute).where(Dispute.escrow_id.in_(ids), Dispute.status == DisputeStatus.CLOSED)
+        )
+    }
+    return [e for e in escrows if deposits[e.id]], deposits, disputes
+
+
+def payout_event(kind:str, payout_id:int, escrow_id:int, asset:Asset, payout_kind:PayoutKind, txid:str)->Outgoing:
+    return Outgoing(kind, escrow_id, asset, {"payout_id": payout_id, "kind": payout_kind.value, "txid": txid})
+
+
+def record_batch(session:Session, plan:BatchPlan, txid:str, raw_tx:str,
+                 status:PayoutStatus=PayoutStatus.BROADCAST)->PayoutBatch:
+    """Grava o lote assinado e um Payout por escrow, antes do broadcast: BROADCAST sem
+    broadcast_at ate mark_broadcast. Se outro worker ja pagou algum desses escrows,
+    uq_one_broadcast_payout_per_escrow estoura aqui, antes do broadcast. Substituta de RBF
+    entra como SIGNED, ao lado do lote que ainda esta BROADCAST."""
+    batch = PayoutBatch(asset=Asset.BTC, txid=txid, status=status, feerate_profile=plan.profile,
+                        feerate_sat_vb=plan.feerate, vbytes_est=plan.vbytes_est, fee=plan.fee, raw_tx=raw_tx)
+    session.add(batch)
+    for e in plan.escrows:
+        payout = Payout(escrow_id=e.escrow_id, asset=Asset.BTC, kind=e.kind, txid=txid, status=status,
+                        feerate_profile=plan.profile, vbytes_est=e.vbytes_est, fn_est_at_send=e.fn_est,
+                        fn_real=e.fn_real, batch=batch)
+        payout.outputs = [PayoutOutput(role=role, address=address, amount=amount) for role, address, amount in e.outputs]
+        session.add(payout)
+    mark_dirty(session, (e.escrow_id for e in plan.escrows))
+    session.flush()
+    return batch
+
+
+def mark_broadcast(session:Session, batch_id:int)->bool:
+    #node aceitou a tx (ou ja a conhecia): so agora o lote conta como transmitido e os assinantes sao avisados
+    now = datetime.now(timezone.utc)
+    batch = session.execute(
+        update(PayoutBatch)
+        .where(PayoutBatch.id == batch_id, PayoutBatch.status == PayoutStatus.BROADCAST, PayoutBatch.broadcast_at.is_(None))
+        .values(broadcast_at=now, first_broadcast_at=func.coalesce(PayoutBatch.first_broadcast_at, now))
+        .returning(PayoutBatch.txid)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if batch is None:
+        return False
+    payouts = session.execute(
+        update(Payout)
+        .where(Payout.batch_id == batch_id, Payout.status == PayoutStatus.BROADCAST)
+        .values(broadcast_at=now)
+        .returning(Payout.id, Payout.escrow_id, Payout.asset, Payout.kind, Payout.txid)
+        .execution_options(synchronize_session=False)
+    ).all()
+    mark_dirty(session, (p.escrow_id for p in payouts))
+    emit(session, [payout_event("payout.broadcast", *p) for p in payouts])
+    return True
+
+
+def fail_unsent(session:Session, batch_id:int)->bool:
+    #tx que o node nunca aceitou: libera os escrows para um lote novo
+    failed = session.execute(
+        update(PayoutBatch)
+        .where(PayoutBatch.id == batch_id, PayoutBatch.status == PayoutStatus.BROADCAST, PayoutBatch.broadcast_at.is_(None))
+        .values(status=PayoutStatus.FAILED)
+        .returning(PayoutBatch.id)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if failed is None:
+        return False
+    escrow_ids = session.execute(
+        update(Payout).where(Payout.batch_id == batch_id, Payout.status == PayoutStatus.BROADCAST)
+        .values(status=PayoutStatus.FAILED)
+        .returning(Payout.escrow_id)
+        .execution_options(synchronize_session=False)
+    ).scalars()
+    mark_dirty(session, escrow_ids)
+    return True
+
+
+def unsent_batches(session:Session, now:datetime, shards:frozenset[int]|None=None)->list[Row]:
+    #gravados e nunca confirmados pelo node: broadcast falhou, estourou timeout ou o worker caiu no meio
+    stmt = select(PayoutBatch.id, PayoutBatch.txid, PayoutBatch.raw_tx, PayoutBatch.created_at).where(
+        PayoutBatch.status == PayoutStatus.BROADCAST, PayoutBatch.broadcast_at.is_(None),
+        PayoutBatch.created_at < now - UNSENT_GRACE,
+    )
+    if shards is not None:
+        stmt = stmt.where(in_shards(PayoutBatch.id, shards))
+    return session.execute(stmt).all()
+
+
+def broadcast_batches(session:Session, shards:frozenset[int]|None=None)->list[str]:
+    stmt = select(PayoutBatch.txid).where(PayoutBatch.status == PayoutStatus.BROADCAST, PayoutBatch.broadcast_at.is_not(None))
+    if shards is not None:
+        stmt = stmt.where(in_shards(PayoutBatch.id, shards))
+    return list(session.scalars(stmt))
+
+
+def mark_confirmed(session:Session, txids:list[str])->list[Row]:
+    #lote e payouts da mesma tx viram CONFIRMED juntos e os escrows fecham (CLOSED);
+    #devolve os horarios de broadcast e o bump aplicado para as metricas
+    now = datetime.now(timezone.utc)
+    confirmed = session.execute(
+        update(Payout)
+        .where(Payout.txid.in_(txids), Payout.status == PayoutStatus.BROADCAST)
+        .values(status=PayoutStatus.CONFIRMED, confirmed_at=now)
+        .returning(Payout.id, Payout.escrow_id, Payout.asset, Payout.kind, Payout.txid)
+        .execution_options(synchronize_session=False)
+    ).all()
+    if confirmed:
+        emit(session, [payout_event("payout.confirmed", *p) for p in confirmed])
+        transition_many(session, Event.CLOSE, [p.escrow_id for p in confirmed], lock="wait")
+    return list(session.execute(
+        update(PayoutBatch)
+        .where(PayoutBatch.txid.in_(txids), PayoutBatch.status == PayoutStatus.BROADCAST)
+        .values(status=PayoutStatus.CONFIRMED, confirmed_at=now)
+        .returning(PayoutBatch.asset, PayoutBatch.broadcast_at, PayoutBatch.first_broadcast_at,
+                   PayoutBatch.bumps, PayoutBatch.cpfp_txid)
+        .execution_options(synchronize_session=False)
+    ).all())
+
+
+class PayoutBatcher:
+    """Junta escrows BTC liberados (RELEASED/RESOLVED) numa unica tx por perfil de velocidade.
+
+    O lote fecha quando atinge `max_outputs` ou quando o escrow mais antigo espera mais
+    que `window` segundos. Por lote: 1 sign + 1 broadcast no node, em vez de 1 por escrow.
+    """
+
+    def __init__(self, Session, wallet:BtcWalletPort, fees:FeeOracle, platform_address:str, window:float=60.0, max_outputs:int=200,
+                 shards:Callable[[], frozenset[int]]|None=None)->None:
+        self.Session = Session
+        self.shards = shards
+        self.wallet = wallet
+        self.fees = fees
+        self.platform_address = platform_address
+        self.window = window
+        self.max_escrows = max(1, (max_outputs - 1) // 2) # seller + buyer por escrow, plataforma compartilhada
+
+    def _owned(self)->frozenset[int]|None:
+        return self.shards() if self.shards is not None else None
+
+    def _due(self, profile:SpeedProfile|None, shards:frozenset[int]|None)->bool:
+        with self.Session() as session:
+            count, oldest = pending_summary(session, profile, shards)
+        if not count:
+            return False
+        waited = (datetime.now(timezone.utc) - oldest).total_seconds() if oldest else 0
+        return count >= self.max_escrows or waited >= self.window
+
+    async def flush(self, profile:SpeedProfile|None)->PayoutBatch|None:
+        #o mesmo conjunto de shards do inicio ao fim do lote, mesmo se rebalancear no meio
+        shards = self._owned()
+        if shards is not None and not shards:
+            return None
+        if not await asyncio.to_thread(self._due, profile, shards):
+            return None
+        with self.Session() as session:
+            escrows, deposits, disputes = await asyncio.to_thread(load_batch, session, profile, self.max_escrows, shards)
+        if not escrows:
+            return None
+        feerate = self.fees.rate(Asset.BTC, profile or SpeedProfile.normal).rate
+        plan = plan_batch(escrows, deposits, disputes, feerate, self.platform_address, profile)
+        txid, raw = await self.wallet.sign_transaction(plan.inputs, plan.outputs)
+
+        def persist():
+            with self.Session.begin() as session:
+                batch = record_batch(session, plan, txid, raw)
+                return batch, batch.id
+        batch, batch_id = await asyncio.to_thread(persist)
+        log.info("lote %s: %d escrows, %d vB, fee=%d sats", txid, len(plan.escrows), plan.vbytes_est, plan.fee)
+        await self._send(batch_id, txid, raw)
+        return batch
+
+    async def _send(self, batch_id:int, txid:str, raw:str)->bool:
+        #um erro no broadcast nao diz se o node aceitou (timeout): fica sem broadcast_at e resume_unsent pergunta ao node
+        try:
+            await self.wallet.broadcast(raw)
+        except Exception:
+            log.warning("broadcast do lote %d (%s) falhou; nova tentativa na proxima passada", batch_id, txid, exc_info=True)
+            return False
+        def persist():
+            with self.Session.begin() as session:
+                mark_broadcast(session, batch_id)
+        await asyncio.to_thread(persist)
+        return True
+
+    async def resume_unsent(self)->int:
+        """Lotes gravados sem broadcast confirmado: se o node ja conhece a tx, so marca; senao
+        retransmite o hex assinado. Depois de UNSENT_TIMEOUT recusado, o lote falha e os
+        escrows voltam para o proximo lote."""
+        now = datetime.now(timezone.utc)
+        def load():
+            with self.Session() as session:
+                return unsent_batches(session, now, self._owned())
+        sent = 0
+        for batch in await asyncio.to_thread(load):
+            if await self.wallet.get_confirmations(batch.txid) is not None:
+                def persist():
+                    with self.Session.begin() as session:
+                        mark_broadcast(session, batch.id)
+                await asyncio.to_thread(persist)
+                sent += 1
+            elif await self._send(batch.id, batch.txid, batch.raw_tx):
+                sent += 1
+            elif now - batch.created_at > UNSENT_TIMEOUT:
+                log.error("lote %d (%s) recusado pelo node desde %s; escrows voltam para um lote novo",
+                          batch.id, batch.txid, batch.created_at.isoformat())
+                def fail():
+                    with self.Session.begin() as session:
+                        fail_unsent(session, batch.id)
+                await asyncio.to_thread(fail)
+        return sent
+
+    async def track_confirmations(self)->int:
+        with self.Session() as session:
+            txids = await asyncio.to_thread(broadcast_batches, session, self._owned())
+        if not txids:
+            return 0
+        confs = await asyncio.gather(*(self.wallet.get_confirmations(t) for t in txids), return_exceptions=True)
+        confirmed = [t for t, c in zip(txids, confs) if isinstance(c, int) and c >= 1]
+        if not confirmed:
+            return 0
+
+        def persist():
+            with self.Session.begin() as session:
+                return mark_confirmed(session, confirmed)
+        now = datetime.now(timezone.utc)
+        for batch in await asyncio.to_thread(persist):
+            if batch.broadcast_at is not None:
+                PAYOUT_CONFIRM_SECONDS.labels(batch.asset.value).observe((now - batch.broadcast_at).total_seconds())
+            if batch.first_broadcast_at is not None:
+                bump = "cpfp" if batch.cpfp_txid else "rbf" if batch.bumps else "none"
+                BUMP_OUTCOME_SECONDS.labels(batch.asset.value, bump).observe((now - batch.first_broadcast_at).total_seconds())
+        return len(confirmed)
@@ -0,0 +1,293 @@
+"""Conciliacao carteira x banco: deposits, payouts e ledger_entries, por janela de blocos.
+
+Cada janela [de, ate] le o historico da carteira so daquele range (listsinceblock /
+get_transfers por altura), ordena por (txid, vout, endereco) e faz merge-join com os
+deposits do banco lidos na mesma ordem por cursor no servidor: so um item de cada lado
+na memoria alem da janela da carteira. Saidas da carteira sao conferidas contra os
+payout_outputs das mesmas txids; no ledger, todo journal tocado desde a ultima janela
+precisa somar zero.
+
+A janela, suas divergencias e o checkpoint (ReconciliationRun.to_height) commitam juntos:
+uma execucao interrompida retoma da ultima janela gravada e uma rodada diaria so le os
+blocos novos. So entra bloco com confirmations_min: acima disso um reorg ainda pode
+mover depositos, e a passada de confirmacoes ja trata esse caso.
+"""
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterable, Iterator, TypeVar
+
+from sqlalchemy import Row, func, insert, select
+from sqlalchemy.orm import Session, sessionmaker
+
+from adapters.metrics import LAG_BUCKETS, REGISTRY
+from adapters.ports import ChainPort, WalletHistoryPort
+from db.models import Deposit, LedgerEntry, Payout, PayoutOutput, ReconciliationDiscrepancy, ReconciliationRun
+from domain.types import Asset, confirmations_min
+
+log = logging.getLogger("worker.reconciliation")
+
+WINDOW_BLOCKS = int(os.getenv("RECONCILE_WINDOW_BLOCKS", "1000"))
+INTERVAL_SECONDS = float(os.getenv("RECONCILE_INTERVAL_SECONDS", "86400"))
+FETCH_ROWS = 2000 # linhas por ida ao cursor no servidor
+FLUSH_DISCREPANCIES = 1000
+LEDGER_SETTLE = timedelta(minutes=1) # lancamentos mais novos podem ter id menor ainda nao commitado
+
+RECONCILED_HEIGHT = REGISTRY.gauge("reconciliation_height", "Checkpoint da conciliacao carteira x banco", ("asset",))
+DISCREPANCIES = REGISTRY.counter("reconciliation_discrepancies_total", "Divergencias carteira x banco", ("asset", "kind"))
+WINDOW_SECONDS = REGISTRY.histogram("reconciliation_window_seconds", "Duracao de uma janela de conciliacao", ("asset",), LAG_BUCKETS)
+
+T = TypeVar("T")
+U = TypeVar("U")
+
+
+def start_height(asset:Asset)->int|None:
+    #RECONCILE_BTC_START_HEIGHT: primeira altura conciliada; sem ela comeca no tip seguro da primeira execucao
+    value = os.getenv(f"RECONCILE_{asset.value}_START_HEIGHT")
+    return int(value) if value else None
+
+
+def merge_join(left:Iterable[T], right:Iterable[U], left_key:Callable[[T],tuple],
+               right_key:Callable[[U],tuple])->Iterator[tuple[T|None,U|None]]:
+    """Pares (esquerda, direita) com a mesma chave e os sem par (None do outro lado).
+    As duas entradas precisam vir ordenadas pela chave."""
+    lit, rit = iter(left), iter(right)
+    l, r = next(lit, None), next(rit, None)
+    while l is not None or r is not None:
+        if r is None or (l is not None and left_key(l) < right_key(r)):
+            yield l, None
+            l = next(lit, None)
+        elif l is None or right_key(r) < left_key(l):
+            yield None, r
+            r = next(rit, None)
+        else:
+            yield l, r
+            l, r = next(lit, None), next(rit, None)
+
+
+def _key(txid:str, vout:int|None, address:str|None)->tuple:
+    #XMR nao tem vout; -1/"" mantem a ordem igual a do ORDER BY do banco
+    return txid, -1 if vout is None else vout, address or ""
+
+
+@dataclass(frozen=True)
+class Checkpoint:
+    height:int # ultima altura conciliada
+    ledger_entry_id:int
+
+
+@dataclass(frozen=True)
+class WindowResult:
+    asset:Asset
+    from_height:int
+    to_height:int
+    wallet_items:int
+    db_items:int
+    discrepancies:dict[str,int]
+
+
+def load_checkpoint(session:Session, asset:Asset)->Checkpoint|None:
+    row = session.execute(
+        select(ReconciliationRun.to_height, ReconciliationRun.ledger_entry_id)
+        .where(ReconciliationRun.asset == asset)
+        .order_by(ReconciliationRun.to_height.desc())
+        .limit(1)
+    ).first()
+    return Checkpoint(row.to_height, row.ledger_entry_id) if row else None
+
+
+def ledger_watermark(session:Session, asset:Asset, after:int)->int:
+    #maior id com folga de LEDGER_SETTLE: abaixo dele todo lancamento ja commitou
+    cutoff = datetime.now(timezone.utc) - LEDGER_SETTLE
+    upto = session.scalar(
+        select(func.max(LedgerEntry.id)).where(LedgerEntry.asset == asset, LedgerEntry.id > after, LedgerEntry.created_at < cutoff)
+    )
+    return upto if upto is not None else after
+
+
+def _db_deposits(session:Session, asset:Asset, lo:int, hi:int)->Iterator[Row]:
+    stmt = (
+        select(Deposit.txid, Deposit.vout, Deposit.destination, Deposit.amount, Deposit.confirmed_height, Deposit.escrow_id)
+        .where(Deposit.asset == asset, Deposit.confirmed_height.between(lo, hi))
+        .order_by(Deposit.txid.collate("C"), func.coalesce(Deposit.vout, -1), Deposit.destination.collate("C"))
+        .execution_options(yield_per=FETCH_ROWS)
+    )
+    return iter(session.execute(stmt))
+
+
+def _db_payout_outputs(session:Session, asset:Asset, txids:list[str])->Iterator[Row]:
+    #um lote BTC paga varios escrows na mesma tx: soma por (txid, endereco), como a carteira ve
+    stmt = (
+        select(Payout.txid, PayoutOutput.address, func.sum(PayoutOutput.amount).label("amount"))
+        .join(PayoutOutput, PayoutOutput.payout_id == Payout.id)
+        .where(Payout.asset == asset, Payout.txid.in_(txids))
+        .group_by(Payout.txid, PayoutOutput.address)
+        .order_by(Payout.txid.collate("C"), PayoutOutput.address.collate("C"))
+        .execution_options(yield_per=FETCH_ROWS)
+    )
+    return iter(session.execute(stmt))
+
+
+def _unbalanced_journals(session:Session, asset:Asset, after:int, upto:int)->Iterator[Row]:
+    #journals com algum lancamento no intervalo, somados inteiros (as pernas podem cair dos dois lados do corte)
+    touched = select(LedgerEntry.journal_id).where(LedgerEntry.asset == asset, LedgerEntry.id > after, LedgerEntry.id <= upto)
+    stmt = (
+        select(LedgerEntry.journal_id, func.sum(LedgerEntry.amount).label("total"), func.min(LedgerEntry.ref_id).label("ref_id"))
+        .where(LedgerEntry.journal_id.in_(touched.scalar_subquery()))
+        .group_by(LedgerEntry.journal_id)
+        .having(func.sum(LedgerEntry.amount) != 0)
+        .execution_options(yield_per=FETCH_ROWS)
+    )
+    return iter(session.execute(stmt))
+
+
+class _Report:
+    #divergencias gravadas em lotes multi-linha, sem acumular a janela inteira
+    def __init__(self, session:Session, run_id:int, asset:Asset)->None:
+        self.session = session
+        self.run_id = run_id
+        self.asset = asset
+        self.pending:list[dict] = []
+        self.counts:dict[str,int] = {}
+
+    def add(self, kind:str, txid:str|None=None, vout:int|None=None, address:str|None=None, height:int|None=None,
+            wallet_amount:int|None=None, db_amount:int|None=None, detail:str|None=None)->None:
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        self.pending.append({
+            "run_id": self.run_id, "asset": self.asset, "kind": kind, "txid": txid, "vout": vout, "address": address,
+            "height": height, "wallet_amount": wallet_amount, "db_amount": db_amount, "detail": detail,
+        })
+        if len(self.pending) >= FLUSH_DISCREPANCIES:
+            self.flush()
+
+    def flush(self)->None:
+        if self.pending:
+            self.session.execute(insert(ReconciliationDiscrepancy), self.pending)
+            self.pending = []
+
+
+def reconcile_window(session:Session, asset:Asset, lo:int, hi:int, history:list[dict],
+                     ledger_after:int)->WindowResult:
+    """Concilia [lo, hi] e grava a janela (checkpoint) com as divergencias na transacao do chamador."""
+    started = datetime.now(timezone.utc)
+    run = ReconciliationRun(asset=asset, from_height=lo, to_height=hi, ledger_entry_id=ledger_after,
+                            started_at=started, finished_at=started)
+    session.add(run)
+    session.flush()
+    report = _Report(session, run.id, asset)
+
+    incoming = sorted((h for h in history if h["direction"] == "in"), key=lambda h: _key(h["txid"], h["vout"], h["address"]))
+    outgoing:dict[tuple[str,str],int] = {}
+    for h in history:
+        if h["direction"] == "out":
+            outgoing[(h["txid"], h["address"] or "")] = outgoing.get((h["txid"], h["address"] or ""), 0) + h["amount"]
+    sent_txids = {txid for txid, _ in outgoing}
+
+    db_items = 0
+    pairs = merge_join(incoming, _db_deposits(session, asset, lo, hi),
+                       lambda h: _key(h["txid"], h["vout"], h["address"]), lambda d: _key(d.txid, d.vout, d.destination))
+    for wallet, db in pairs:
+        if db is not None:
+            db_items += 1
+        if db is None:
+            #troco/saida para a propria carteira aparece como entrada da tx de payout
+            if wallet["txid"] not in sent_txids:
+                report.add("missing_in_db", wallet["txid"], wallet["vout"], wallet["address"], wallet["height"],
+                           wallet_amount=wallet["amount"])
+        elif wallet is None:
+            report.add("missing_in_wallet", db.txid, db.vout, db.destination, db.confirmed_height,
+                       db_amount=db.amount, detail=f"escrow {db.escrow_id}")
+        elif wallet["amount"] != db.amount:
+            report.add("amount_mismatch", db.txid, db.vout, db.destination, wallet["height"],
+                       wallet_amount=wallet["amount"], db_amount=db.amount, detail=f"escrow {db.escrow_id}")
+        elif wallet["height"] != db.confirmed_height:
+            report.add("height_mismatch", db.txid, db.vout, db.destination, wallet["height"],
+                       detail=f"escrow {db.escrow_id}: banco em {db.confirmed_height}")
+
+    if outgoing:
+        heights = {h["txid"]: h["height"] for h in history if h["direction"] == "out"}
+        sends = sorted(outgoing.items())
+        for wallet, db in merge_join(sends, _db_payout_outputs(session, asset, sorted(sent_txids)),
+                                     lambda s: s[0], lambda p: (p.txid, p.address)):
+            if db is not None:
+                db_items += 1
+            if db is None:
+                (txid, address), amount = wallet
+                report.add("unknown_send", txid, address=address or None, height=heights[txid], wallet_amount=amount)
+            elif wallet is None:
+                report.add("payout_not_in_wallet", db.txid, address=db.address, db_amount=db.amount)
+            elif wallet[1] != db.amount:
+                report.add("send_mismatch", db.txid, address=db.address, height=heights[db.txid],
+                           wallet_amount=wallet[1], db_amount=db.amount)
+
+    ledger_upto = ledger_watermark(session, asset, ledger_after)
+    if ledger_upto > ledger_after:
+        for journal in _unbalanced_journals(session, asset, ledger_after, ledger_upto):
+            report.add("unbalanced_journal", db_amount=journal.total, detail=f"journal {journal.journal_id} ({journal.ref_id})")
+
+    report.flush()
+    run.ledger_entry_id = ledger_upto
+    run.wallet_items = len(incoming) + len(outgoing)
+    run.db_items = db_items
+    run.discrepancies = sum(report.counts.values())
+    run.finished_at = datetime.now(timezone.utc)
+    return WindowResult(asset, lo, hi, run.wallet_items, db_items, report.counts)
+
+
+class Reconciler:
+    """Anda de janela em janela do checkpoint ate o tip seguro; depois dorme `interval`."""
+
+    def __init__(self, Session:sessionmaker, asset:Asset, port:ChainPort|WalletHistoryPort, window:int=WINDOW_BLOCKS,
+                 interval:float=INTERVAL_SECONDS)->None:
+        self.Session = Session
+        self.asset = asset
+        self.port = port
+        self.window = window
+        self.interval = interval
+
+    def _next(self, safe_tip:int)->tuple[int,int]:
+        #(primeira altura da proxima janela, ultimo id do ledger ja conferido)
+        with self.Session() as session:
+            checkpoint = load_checkpoint(session, self.asset)
+            if checkpoint is not None:
+                return checkpoint.height + 1, checkpoint.ledger_entry_id
+            start = start_height(self.asset)
+            if start is not None:
+                return start, 0
+            #sem altura inicial o historico fica de fora, inclusive o do ledger
+            return safe_tip, ledger_watermark(session, self.asset, 0)
+
+    async def run_once(self, stopping:Callable[[], bool]=lambda: False)->list[WindowResult]:
+        safe_tip = await self.port.get_tip_height() - confirmations_min(self.asset) + 1
+        results = []
+        while not stopping():
+            lo, ledger_after = await asyncio.to_thread(self._next, safe_tip)
+            if lo > safe_tip:
+                break
+            hi = min(lo + self.window - 1, safe_tip)
+            t0 = time.monotonic()
+            history = await self.port.list_history(lo, hi)
+            def work():
+                with self.Session.begin() as session:
+                    return reconcile_window(session, self.asset, lo, hi, history, ledger_after)
+            result = await asyncio.to_thread(work)
+            WINDOW_SECONDS.labels(self.asset.value).observe(time.monotonic() - t0)
+            RECONCILED_HEIGHT.labels(self.asset.value).set(hi)
+            for kind, n in result.discrepancies.items():
+                DISCREPANCIES.labels(self.asset.value, kind).inc(n)
+            (log.warning if result.discrepancies else log.info)(
+                "conciliacao %s [%d, %d]: %d itens da carteira, %d do banco, divergencias %s",
+                self.asset.value, lo, hi, result.wallet_items, result.db_items, result.discrepancies or "nenhuma")
+            results.append(result)
+        return results
+
+    async def run(self, runtime)->None:
+        while not runtime.stopping:
+            try:
+                await self.run_once(lambda: runtime.stopping)
+            except Exception:
+                log.exception("falha na conciliacao de %s", self.asset.value)
+            await runtime.sleep(self.interval)
@@ -0,0 +1,229 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Awaitable, Callable
+
+from redis.asyncio import Redis
+
+from adapters.metrics import REGISTRY, timer
+from domain.types import Asset
+
+log = logging.getLogger("worker.runtime")
+
+QUEUE_PREFIX = "jobs"
+DEAD_LETTER = f"{QUEUE_PREFIX}:dead"
+
+#Limites por ativo: um monero-wallet-rpc lento nao pode consumir os slots do BTC
+DEFAULT_CONCURRENCY = {
+    Asset.BTC: int(os.getenv("BTC_CONCURRENCY", "64")),
+    Asset.XMR: int(os.getenv("XMR_CONCURRENCY", "16")),
+}
+MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+
+JOB_SECONDS = REGISTRY.histogram("worker_job_seconds", "Duracao dos jobs por tipo", ("kind",))
+JOB_FAILURES = REGISTRY.counter("worker_job_failures_total", "Jobs que falharam (retry ou dead letter)", ("kind",))
+JOBS_INFLIGHT = REGISTRY.gauge("worker_jobs_inflight", "Jobs em execucao neste processo", ("asset",))
+QUEUE_DEPTH = REGISTRY.gauge("queue_depth", "Itens aguardando por fila", ("queue",))
+
+
+@dataclass
+class Job:
+    kind:str # deposit_watch, payout_sign, auto_release...
+    asset:Asset
+    payload:dict = field(default_factory=dict)
+    id:str = field(default_factory=lambda: uuid.uuid4().hex)
+    attempts:int = 0
+
+    def dumps(self)->str:
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def loads(cls, raw:str|bytes)->"Job":
+        data = json.loads(raw)
+        data["asset"] = Asset(data["asset"])
+        return cls(**data)
+
+
+Handler = Callable[[Job], Awaitable[None]]
+
+
+def queue_key(asset:Asset)->str:
+    return f"{QUEUE_PREFIX}:{asset.value}"
+
+
+def processing_key(asset:Asset, consumer:str)->str:
+    return f"{QUEUE_PREFIX}:{asset.value}:processing:{consumer}"
+
+
+def redis_from_env()->Redis:
+    return Redis(
+        host=os.getenv("REDIS_HOST", "redis"),
+        port=int(os.getenv("REDIS_PORT", "6379")),
+        db=int(os.getenv("REDIS_DB", "0")),
+    )
+
+
+async def requeue_processing(redis:Redis, consumer:str, assets=Asset)->int:
+    """Devolve para a fila o que estava na lista de processamento de `consumer` (LMOVE item a
+    item: dois nos drenando a mesma lista nunca duplicam um job)."""
+    moved = 0
+    for asset in assets:
+        src, dst = processing_key(asset, consumer), queue_key(asset)
+        while await redis.lmove(src, dst, "RIGHT", "RIGHT") is not None:
+            moved += 1
+    return moved
+
+
+async def enqueue(redis:Redis, job:Job)->None:
+    await redis.lpush(queue_key(job.asset), job.dumps())
+
+
+async def enqueue_many(redis:Redis, jobs:list[Job])->None:
+    async with redis.pipeline(transaction=False) as pipe:
+        for job in jobs:
+            pipe.lpush(queue_key(job.asset), job.dumps())
+        await pipe.execute()
+
+
+class WorkerRuntime:
+    """Fila de jobs no Redis com um limite de concorrencia por ativo.
+
+    Cada ativo tem seu semaforo e seu loop de consumo; o loop so tira um job da fila
+    (BLMOVE para a lista de processamento do consumidor) quando ha slot livre, entao a
+    contrapressao fica no Redis e nao na memoria do processo. Jobs que estavam em
+    processamento quando o worker morreu voltam para a fila no proximo start com o mesmo
+    WORKER_NAME ou, com nome novo, quando o cluster declara o no antigo morto (Cluster.heartbeat).
+    """
+
+    def __init__(self, redis:Redis, consumer:str|None=None, concurrency:dict[Asset,int]|None=None,
+                 shutdown_timeout:float=30.0)->None:
+        self.redis = redis
+        self.consumer = consumer or os.getenv("WORKER_NAME") or uuid.uuid4().hex[:8]
+        self.concurrency = concurrency or dict(DEFAULT_CONCURRENCY)
+        self.shutdown_timeout = shutdown_timeout
+        self._handlers:dict[str,Handler] = {}
+        self._background:list[Callable[[], Awaitable[None]]] = []
+        self._inflight:set[asyncio.Task] = set()
+        self._stopping = asyncio.Event()
+        self._running:dict[Asset,int] = {a: 0 for a in self.concurrency}
+        REGISTRY.collector(self.collect_metrics)
+
+    async def collect_metrics(self)->None:
+        keys = [queue_key(a) for a in self.concurrency] + [DEAD_LETTER]
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.llen(key)
+            depths = await pipe.execute()
+        for key, depth in zip(keys, depths):
+            QUEUE_DEPTH.labels(key).set(depth)
+        for asset, running in self._running.items():
+            JOBS_INFLIGHT.labels(asset.value).set(running)
+
+    def handler(self, kind:str)->Callable[[Handler], Handler]:
+        def register(fn:Handler)->Handler:
+            self._handlers[kind] = fn
+            return fn
+        return register
+
+    def background(self, fn:Callable[[], Awaitable[None]])->Callable[[], Awaitable[None]]:
+        #Corrotinas de longa duracao (ex: polling de tip) que rodam ate o shutdown
+        self._background.append(fn)
+        return fn
+
+    @property
+    def stopping(self)->bool:
+        return self._stopping.is_set()
+
+    def stop(self)->None:
+        self._stopping.set()
+
+    async def sleep(self, seconds:float)->None:
+        #sleep interrompido pelo shutdown
+        try:
+            await asyncio.wait_for(self._stopping.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self)->None:
+        loop = asyncio.get_running_loop()
+        #handlers sincronos (SQLAlchemy) rodam via to_thread: 1 thread por slot
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=sum(self.concurrency.values())))
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stop)
+
+        await self._recover()
+        tasks = [asyncio.create_task(self._consume(asset, limit)) for asset, limit in self.concurrency.items()]
+        tasks += [asyncio.create_task(fn()) for fn in self._background]
+        log.info("runtime %s online: %s", self.consumer, {a.value: n for a, n in self.concurrency.items()})
+
+        await self._stopping.wait()
+        log.info("shutdown: aguardando %d jobs em andamento", len(self._inflight))
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._inflight:
+            _, pending = await asyncio.wait(self._inflight, timeout=self.shutdown_timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        #O que foi cancelado continua na lista de processamento e volta para a fila
+        await self._recover()
+
+    async def _recover(self)->None:
+        moved = await requeue_processing(self.redis, self.consumer, self.concurrency)
+        if moved:
+            log.warning("%d jobs de %s devolvidos para a fila", moved, self.consumer)
+
+    async def _consume(self, asset:Asset, limit:int)->None:
+        slots = asyncio.Semaphore(limit)
+        src, processing = queue_key(asset), processing_key(asset, self.consumer)
+        while not self.stopping:
+            await slots.acquire()
+            try:
+                raw = await self.redis.blmove(src, processing, 1, "RIGHT", "LEFT")
+            except BaseException:
+                slots.release()
+                raise
+            if raw is None:
+                slots.release()
+                continue
+            task = asyncio.create_task(self._execute(asset, raw, processing))
+            self._inflight.add(task)
+            task.add_done_callback(lambda t: (self._inflight.discard(t), slots.release()))
+
+    async def _execute(self, asset:Asset, raw:bytes, processing:str)->None:
+        job:Job|None = None
+        self._running[asset] += 1
+        try:
+            #parse dentro do try: payload ilegivel vai para a dead-letter em vez de ficar em processing
+            job = Job.loads(raw)
+            handler = self._handlers.get(job.kind)
+            if handler is None:
+                raise LookupError(f"sem handler para job {job.kind}")
+            with timer(JOB_SECONDS, job.kind):
+                await handler(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            if job is None:
+                JOB_FAILURES.labels("invalid").inc()
+                log.exception("job invalido na fila %s: %r", asset.value, raw[:200])
+                target, body = DEAD_LETTER, raw
+            else:
+                JOB_FAILURES.labels(job.kind).inc()
+                job.attempts += 1
+                log.exception("job %s (%s) falhou, tentativa %d", job.id, job.kind, job.attempts)
+                target, body = DEAD_LETTER if job.attempts >= MAX_ATTEMPTS else queue_key(asset), job.dumps()
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.lrem(processing, 1, raw)
+                pipe.lpush(target, body)
+                await pipe.execute()
+            return
+        finally:
+            self._running[asset] -= 1
+        await self.redis.lrem(processing, 1, raw)
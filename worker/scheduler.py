@@ -0,0 +1,166 @@
+import logging
+import time
+from datetime import datetime, timezone
+
+from redis.asyncio import Redis
+from sqlalchemy import exists, select
+from sqlalchemy.orm import Session
+
+from db.escrow_transitions import transition_many
+from db.models import Dispute, Escrow
+from db.outbox import emit, escrow_event
+from domain.state_machine import Event
+from domain.types import Asset, DisputeStatus, EscrowState
+from worker.runtime import Job, enqueue_many
+
+log = logging.getLogger("worker.scheduler")
+
+DEADLINES_KEY = "deadlines:auto_release"
+DISPUTE_DEADLINES_KEY = "deadlines:dispute_window"
+
+#Remove e devolve atomicamente os membros vencidos (score <= agora)
+_POP_DUE = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #due > 0 then
+    redis.call('ZREM', KEYS[1], unpack(due))
+end
+return due
+"""
+
+
+def _member(escrow_id:int, asset:Asset)->str:
+    return f"{asset.value}:{escrow_id}"
+
+
+def _parse(member:bytes|str)->tuple[Asset,int]:
+    if isinstance(member, bytes):
+        member = member.decode()
+    asset, escrow_id = member.split(":", 1)
+    return Asset(asset), int(escrow_id)
+
+
+def _no_open_dispute():
+    return ~exists().where(Dispute.escrow_id == Escrow.id, Dispute.status == DisputeStatus.OPEN)
+
+
+class DeadlineScheduler:
+    """Prazos de um escrow num sorted set do Redis (score = epoch da coluna do prazo).
+
+    Uma instancia por prazo: auto_release_at (job auto_release) e dispute_deadline (job
+    dispute_window, ver dispute_scheduler). O sorted set e so um indice: ele e reconstruido
+    a partir de `escrows` no start e o job reconfere estado, prazo e disputa no banco, entao
+    uma entrada velha (delivered_at alterado, disputa aberta) nunca age indevidamente.
+    """
+
+    def __init__(self, redis:Redis, key:str=DEADLINES_KEY, batch:int=500, job:str="auto_release",
+                 column=Escrow.auto_release_at)->None:
+        self.redis = redis
+        self.key = key
+        self.batch = batch
+        self.job = job
+        self.column = column
+        self._pop_due = redis.register_script(_POP_DUE)
+
+    async def schedule(self, escrow_id:int, asset:Asset, at:datetime)->None:
+        #ZADD sobrescreve o score, entao reagendar apos mudar delivered_at e o mesmo comando
+        await self.redis.zadd(self.key, {_member(escrow_id, asset): at.timestamp()})
+
+    async def cancel(self, escrow_id:int, asset:Asset)->None:
+        await self.redis.zrem(self.key, _member(escrow_id, asset))
+
+    async def rebuild(self, session:Session, chunk:int=5000)->int:
+        #mescla no set vivo (ZUNIONSTORE) em vez de RENAME: o que a API agendou durante a
+        #leitura fica. Score MIN: disparar cedo so faz o job reagendar; sobra velha ele descarta
+        tmp = f"{self.key}:rebuild"
+        await self.redis.delete(tmp)
+        rows = session.execute(
+            select(Escrow.id, Escrow.asset, self.column)
+            .where(
+                Escrow.state == EscrowState.FUNDED,
+                self.column.is_not(None),
+                _no_open_dispute(),
+            )
+            .execution_options(yield_per=chunk)
+        )
+        total = 0
+        for part in rows.partitions():
+            await self.redis.zadd(tmp, {_member(i, a): at.timestamp() for i, a, at in part})
+            total += len(part)
+        if total:
+            await self.redis.zunionstore(self.key, [self.key, tmp], aggregate="MIN")
+            await self.redis.delete(tmp)
+        return total
+
+    async def pop_due(self, now:float|None=None)->list[tuple[Asset,int]]:
+        due = await self._pop_due(keys=[self.key], args=[now or time.time(), self.batch])
+        return [_parse(m) for m in due]
+
+    async def run(self, runtime, interval:float=0.5)->None:
+        #Um job por ativo com o lote de escrows vencidos
+        while not runtime.stopping:
+            due = await self.pop_due()
+            if not due:
+                await runtime.sleep(interval)
+                continue
+            by_asset:dict[Asset,list[int]] = {}
+            for asset, escrow_id in due:
+                by_asset.setdefault(asset, []).append(escrow_id)
+            await enqueue_many(self.redis, [Job(self.job, a, {"escrow_ids": ids}) for a, ids in by_asset.items()])
+            log.info("%s enfileirado para %d escrows", self.job, len(due))
+
+
+def dispute_scheduler(redis:Redis, batch:int=500)->DeadlineScheduler:
+    return DeadlineScheduler(redis, DISPUTE_DEADLINES_KEY, batch, job="dispute_window", column=Escrow.dispute_deadline)
+
+
+def release_due_escrows(session:Session, escrow_ids:list[int])->list[int]:
+    #Um UPDATE para o lote todo; reconfere estado FUNDED, prazo vencido e nenhuma disputa aberta
+    escrows = transition_many(
+        session, Event.AUTO_RELEASE, escrow_ids,
+        where=(Escrow.auto_release_at <= datetime.now(timezone.utc), _no_open_dispute()),
+    )
+    return [e.id for e in escrows]
+
+
+def pending_deadlines(session:Session, escrow_ids:list[int])->list[tuple[int,Asset,datetime]]:
+    #Continuam elegiveis e voltam pro sorted set: prazo adiado (delivered_at mudou) ou
+    #linha travada por outra transicao no momento do lote (SKIP LOCKED), que tenta de novo
+    return list(session.execute(
+        select(Escrow.id, Escrow.asset, Escrow.auto_release_at)
+        .where(
+            Escrow.id.in_(escrow_ids),
+            Escrow.state == EscrowState.FUNDED,
+            Escrow.auto_release_at.is_not(None),
+            _no_open_dispute(),
+        )
+    ).tuples())
+
+
+def close_dispute_windows(session:Session, escrow_ids:list[int])->list[int]:
+    """Janela de disputa vencida: a partir daqui POST /disputes e recusado (o UPDATE do endpoint
+    confere dispute_deadline) e o escrow so espera o auto-release. Avisa pela outbox quem
+    continua FUNDED sem disputa; o resto (liberado, disputado, prazo adiado) e ignorado."""
+    escrows = list(session.scalars(
+        select(Escrow)
+        .where(
+            Escrow.id.in_(escrow_ids),
+            Escrow.state == EscrowState.FUNDED,
+            Escrow.dispute_deadline <= datetime.now(timezone.utc),
+            ~exists().where(Dispute.escrow_id == Escrow.id),
+        )
+    ))
+    emit(session, [escrow_event("escrow.dispute_window_closed", e) for e in escrows])
+    return [e.id for e in escrows]
+
+
+def pending_dispute_windows(session:Session, escrow_ids:list[int])->list[tuple[int,Asset,datetime]]:
+    #prazo adiado (delivered_at mudou): volta pro sorted set com o novo dispute_deadline
+    return list(session.execute(
+        select(Escrow.id, Escrow.asset, Escrow.dispute_deadline)
+        .where(
+            Escrow.id.in_(escrow_ids),
+            Escrow.state == EscrowState.FUNDED,
+            Escrow.dispute_deadline > datetime.now(timezone.utc),
+            _no_open_dispute(),
+        )
+    ).tuples())
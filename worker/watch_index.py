@@ -0,0 +1,70 @@
+"""Match de saidas on-chain com os destinos dos escrows e upsert dos depositos.
+
+As entradas ja chegam filtradas pela carteira (listsinceblock da watch-only com os
+descriptors de deposito, get_transfers das subaddresses, webhooks do watcher), entao o
+match e um SELECT ... IN por lote no indice unico de escrow_destinations.destination.
+"""
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from db.escrow_view import mark_dirty
+from db.models import Deposit, EscrowDestination
+from domain.types import Asset, DepositStatus
+
+
+def owned_deposit_rows(session:Session, outputs:list[tuple[Asset,dict]])->tuple[list[dict],list[dict]]:
+    """Saidas no formato do payload DEPOSIT {txid, vout, address, amount, height} -> linhas de
+    Deposit dos destinos conhecidos (um SELECT para o lote). Devolve (linhas, sem_dono)."""
+    owners = dict(session.execute(
+        select(EscrowDestination.destination, EscrowDestination.escrow_id)
+        .where(EscrowDestination.destination.in_({p["address"] for _, p in outputs}))
+    ).all())
+    rows, unknown = [], []
+    for asset, p in outputs:
+        escrow_id = owners.get(p["address"])
+        if escrow_id is None:
+            unknown.append(p)
+            continue
+        rows.append({
+            "escrow_id": escrow_id, "asset": asset, "txid": p["txid"], "vout": p.get("vout"),
+            "destination": p["address"], "amount": int(p["amount"]), "confirmed_height": p.get("height"),
+            "confirmations_current": 0, "status": DepositStatus.PENDING,
+        })
+    return rows, unknown
+
+
+def _upsert(session:Session, rows:list[dict], key:tuple[str,...], where=None)->list[tuple[str,int|None,datetime]]:
+    #um INSERT ... ON CONFLICT nao pode tocar a mesma linha duas vezes: uma linha por chave, a do bloco se houver
+    unique:dict[tuple,dict] = {}
+    for r in rows:
+        k = tuple(r[c] for c in key)
+        if k not in unique or unique[k]["confirmed_height"] is None:
+            unique[k] = r
+    stmt = pg_insert(Deposit).values(list(unique.values()))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(key),
+        index_where=where,
+        set_={"confirmed_height": stmt.excluded.confirmed_height},
+        where=Deposit.confirmed_height.is_(None) & stmt.excluded.confirmed_height.is_not(None),
+    ).returning(Deposit.txid, Deposit.vout, Deposit.first_seen_at)
+    return session.execute(stmt).all()
+
+
+def upsert_deposits(session:Session, rows:list[dict])->list[tuple[str,int|None,datetime]]:
+    #Mesmo output visto no mempool e depois no bloco: so preenche confirmed_height.
+    #BTC colide em (txid, vout); XMR (vout NULL) em (txid, destino), uq_deposits_txid_destination_novout.
+    #Devolve (txid, vout, first_seen_at) das linhas inseridas ou atualizadas
+    if not rows:
+        return []
+    mark_dirty(session, {r["escrow_id"] for r in rows})
+    outputs = [r for r in rows if r["vout"] is not None]
+    transfers = [r for r in rows if r["vout"] is None]
+    done = []
+    if outputs:
+        done += _upsert(session, outputs, ("txid", "vout"))
+    if transfers:
+        done += _upsert(session, transfers, ("txid", "destination"), Deposit.vout.is_(None))
+    return done
@@ -0,0 +1,219 @@
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Callable
+
+from sqlalchemy import case, func, insert, literal, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session, sessionmaker
+
+from adapters.metrics import LAG_BUCKETS, REGISTRY
+from db.models import WebhookEvent, WebhookEventKey
+from domain.types import Asset
+from worker.watch_index import owned_deposit_rows, upsert_deposits
+
+log = logging.getLogger("worker.webhooks")
+
+#handler recebe o lote inteiro de um kind, dentro da transacao que segura os locks
+BatchHandler = Callable[[Session, list[WebhookEvent]], None]
+
+MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "5"))
+
+DETECTION_LAG = REGISTRY.histogram(
+    "deposit_detection_lag_seconds", "first_seen_at do deposito menos o horario do bloco", ("asset",), LAG_BUCKETS)
+WEBHOOK_BACKLOG = REGISTRY.gauge("webhook_backlog", "webhook_events nao processados e idade do mais antigo", ("measure",))
+WEBHOOK_DEAD = REGISTRY.counter("webhook_dead_letters_total", "Webhooks movidos para a dead-letter", ("kind", "reason"))
+
+
+def record_event(session:Session, provider:str, kind:str, idempotency_key:str, payload:dict)->int|None:
+    """Grava um webhook recebido; None se (idempotency_key, kind) ja foi visto.
+    A chave entra em webhook_event_keys e o evento so e inserido se ela for nova, num statement so."""
+    now = datetime.now(timezone.utc)
+    key = (
+        pg_insert(WebhookEventKey)
+        .values(idempotency_key=idempotency_key, kind=kind, received_at=now)
+        .on_conflict_do_nothing()
+        .returning(WebhookEventKey.received_at)
+        .cte("new_key")
+    )
+    stmt = insert(WebhookEvent).from_select(
+        ["provider", "kind", "idempotency_key", "payload", "processed", "received_at"],
+        select(literal(provider), literal(kind), literal(idempotency_key),
+               literal(payload, WebhookEvent.payload.type), literal(False), key.c.received_at),
+    ).returning(WebhookEvent.id)
+    return session.execute(stmt).scalar()
+
+
+def claim_batch(session:Session, limit:int)->list[WebhookEvent]:
+    #SKIP LOCKED: cada consumidor pega linhas diferentes sem esperar os outros
+    return list(session.scalars(
+        select(WebhookEvent)
+        .where(WebhookEvent.processed.is_(False), WebhookEvent.dead_at.is_(None))
+        .order_by(WebhookEvent.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    ))
+
+
+def mark_processed(session:Session, ids:list[int])->None:
+    session.execute(
+        update(WebhookEvent)
+        .where(WebhookEvent.id.in_(ids))
+        .values(processed=True, processed_at=datetime.now(timezone.utc))
+        .execution_options(synchronize_session=False)
+    )
+
+
+def handle_deposits(session:Session, events:list[WebhookEvent])->None:
+    """Payload DEPOSIT: {txid, vout, address, amount, height, blocktime?}. Um SELECT para os
+    destinos do lote e um upsert para todos os depositos."""
+    rows, unknown = owned_deposit_rows(session, [(Asset(e.provider), e.payload) for e in events])
+    for p in unknown:
+        log.warning("webhook %s:%s: destino desconhecido %s", p["txid"], p.get("vout"), p["address"])
+    blocktimes = {
+        (e.payload["txid"], e.payload.get("vout")): (e.provider, e.payload["blocktime"])
+        for e in events if e.payload.get("blocktime")
+    }
+    for txid, vout, first_seen_at in upsert_deposits(session, rows):
+        #visto no mempool antes do bloco: atraso zero
+        seen = blocktimes.get((txid, vout))
+        if seen is not None:
+            DETECTION_LAG.labels(seen[0]).observe(max(first_seen_at.timestamp() - seen[1], 0.0))
+
+
+DEFAULT_HANDLERS:dict[str,BatchHandler] = {"DEPOSIT": handle_deposits}
+
+
+def record_failure(session:Session, events:list[WebhookEvent], error:str, dead:bool=False)->int:
+    """Conta uma falha nos eventos; os que chegam a MAX_ATTEMPTS (ou `dead`) vao para a
+    dead-letter e saem da fila. Devolve quantos foram."""
+    now = datetime.now(timezone.utc)
+    attempts = WebhookEvent.attempts + 1
+    rows = session.execute(
+        update(WebhookEvent)
+        .where(WebhookEvent.id.in_([e.id for e in events]))
+        .values(attempts=attempts, last_error=error[:2000],
+                dead_at=now if dead else case((attempts >= MAX_ATTEMPTS, now), else_=None))
+        .returning(WebhookEvent.id, WebhookEvent.kind, WebhookEvent.dead_at)
+        .execution_options(synchronize_session=False)
+    ).all()
+    dead_rows = [r for r in rows if r.dead_at is not None]
+    for r in dead_rows:
+        WEBHOOK_DEAD.labels(r.kind, "no_handler" if dead else "handler_error").inc()
+        log.error("webhook %d (%s) na dead-letter: %s", r.id, r.kind, error)
+    return len(dead_rows)
+
+
+def _handle(session:Session, handler:BatchHandler, events:list[WebhookEvent])->list[WebhookEvent]:
+    #lote do kind num savepoint; se falhar, evento a evento para isolar o envenenado. Devolve os que passaram
+    if len(events) > 1:
+        try:
+            with session.begin_nested():
+                handler(session, events)
+            return events
+        except Exception:
+            log.warning("lote de %d webhooks %s falhou; reprocessando um a um", len(events), events[0].kind, exc_info=True)
+    done = []
+    for e in events:
+        try:
+            with session.begin_nested():
+                handler(session, [e])
+            done.append(e)
+        except Exception as error:
+            log.exception("webhook %d (%s) falhou", e.id, e.kind)
+            record_failure(session, [e], f"{type(error).__name__}: {error}")
+    return done
+
+
+def process_batch(Session:sessionmaker, handlers:dict[str,BatchHandler], limit:int)->int:
+    #um evento que falha nao derruba o lote: fica na fila com attempts+1 ate a dead-letter
+    with Session.begin() as session:
+        events = claim_batch(session, limit)
+        if not events:
+            return 0
+        by_kind:dict[str,list[WebhookEvent]] = {}
+        for e in events:
+            by_kind.setdefault(e.kind, []).append(e)
+        done = []
+        for kind, group in by_kind.items():
+            handler = handlers.get(kind)
+            if handler is None:
+                record_failure(session, group, f"sem handler para {kind}", dead=True)
+                continue
+            done += _handle(session, handler, group)
+        if done:
+            mark_processed(session, [e.id for e in done])
+        return len(events)
+
+
+def queue_lag(session:Session)->tuple[int,float]:
+    #(eventos pendentes, idade em segundos do mais antigo)
+    count, oldest = session.execute(
+        select(func.count(), func.min(WebhookEvent.received_at))
+        .where(WebhookEvent.processed.is_(False), WebhookEvent.dead_at.is_(None))
+    ).one()
+    age = (datetime.now(timezone.utc) - oldest).total_seconds() if oldest else 0.0
+    return count, age
+
+
+@dataclass
+class ConsumerStats:
+    processed:int = 0
+    batches:int = 0
+    started:float = field(default_factory=time.monotonic)
+    backlog:int = 0
+    lag_seconds:float = 0.0
+
+    @property
+    def throughput(self)->float:
+        elapsed = time.monotonic() - self.started
+        return self.processed / elapsed if elapsed > 0 else 0.0
+
+
+class WebhookConsumerPool:
+    """N consumidores concorrentes drenando webhook_events com FOR UPDATE SKIP LOCKED.
+
+    Cada lote e reivindicado, processado e marcado processed na mesma transacao, entao
+    varios processos podem rodar o pool ao mesmo tempo sem processar um evento duas vezes.
+    """
+
+    def __init__(self, Session:sessionmaker, handlers:dict[str,BatchHandler]|None=None,
+                 consumers:int=4, batch:int=200, idle:float=0.5)->None:
+        self.Session = Session
+        self.handlers = handlers or dict(DEFAULT_HANDLERS)
+        self.consumers = consumers
+        self.batch = batch
+        self.idle = idle
+        self.stats = ConsumerStats()
+
+    async def _consume(self, runtime)->None:
+        while not runtime.stopping:
+            try:
+                n = await asyncio.to_thread(process_batch, self.Session, self.handlers, self.batch)
+            except Exception:
+                log.exception("falha processando lote de webhooks")
+                n = 0
+            if n:
+                self.stats.processed += n
+                self.stats.batches += 1
+            else:
+                await runtime.sleep(self.idle)
+
+    async def _report(self, runtime, every:float)->None:
+        while not runtime.stopping:
+            await runtime.sleep(every)
+            with self.Session() as session:
+                self.stats.backlog, self.stats.lag_seconds = await asyncio.to_thread(queue_lag, session)
+            WEBHOOK_BACKLOG.labels("pending").set(self.stats.backlog)
+            WEBHOOK_BACKLOG.labels("oldest_seconds").set(self.stats.lag_seconds)
+            log.info("webhooks: %.1f ev/s, %d pendentes, lag %.1fs",
+                     self.stats.throughput, self.stats.backlog, self.stats.lag_seconds)
+
+    async def run(self, runtime, report_every:float=30.0)->None:
+        await asyncio.gather(
+            *(self._consume(runtime) for _ in range(self.consumers)),
+            self._report(runtime, report_every),
+        )